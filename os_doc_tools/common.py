@@ -16,6 +16,7 @@
 Common functions for os_doc_tools.
 '''
 
+import os
 import subprocess
 
 
@@ -39,3 +40,31 @@ def check_output(*popenargs, **kwargs):
             cmd = popenargs[0]
         raise subprocess.CalledProcessError(retcode, cmd, output=output)
     return output
+
+
+def write_file_atomically(path, data):
+    """Replace the content of path by data.
+
+    The data is written to a temporary file next to path that is then
+    renamed, so that an interrupted run does not leave a broken file
+    behind. Missing directories are created. Raises IOError or OSError
+    if the file cannot be written.
+    """
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Created by another process in the meantime.
+            if not os.path.isdir(directory):
+                raise
+    tmp_file = "%s.%d" % (path, os.getpid())
+    try:
+        with open(tmp_file, 'w') as fp:
+            fp.write(data)
+        os.rename(tmp_file, path)
+    except (IOError, OSError):
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
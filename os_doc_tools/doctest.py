@@ -31,23 +31,37 @@ Requires:
     - Maven
 '''
 
+import collections
+import fcntl
+import filecmp
 import gzip
+import hashlib
+import heapq
+import json
 import multiprocessing
 import operator
 import os
 import re
 import shutil
+import socket
+import SocketServer
+import StringIO
 import subprocess
 import sys
 import time
-import urllib2
 
 from lxml import etree
 from oslo.config import cfg
 
 import os_doc_tools
-from os_doc_tools.common import check_output   # noqa
+from os_doc_tools import doctest_client
+from os_doc_tools import gitstate
 from os_doc_tools import jsoncheck
+from os_doc_tools import linkcheck
+from os_doc_tools import results
+from os_doc_tools import scheduler
+from os_doc_tools import watcher
+from os_doc_tools.common import write_file_atomically
 from os_doc_tools.openstack.common import log
 
 
@@ -68,14 +82,53 @@ BOOK_EXCEPTIONS = []
 # --url-exception.
 URL_EXCEPTIONS = []
 
+# Number of last lines of the build output of a book that are kept in
+# memory and reported if the build fails, see BuildLog.
+BUILD_LOG_TAIL_LINES = 200
+
+# Start of the execution of a Maven goal in the build output.
+MAVEN_GOAL_RE = re.compile(br'\[INFO\] --- (\S+)')
+
 # Mappings from books to build directories under target
 BOOK_MAPPINGS = {}
 
 # Mappings from books to publish directories
 BOOK_PUBLISH_MAPPINGS = {}
 
+# Books that are built several times with different profiling. Each
+# variant has a name, a label, the operating system and the profiling
+# of the build. Variants are built in parallel in copies of the book
+# directory, see get_variant_dir, and published together.
+BOOK_VARIANTS = {
+    'install-guide': collections.OrderedDict([
+        ('debian', ("Debian", "apt-debian", "debian")),
+        ('fedora', ("Fedora", "yum", "centos;fedora;rhel")),
+        ('opensuse', ("openSUSE", "zypper", "opensuse;sles")),
+        ('ubuntu', ("Ubuntu", "apt", "ubuntu")),
+    ]),
+}
+
 RESULTS_OF_BUILDS = []
 
+# Machine readable results of all checks, opened in handle_options.
+RESULTS = results.ResultsWriter()
+
+# Snapshot of the tested git repository, see get_repository_state.
+REPO_STATE = None
+
+# Entity files of the books, set from the BookScan of the affected
+# books, see get_shared_build_inputs.
+ENTITY_FILES = None
+
+# Attributes of XML files that are not DocBook, like WADL and XSD files,
+# that reference other files.
+INPUT_REFERENCE_XPATH = '//@href | //@fileref | //@schemaLocation'
+# Start of a URL with a scheme, such references are no local files.
+URL_SCHEME_RE = re.compile(r'^[a-zA-Z][a-zA-Z0-9+.-]*:')
+
+# ioctl of Linux to share the data blocks of two files, see clone_file.
+FICLONE = 0x40049409
+
 # List of recognized (allowable) os profiling directives.
 KNOWN_OS_VALUES = ["debian",
                    "centos",
@@ -92,6 +145,11 @@ KNOWN_AUDIENCE_VALUES = ["enduser",
                          "installer",
                          "webpage"]
 
+# Profiling attributes checked by verify_profiling with their known
+# values.
+PROFILING_ATTRIBUTES = [("os", KNOWN_OS_VALUES),
+                        ("audience", KNOWN_AUDIENCE_VALUES)]
+
 OS_DOC_TOOLS_DIR = os.path.dirname(__file__)
 # NOTE(jaegerandi): BASE_RNG needs to end with '/', otherwise
 # the etree.parse call in get_wadl_schema will fail.
@@ -104,14 +162,36 @@ WADL_XSD = os.path.join(BASE_RNG, 'wadl.xsd')
 SCRIPTS_DIR = os.path.join(OS_DOC_TOOLS_DIR, 'scripts')
 
 
+# Compiled schemas by URL, see load_schema.
+SCHEMAS = {}
+
+# Seconds needed for compiling each schema in SCHEMAS.
+SCHEMA_TIMINGS = {}
+
+
+def load_schema(url, schema_class, base_url=None):
+    """Return schema_class compiled from url.
+
+    Compiling a schema takes several seconds, thus each schema is only
+    compiled once per process. Processes forked after compiling share
+    the compiled schema.
+    """
+
+    if url not in SCHEMAS:
+        start = time.time()
+        schema_doc = etree.parse(url, base_url=base_url)
+        SCHEMAS[url] = schema_class(schema_doc)
+        SCHEMA_TIMINGS[url] = time.time() - start
+    return SCHEMAS[url]
+
+
 def get_schema(is_api_site=False):
     """Return the DocBook RELAX NG schema."""
     if is_api_site:
         url = RACKBOOK_RNG
     else:
         url = DOCBOOKXI_RNG
-    relaxng_doc = etree.parse(url)
-    return etree.RelaxNG(relaxng_doc)
+    return load_schema(url, etree.RelaxNG)
 
 
 def get_wadl_schema():
@@ -122,9 +202,319 @@ def get_wadl_schema():
     # url = WADL_RNG
     # relaxng_doc = etree.parse(url, base_url=BASE_RNG)
     # return etree.RelaxNG(relaxng_doc)
-    url = WADL_XSD
-    schema = etree.parse(url, base_url=BASE_RNG)
-    return etree.XMLSchema(schema)
+    return load_schema(WADL_XSD, etree.XMLSchema, base_url=BASE_RNG)
+
+
+def print_schema_timings():
+    """Print time needed for compiling schemas in this process."""
+
+    for url, seconds in sorted(SCHEMA_TIMINGS.items()):
+        print("Compiled schema %s in %.2f seconds." %
+              (os.path.basename(url), seconds))
+
+
+# Maximal number of parsed documents kept in DOC_CACHE.
+DOC_CACHE_SIZE = 256
+
+# Elements that reference other files, these are followed for
+# dependencies of books and for checking of deleted files.
+REFERENCE_XPATH = ('//docbook:imagedata | //xi:include | '
+                   '//wadl:resource | //wadl:resources')
+REFERENCE_NS = {"docbook": "http://docbook.org/ns/docbook",
+                "xi": "http://www.w3.org/2001/XInclude",
+                "wadl": "http://wadl.dev.java.net/2009/02"}
+REFERENCE_TAGS = ('{http://docbook.org/ns/docbook}imagedata',
+                  '{http://www.w3.org/2001/XInclude}include',
+                  '{http://wadl.dev.java.net/2009/02}resource',
+                  '{http://wadl.dev.java.net/2009/02}resources')
+# Start tag of any element of REFERENCE_TAGS with or without a namespace
+# prefix.
+REFERENCE_START_TAG_RE = re.compile(
+    br'<(?:[\w.-]+:)?(?:imagedata|include|resources?)[\s/>]')
+
+
+def get_reference(node, root):
+    """Return reference of a node matching REFERENCE_TAGS.
+
+    Returns a tuple (kind, href, absolute path of href) with kind
+    being one of 'imagedata', 'xinclude' or 'wadl'. The href is
+    relative to the directory root. Returns None if the node has no
+    reference.
+    """
+
+    if node.tag == '{http://docbook.org/ns/docbook}imagedata':
+        kind = 'imagedata'
+        href = node.get('fileref')
+    elif node.tag == '{http://www.w3.org/2001/XInclude}include':
+        kind = 'xinclude'
+        href = node.get('href')
+    else:
+        # wadl:resources either have a href directly or a child
+        # wadl:resource that has a href.
+        kind = 'wadl'
+        href = node.get('href')
+        if href:
+            hash_sign = href.rfind('#')
+            if hash_sign != -1:
+                href = href[:hash_sign]
+    if not href:
+        return None
+    return (kind, href, os.path.abspath(os.path.join(root, href)))
+
+
+def get_references(doc, path):
+    """Return list of files referenced by the parsed doc of path.
+
+    Each entry is a tuple as returned by get_reference.
+    """
+
+    root = os.path.dirname(path)
+    references = []
+    for node in doc.xpath(REFERENCE_XPATH, namespaces=REFERENCE_NS):
+        reference = get_reference(node, root)
+        if reference is not None:
+            references.append(reference)
+    return references
+
+
+def extract_references(path):
+    """Return list of files referenced by path.
+
+    Returns the same list as get_references for the parsed path. Files
+    that do not reference any other file are recognized with a text
+    search for the start tags of REFERENCE_TAGS and are not parsed at
+    all, such files are not checked to be valid XML.
+
+    Raises etree.XMLSyntaxError if the file is not valid XML.
+    """
+
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    if not REFERENCE_START_TAG_RE.search(data):
+        return []
+    return get_references(etree.fromstring(data), path)
+
+
+def get_file_hash(path):
+    """Return SHA-1 hex digest of the content of path."""
+
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(65536), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class DocumentCache(object):
+    """Cache of parsed XML files.
+
+    Parsed documents are shared between the checks so that each file is
+    only parsed once. Entries are keyed by path and are invalid once
+    modification time or size of the file change. Only the last
+    max_docs documents are kept, the much smaller list of references of
+    each document (see get_references) is kept for all files. Files that
+    are only needed for their references are scanned with
+    extract_references instead.
+
+    The references together with the content hash of each file and the
+    book master files of each book can be stored in an index file
+    between runs. After loading the index, only files whose content
+    changed need to be parsed again.
+    """
+
+    # Version of the index file format, increase on incompatible changes.
+    INDEX_VERSION = 1
+
+    def __init__(self, max_docs=DOC_CACHE_SIZE):
+        self.max_docs = max_docs
+        self.docs = collections.OrderedDict()
+        self.references = {}
+        self.hashes = {}
+        self.book_bk = {}
+        self.referenced_by = {}
+        self.parses = 0
+        self.scans = 0
+        self.hits = 0
+        self.reference_hits = 0
+
+    @staticmethod
+    def _stat_key(path):
+        st = os.stat(path)
+        return (st.st_mtime, st.st_size)
+
+    def parse(self, path):
+        """Return parsed document for path.
+
+        Raises etree.XMLSyntaxError if the file is not valid XML.
+        """
+
+        path = os.path.abspath(path)
+        key = self._stat_key(path)
+        entry = self.docs.pop(path, None)
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            self.docs[path] = entry
+            return entry[1]
+
+        self.parses += 1
+        doc = etree.parse(path)
+        self.docs[path] = (key, doc)
+        if len(self.docs) > self.max_docs:
+            self.docs.popitem(last=False)
+        self.references[path] = (key, get_references(doc, path))
+        self.hashes.pop(path, None)
+        return doc
+
+    def get_references(self, path):
+        """Return list of files referenced by path, see get_references.
+
+        Raises etree.XMLSyntaxError if the file is not valid XML.
+        """
+
+        path = os.path.abspath(path)
+        entry = self.references.get(path)
+        if entry is not None:
+            key = self._stat_key(path)
+            if entry[0] == key:
+                self.reference_hits += 1
+                return entry[1]
+            # Files get new modification times for example by a git
+            # checkout, the content might still be the same.
+            if (path in self.hashes and
+                    self.hashes[path] == get_file_hash(path)):
+                self.reference_hits += 1
+                self.references[path] = (key, entry[1])
+                return entry[1]
+        else:
+            key = self._stat_key(path)
+
+        self.scans += 1
+        references = extract_references(path)
+        self.references[path] = (key, references)
+        self.hashes.pop(path, None)
+        return references
+
+    def add_references(self, path, entry):
+        """Add entry for path as returned by get_references_entry."""
+
+        if entry is not None:
+            path = os.path.abspath(path)
+            self.references[path] = entry
+            self.hashes.pop(path, None)
+
+    def get_references_entry(self, path):
+        """Return cached references entry of path for add_references."""
+
+        return self.references.get(os.path.abspath(path))
+
+    def get_referenced_by(self, rootdir, file_exceptions):
+        """Return the files referencing each file below rootdir.
+
+        Returns a tuple of a dictionary and of the number of scanned XML
+        files. The dictionary maps the absolute path of each referenced
+        file to a list of tuples (path, kind, href) of the references
+        to it, see get_references. The tree is only scanned on the first
+        call for rootdir, references of unchanged files are taken from
+        the index.
+        """
+
+        key = (rootdir, tuple(sorted(file_exceptions)))
+        if key in self.referenced_by:
+            return self.referenced_by[key]
+
+        referenced_by = {}
+        no_files = 0
+        for root, dirs, files in os.walk(rootdir):
+            dirs[:] = filter_dirs(dirs)
+            for f in files:
+                if not is_testable_xml_file(f, file_exceptions):
+                    continue
+                path = os.path.abspath(os.path.join(root, f))
+                try:
+                    references = self.get_references(path)
+                except etree.XMLSyntaxError as e:
+                    print(" Warning: file %s is invalid XML: %s" % (path, e))
+                    continue
+                no_files += 1
+                for kind, href, href_abs in references:
+                    referenced_by.setdefault(href_abs, []).append(
+                        (path, kind, href))
+        self.referenced_by[key] = (referenced_by, no_files)
+        return referenced_by, no_files
+
+    def load_index(self, index_file, rootdir):
+        """Load references and book masters of files below rootdir."""
+
+        try:
+            with open(index_file, 'r') as fp:
+                index = json.load(fp)
+        except (IOError, ValueError):
+            return
+        if index.get('version') != self.INDEX_VERSION:
+            return
+
+        for rel, entry in index['files'].items():
+            path = os.path.join(rootdir, rel)
+            root = os.path.dirname(path)
+            references = [
+                (kind, href, os.path.abspath(os.path.join(root, href)))
+                for kind, href in entry['references']]
+            self.references[path] = ((entry['mtime'], entry['size']),
+                                     references)
+            self.hashes[path] = entry['sha1']
+        for rel, book in index['book_bk'].items():
+            self.book_bk[os.path.join(rootdir, rel)] = os.path.join(rootdir,
+                                                                    book)
+
+    def save_index(self, index_file, rootdir):
+        """Save references and book masters of files below rootdir.
+
+        Entries of files that no longer exist or that changed since they
+        were parsed are dropped.
+        """
+
+        files = {}
+        prefix = os.path.join(rootdir, '')
+        for path, (key, references) in self.references.items():
+            if not path.startswith(prefix):
+                continue
+            try:
+                if self._stat_key(path) != key:
+                    continue
+                sha1 = self.hashes.get(path) or get_file_hash(path)
+            except (IOError, OSError):
+                continue
+            self.hashes[path] = sha1
+            files[os.path.relpath(path, rootdir)] = {
+                'mtime': key[0],
+                'size': key[1],
+                'sha1': sha1,
+                'references': [[kind, href]
+                               for kind, href, _ in references]}
+        book_bk = dict((os.path.relpath(path, rootdir),
+                        os.path.relpath(book, rootdir))
+                       for path, book in self.book_bk.items()
+                       if path.startswith(prefix) and os.path.isfile(path))
+
+        index = {'version': self.INDEX_VERSION,
+                 'files': files,
+                 'book_bk': book_bk}
+        try:
+            write_file_atomically(index_file, json.dumps(index))
+        except (IOError, OSError) as e:
+            print("Warning: cannot write index file %s: %s" %
+                  (index_file, e))
+
+    def print_statistics(self):
+        """Print usage statistics of the cache."""
+
+        print("Document cache: %d files parsed, %d files scanned for "
+              "references, %d parsed documents reused, %d reference lists "
+              "reused." % (self.parses, self.scans, self.hits,
+                           self.reference_hits))
+
+
+DOC_CACHE = DocumentCache()
 
 
 def validation_failed(schema, doc):
@@ -161,165 +551,216 @@ def verify_attribute_profiling(doc, attribute, known_values):
     supported profiling values.
     """
 
-    msg = []
-    ns = {"docbook": "http://docbook.org/ns/docbook"}
-    path = '//docbook:*[@%s]' % attribute
-    for parent in doc.xpath(path, namespaces=ns):
-        p_tag = parent.tag
-        p_line = parent.sourceline
-        p_att_list = parent.attrib[attribute].split(';')
-
-        for att in p_att_list:
-            if att not in known_values:
-                msg.append(
-                    "'%s' is not a recognized %s profile on line %d." %
-                    (att, attribute, p_line))
-
-        cpath = './/docbook:*[@%s]' % attribute
-        for child in parent.xpath(cpath, namespaces=ns):
-            c_tag = child.tag
-            c_line = child.sourceline
-            c_att_list = child.attrib[attribute].split(';')
-            for att in c_att_list:
-                if att not in p_att_list:
-                    len_ns = len("{http://docbook.org/ns/docbook}")
-                    msg.append(
-                        "%s %s profiling (%s) conflicts with %s "
-                        "profiling of %s on line %d." %
-                        (p_tag[len_ns:], attribute, p_att_list,
-                         attribute, c_tag[len_ns:], c_line))
-    if len(msg) > 0:
-        raise ValueError("\n     ".join(msg))
+    verify_profiling(doc, [(attribute, known_values)])
 
 
-def verify_profiling(doc):
-    """"Check profiling information."""
-    verify_attribute_profiling(doc, "os", KNOWN_OS_VALUES)
-    verify_attribute_profiling(doc, "audience", KNOWN_AUDIENCE_VALUES)
+def verify_profiling(doc, attributes=None):
+    """Check profiling information.
 
+    Checks all profiling attributes in a single pass over the profiled
+    elements, see verify_attribute_profiling. attributes is a list of
+    tuples of attribute name and known values and defaults to
+    PROFILING_ATTRIBUTES.
+    """
 
-def verify_newline_end_of_file(docfile):
-    """Check that there is a newline at the end of file."""
-
-    with open(docfile, 'r') as fp:
-        lines = fp.readlines()
-        lastline = lines[-1]
-
-    if not lastline.endswith('\n'):
-        raise ValueError('last line of a file must end with a \\n')
-
+    if attributes is None:
+        attributes = PROFILING_ATTRIBUTES
 
-def verify_unicode_niceness(docfile):
-    """Check that no unwanted unicode charaters are used."""
+    len_ns = len("{http://docbook.org/ns/docbook}")
+    ns = {"docbook": "http://docbook.org/ns/docbook"}
+    path = '//docbook:*[%s]' % " or ".join("@%s" % attribute
+                                           for attribute, _ in attributes)
+
+    # For each attribute, the messages of each profiled element in
+    # document order. The messages of an element are the unknown
+    # values of the element followed by the conflicts with all its
+    # profiled descendants.
+    msg = dict((attribute, []) for attribute, _ in attributes)
+    # For each attribute, the profiled ancestors of the current element
+    # as tuples (element, tag, values, messages).
+    stacks = dict((attribute, []) for attribute, _ in attributes)
+
+    for node in doc.xpath(path, namespaces=ns):
+        ancestors = set(node.iterancestors())
+        tag = node.tag[len_ns:]
+        line = node.sourceline
+        for attribute, known_values in attributes:
+            stack = stacks[attribute]
+            while stack and stack[-1][0] not in ancestors:
+                stack.pop()
+            if attribute not in node.attrib:
+                continue
 
-    invalid_characters = '“”‘’―—'
+            att_list = node.attrib[attribute].split(';')
+            for _, p_tag, p_att_list, p_msg in stack:
+                for att in att_list:
+                    if att not in p_att_list:
+                        p_msg.append(
+                            "%s %s profiling (%s) conflicts with %s "
+                            "profiling of %s on line %d." %
+                            (p_tag, attribute, p_att_list,
+                             attribute, tag, line))
+
+            node_msg = []
+            for att in att_list:
+                if att not in known_values:
+                    node_msg.append(
+                        "'%s' is not a recognized %s profile on line %d." %
+                        (att, attribute, line))
+            msg[attribute].append(node_msg)
+            stack.append((node, tag, att_list, node_msg))
+
+    all_msg = []
+    for attribute, _ in attributes:
+        for node_msg in msg[attribute]:
+            all_msg.extend(node_msg)
+    if all_msg:
+        raise ValueError("\n     ".join(all_msg))
+
+
+# Elements that should have no whitespace directly after the start tag
+# or directly before the end tag.
+NICENESS_ELEMENTS = ['listitem',
+                     'para',
+                     'td',
+                     'th',
+                     'command',
+                     'literal',
+                     'title',
+                     'caption',
+                     'filename',
+                     'userinput',
+                     'programlisting']
+
+# Single pattern for all whitespace checks of verify_niceness: trailing
+# whitespace and whitespace inside of any of NICENESS_ELEMENTS.
+WHITESPACE_NICENESS_RE = re.compile(
+    r"\s+\n$|"
+    r"<(?:%(elements)s)>\s+[\w\-().:!?{}\[\]]+.*\n|"
+    r"[\w\-().:!?{}\[\]]+\s+</(?:%(elements)s)>.*\n"
+    % {'elements': '|'.join(NICENESS_ELEMENTS)})
+
+# Unicode characters that should not be used, the files are checked
+# as UTF-8 encoded byte strings.
+INVALID_UNICODE_CHARACTERS = u'\u201c\u201d\u2018\u2019\u2015\u2014'
+INVALID_UNICODE_RE = re.compile('|'.join(
+    re.escape(c.encode('utf-8')) for c in INVALID_UNICODE_CHARACTERS))
+
+
+def verify_niceness(docfile):
+    """Check that a file is nicely formatted.
+
+    Reads the file once and checks in a single pass that no tabs,
+    non-breaking spaces, unnecessary whitespaces or unwanted unicode
+    characters are used and that the file ends with a newline.
+    """
 
-    affected_lines = []
-    lc = 0
-    for line in open(docfile, 'r'):
-        lc += 1
-        any(c in line for c in invalid_characters)
-
-    if len(affected_lines):
-        raise ValueError("unwanted unicode charaters (one of %s) "
-                         "found in line(s): %" % (" ".join(invalid_characters),
-                                                  ", ".join(affected_lines)))
-
-
-def verify_whitespace_niceness(docfile):
-    """Check that no unnecessary whitespaces are used."""
-    checks = [
-        re.compile(".*\s+\n$"),
-    ]
-
-    elements = [
-        'listitem',
-        'para',
-        'td',
-        'th',
-        'command',
-        'literal',
-        'title',
-        'caption',
-        'filename',
-        'userinput',
-        'programlisting'
-    ]
-
-    for element in elements:
-        checks.append(re.compile(".*<%s>\s+[\w\-().:!?{}\[\]]+.*\n"
-                                 % element))
-        checks.append(re.compile(".*[\w\-().:!?{}\[\]]+\s+<\/%s>.*\n"
-                                 % element))
-
-    lc = 0
-    affected_lines = []
     tab_lines = []
     nbsp_lines = []
-    for line in open(docfile, 'r'):
-        lc = lc + 1
-        if '\t' in line:
-            tab_lines.append(str(lc))
-
-        if '\xc2\xa0' in line:
-            nbsp_lines.append(str(lc))
-        for check in checks:
-            if check.match(line) and lc not in affected_lines:
+    affected_lines = []
+    unicode_lines = []
+    lastline = None
+    with open(docfile, 'rb') as fp:
+        for lc, line in enumerate(fp, 1):
+            if '\t' in line:
+                tab_lines.append(str(lc))
+            if '\xc2\xa0' in line:
+                nbsp_lines.append(str(lc))
+            if WHITESPACE_NICENESS_RE.search(line):
                 affected_lines.append(str(lc))
+            if INVALID_UNICODE_RE.search(line):
+                unicode_lines.append(str(lc))
+            lastline = line
 
-    msg = ""
+    msg = []
     if nbsp_lines:
-        msg = "non-breaking space found in lines (use &nbsp;): %s" % (
-            ", ".join(nbsp_lines))
+        msg.append("non-breaking space found in lines (use &nbsp;): %s" %
+                   ", ".join(nbsp_lines))
     if affected_lines:
-        if (msg):
-            msg += "\n    "
-        msg += ("trailing or unnecessary whitespaces found in lines: %s"
-                % (", ".join(affected_lines)))
+        msg.append("trailing or unnecessary whitespaces found in lines: %s" %
+                   ", ".join(affected_lines))
     if tab_lines:
-        if (msg):
-            msg += "\n    "
-        msg += "tabs found in lines: %s" % ", ".join(tab_lines)
+        msg.append("tabs found in lines: %s" % ", ".join(tab_lines))
+    if unicode_lines:
+        msg.append("unwanted unicode characters (one of %s) found in "
+                   "line(s): %s" %
+                   (" ".join(INVALID_UNICODE_CHARACTERS).encode('utf-8'),
+                    ", ".join(unicode_lines)))
+    if lastline is not None and not lastline.endswith('\n'):
+        msg.append('last line of a file must end with a \\n')
 
     if msg:
-        raise ValueError(msg)
+        raise ValueError("\n    ".join(msg))
 
 
-def verify_valid_links(doc):
-    """Check that all linked URLs are reachable
+def get_links(doc):
+    """Return list of linked URLs as tuples (url, line).
 
-    Will throw an exception if there's at least one unreachable URL.
+    URLs in URL_EXCEPTIONS are skipped.
     """
-    ns = {"docbook": "http://docbook.org/ns/docbook",
-          'xlink': 'http://www.w3.org/1999/xlink'}
-    msg = []
+
+    ns = {"docbook": "http://docbook.org/ns/docbook"}
+    links = []
     for node in doc.xpath('//docbook:link', namespaces=ns):
-        try:
-            url = node.attrib['{http://www.w3.org/1999/xlink}href']
-        except Exception:
+        url = node.get('{http://www.w3.org/1999/xlink}href')
+        if url is None or url in URL_EXCEPTIONS:
             continue
+        links.append((url, node.sourceline))
+    return links
+
+
+def verify_valid_links(links, rootdir, verbose):
+    """Check that all linked URLs are reachable.
+
+    links is a list of tuples (path, url, line) of all files. Every URL
+    is checked only once. Prints the unreachable URLs of each file and
+    returns the set of files with unreachable URLs.
+    """
 
-        if url in URL_EXCEPTIONS:
+    cache_file = None
+    if cfg.CONF.link_cache_ttl > 0 and not cfg.CONF.no_cache:
+        cache_file = os.path.join(get_cache_dir(), 'links.json')
+    checker = linkcheck.LinkChecker(
+        workers=cfg.CONF.link_check_workers,
+        timeout=cfg.CONF.link_check_timeout,
+        cache_file=cache_file,
+        cache_ttl=cfg.CONF.link_cache_ttl * 3600)
+    url_results = checker.check([url for _, url, _ in links])
+
+    msg = collections.OrderedDict()
+    for path, url, line in links:
+        error = url_results[url]
+        if error is None:
             continue
+        if error.kind == 'unreachable':
+            file_msg = ("URL %s not reachable at line %d, error %s" %
+                        (url, line, error))
+        else:
+            file_msg = ("URL %s invalid at line %d, error %s" %
+                        (url, line, error))
+        msg.setdefault(path, []).append(file_msg)
+        RESULTS.record(os.path.relpath(path, rootdir), 'links', 'failed',
+                       file_msg, line)
+
+    for path, file_msg in msg.items():
+        print("  %s: %s" % (os.path.relpath(path, rootdir),
+                            "\n    ".join(file_msg)))
+    if RESULTS.enabled():
+        for path in sorted(set(path for path, _, _ in links) - set(msg)):
+            RESULTS.record(os.path.relpath(path, rootdir), 'links',
+                           'passed')
+    if verbose:
+        print(" Checked %d URLs, %d URLs were reachable in earlier runs."
+              % (checker.checked, checker.cache_hits))
+    return set(msg)
 
-        try:
-            urllib2.urlopen(url)
-        except urllib2.HTTPError as e:
-            # Ignore some error codes:
-            # 403 (Forbidden) since it often means that the user-agent
-            # is wrong.
-            # 503 (Service Temporarily Unavailable)
-            if e.code not in [403, 503]:
-                e_line = node.sourceline
-                msg.append("URL %s not reachable at line %d, error %s" % (
-                    url, e_line, e))
-        except urllib2.URLError as e:
-            e_line = node.sourceline
-            msg.append("URL %s invalid at line %d, error %s" % (
-                url, e_line, e))
-
-    if len(msg) > 0:
-        raise ValueError("\n    ".join(msg))
+
+def get_errors(error_log):
+    """Return entries of error_log that are real errors.
+
+    We use this to filter out false positives related to IDREF attributes
+    """
+    return [x for x in error_log if x.type_name != 'DTD_UNKNOWN_ID']
 
 
 def error_message(error_log):
@@ -327,53 +768,36 @@ def error_message(error_log):
 
     We use this to filter out false positives related to IDREF attributes
     """
-    errs = [str(x) for x in error_log if x.type_name != 'DTD_UNKNOWN_ID']
+    errs = [str(x) for x in get_errors(error_log)]
 
     # Reverse output so that earliest failures are reported first
     errs.reverse()
     return "\n".join(errs)
 
 
-def www_touched():
-    """Check whether files in www directory are touched."""
+def get_repository_state():
+    """Return snapshot of the tested git repository.
 
-    try:
-        git_args = ["git", "diff", "--name-only", "HEAD~1", "HEAD"]
-        modified_files = check_output(git_args).strip().split()
-    except (subprocess.CalledProcessError, OSError) as e:
-        print("git failed: %s" % e)
-        sys.exit(1)
+    The snapshot is taken on first use, all later calls return the same
+    snapshot, so that all checks of a run see the same state.
+    """
 
-    www_changed = False
-    other_changed = False
-    for f in modified_files:
-        if f.startswith("www/"):
-            www_changed = True
-        else:
-            other_changed = True
+    global REPO_STATE
+    if REPO_STATE is None:
+        REPO_STATE = gitstate.RepositoryState()
+    return REPO_STATE
 
-    return www_changed and not other_changed
 
+def www_touched():
+    """Check whether files in www directory are touched."""
 
-def only_po_touched():
-    """Check whether only files in locale directory are touched."""
+    return get_repository_state().www_touched()
 
-    try:
-        git_args = ["git", "diff", "--name-only", "HEAD~1", "HEAD"]
-        modified_files = check_output(git_args).strip().split()
-    except (subprocess.CalledProcessError, OSError) as e:
-        print("git failed: %s" % e)
-        sys.exit(1)
 
-    locale_changed = False
-    other_changed = False
-    for f in modified_files:
-        if "/locale/" in f and f.endswith((".po", ".pot")):
-            locale_changed = True
-        else:
-            other_changed = True
+def only_po_touched():
+    """Check whether only files in locale directory are touched."""
 
-    return locale_changed and not other_changed
+    return get_repository_state().only_po_touched()
 
 
 def check_modified_affects_all(rootdir):
@@ -383,49 +807,20 @@ def check_modified_affects_all(rootdir):
     if either of these is touched.
     """
 
-    os.chdir(rootdir)
-
-    try:
-        git_args = ["git", "diff", "--name-only", "HEAD~1", "HEAD"]
-        modified_files = check_output(git_args).strip().split()
-    except (subprocess.CalledProcessError, OSError) as e:
-        print("git failed: %s" % e)
-        sys.exit(1)
-
-    special_files = [
-        # Top-Level pom.xml
-        "pom.xml",
-        # doc/pom.xml in openstack-manuals
-        "doc/pom.xml"
-    ]
-
-    for f in modified_files:
-        if f in special_files or f.endswith('.ent'):
-            if cfg.CONF.verbose:
-                print("File %s modified, this affects all books." % f)
-            return True
-
-    return False
+    special_files = get_repository_state().get_special_files()
+    if special_files and cfg.CONF.verbose:
+        print("File %s modified, this affects all books." % special_files[0])
+    return bool(special_files)
 
 
-def get_modified_files(rootdir, filtering=None):
-    """Get modified files below doc directory."""
+def get_modified_files(rootdir, statuses=None):
+    """Get modified files below doc directory.
 
-    # There are several tree traversals in this program that do a
-    # chdir, we need to run this git command always from the rootdir,
-    # so assure that.
-    os.chdir(rootdir)
+    The files are returned relative to rootdir, statuses are the git
+    status letters of files to return, None for all modified files.
+    """
 
-    try:
-        git_args = ["git", "diff", "--name-only", "--relative", "HEAD~1",
-                    "HEAD"]
-        if filtering is not None:
-            git_args.append(filtering)
-        modified_files = check_output(git_args).strip().split()
-    except (subprocess.CalledProcessError, OSError) as e:
-        print("git failed: %s" % e)
-        sys.exit(1)
-    return modified_files
+    return get_repository_state().modified_files(rootdir, statuses)
 
 
 def filter_dirs(dirs):
@@ -444,7 +839,7 @@ def check_deleted_files(rootdir, file_exceptions, verbose):
     """Checking that no removed files are referenced."""
 
     print("Checking that no removed files are referenced...")
-    deleted_files = get_modified_files(rootdir, "--diff-filter=D")
+    deleted_files = get_modified_files(rootdir, "D")
     if not deleted_files:
         print("No files were removed.\n")
         return 0
@@ -454,50 +849,38 @@ def check_deleted_files(rootdir, file_exceptions, verbose):
         for f in deleted_files:
             print ("   %s" % f)
 
-    deleted_files = [os.path.abspath(x) for x in deleted_files]
-    no_checked_files = 0
+    deleted_files = set(os.path.join(rootdir, x) for x in deleted_files)
+    referenced_by, no_checked_files = DOC_CACHE.get_referenced_by(
+        rootdir, file_exceptions)
 
     # Figure out whether files were included anywhere
     missing_reference = False
 
-    for root, dirs, files in os.walk(rootdir):
-        dirs[:] = filter_dirs(dirs)
-
-        os.chdir(root)
-
-        for f in files:
-            if not is_testable_xml_file(f, file_exceptions):
-                continue
-
-            path = os.path.abspath(os.path.join(root, f))
-            try:
-                doc = etree.parse(path)
-            except etree.XMLSyntaxError as e:
-                print(" Warning: file %s is invalid XML: %s" % (path, e))
-                continue
-
-            no_checked_files = no_checked_files + 1
+    # Files with imagedata for deleted files, each is reported once.
+    imagedata_files = set()
 
+    for deleted in sorted(deleted_files):
+        for path, kind, href in referenced_by.get(deleted, ()):
+            f = os.path.basename(path)
             # Check for inclusion of files as part of imagedata
-            for node in doc.findall(
-                    '//{http://docbook.org/ns/docbook}imagedata'):
-                href = node.get('fileref')
-                if (f not in file_exceptions and
-                        os.path.abspath(href) in deleted_files):
-                    print("  File %s has imagedata href for deleted "
-                          "file %s" % (f, href))
-                    missing_reference = True
-
-                    break
+            if kind == 'imagedata' and path not in imagedata_files:
+                imagedata_files.add(path)
+                print("  File %s has imagedata href for deleted "
+                      "file %s" % (f, href))
+                RESULTS.record(os.path.relpath(path, rootdir),
+                               'deletions', 'failed',
+                               "imagedata href for deleted file %s" %
+                               href)
+                missing_reference = True
 
             # Check for inclusion of files as part of xi:include
-            ns = {"xi": "http://www.w3.org/2001/XInclude"}
-            for node in doc.xpath('//xi:include', namespaces=ns):
-                href = node.get('href')
-                if (os.path.abspath(href) in deleted_files):
-                    print("  File %s has an xi:include on deleted file %s"
-                          % (f, href))
-                    missing_reference = True
+            elif kind == 'xinclude':
+                print("  File %s has an xi:include on deleted file %s"
+                      % (f, href))
+                RESULTS.record(os.path.relpath(path, rootdir),
+                               'deletions', 'failed',
+                               "xi:include on deleted file %s" % href)
+                missing_reference = True
 
     if missing_reference:
         print("Check failed, %d files were removed, "
@@ -521,8 +904,11 @@ def indent(text, spaces):
 
 
 def validate_one_json_file(rootdir, path, verbose, check_syntax,
-                           check_niceness):
-    """Validate a single JSON file."""
+                           check_niceness, problems):
+    """Validate a single JSON file.
+
+    Every failure is appended to problems as tuple (check, line, message).
+    """
 
     any_failures = False
     if verbose:
@@ -535,6 +921,7 @@ def validate_one_json_file(rootdir, path, verbose, check_syntax,
         any_failures = True
         print("  Invalid JSON file %s:\n%s" %
               (os.path.relpath(path, rootdir), indent(e, 4)))
+        problems.append(('syntax', None, str(e)))
     else:
         try:
             if check_niceness:
@@ -543,50 +930,61 @@ def validate_one_json_file(rootdir, path, verbose, check_syntax,
             any_failures = True
             print("  %s:\n%s" % (os.path.relpath(path, rootdir),
                                  indent(e, 4)))
+            problems.append(('niceness', None, str(e)))
 
     try:
         if check_niceness:
-            verify_whitespace_niceness(path)
-            verify_newline_end_of_file(path)
-            verify_unicode_niceness(path)
+            verify_niceness(path)
     except ValueError as e:
         any_failures = True
         print("  %s: %s" % (os.path.relpath(path, rootdir), e))
+        problems.append(('niceness', None, str(e)))
 
     return any_failures
 
 
 def validate_one_file(schema, rootdir, path, verbose,
                       check_syntax, check_niceness, check_links,
-                      validate_schema):
-    """Validate a single file."""
+                      validate_schema, links, problems):
+    """Validate a single file.
+
+    Linked URLs are not checked here but appended to the list links as
+    tuples (path, url, line), see verify_valid_links. Every failure is
+    appended to problems as tuple (check, line, message).
+    """
     # We pass schema in as a way of caching it, generating it is expensive
 
     any_failures = False
     if verbose:
         print(" Validating %s" % os.path.relpath(path, rootdir))
+    check = 'syntax'
     try:
         if check_syntax or check_links:
-            doc = etree.parse(path)
+            doc = DOC_CACHE.parse(path)
             if check_syntax:
                 if validate_schema:
                     if validation_failed(schema, doc):
                         any_failures = True
                         print(error_message(schema.error_log))
+                        problems.extend(('syntax', x.line, str(x))
+                                        for x in get_errors(
+                                            schema.error_log))
                     verify_section_tags_have_xmlid(doc)
                     verify_profiling(doc)
             if check_links:
-                    verify_valid_links(doc)
+                links.extend((path, url, line)
+                             for url, line in get_links(doc))
         if check_niceness:
-            verify_whitespace_niceness(path)
-            verify_newline_end_of_file(path)
-            verify_unicode_niceness(path)
+            check = 'niceness'
+            verify_niceness(path)
     except etree.XMLSyntaxError as e:
         any_failures = True
         print("  %s: %s" % (os.path.relpath(path, rootdir), e))
+        problems.append(('syntax', e.lineno, str(e)))
     except ValueError as e:
         any_failures = True
         print("  %s: %s" % (os.path.relpath(path, rootdir), e))
+        problems.append((check, None, str(e)))
 
     return any_failures
 
@@ -623,18 +1021,234 @@ def is_json(filename):
     return filename.endswith('.json')
 
 
+def validate_file(path, rootdir, verbose, check_syntax, check_niceness,
+                  check_links, is_api_site, links, problems):
+    """Validate a single file of any type we handle.
+
+    Returns True if the file has failures. Linked URLs and failures are
+    appended to links and problems, see validate_one_file. The schema is
+    only compiled if the file needs to be validated against it.
+    """
+
+    validate_schema = True
+    if is_api_site:
+        # Files ending with ".xml" in subdirectories of
+        # wadls and samples files are not docbook files.
+        if (path.endswith('.xml') and
+           ("wadls" in path or "samples" in path)):
+            validate_schema = False
+        # Right now we can only validate docbook .xml
+        # and .wadl files with a schema
+        elif not path.endswith(('.wadl', '.xml')):
+            validate_schema = False
+
+    if is_json(path):
+        return validate_one_json_file(rootdir, path, verbose,
+                                      check_syntax, check_niceness,
+                                      problems)
+
+    schema = None
+    if check_syntax and validate_schema:
+        if is_api_site and is_wadl(path):
+            schema = get_wadl_schema()
+        else:
+            schema = get_schema(is_api_site)
+    return validate_one_file(schema, rootdir, path, verbose,
+                             check_syntax, check_niceness,
+                             check_links, validate_schema, links,
+                             problems)
+
+
+def get_schema_hash():
+    """Return hash over all schema files."""
+
+    sha1 = hashlib.sha1()
+    for name in sorted(os.listdir(BASE_RNG)):
+        path = os.path.join(BASE_RNG, name)
+        if os.path.isfile(path):
+            sha1.update(name)
+            sha1.update(get_file_hash(path))
+    return sha1.hexdigest()
+
+
+class ValidationCache(object):
+    """Results of validating files, kept between runs.
+
+    A result is reused as long as the content of the file is the same
+    and the validation itself did not change, that is the version of
+    openstack-doc-tools, the schema files and the settings given to
+    the constructor as a dictionary.
+    """
+
+    def __init__(self, cache_file, settings):
+        self.cache_file = cache_file
+        settings = dict(settings, version=os_doc_tools.__version__,
+                        schema=get_schema_hash())
+        self.settings_hash = hashlib.sha1(
+            json.dumps(settings, sort_keys=True)).hexdigest()
+        self.entries = {}
+        self.skipped = 0
+        self.validated = 0
+        try:
+            with open(cache_file, 'r') as fp:
+                self.entries = json.load(fp)
+        except (IOError, ValueError):
+            pass
+
+    def _get_key(self, path, entry):
+        """Return key of the current content of path."""
+
+        st = os.stat(path)
+        if (entry is not None and entry['mtime'] == st.st_mtime and
+                entry['size'] == st.st_size):
+            sha1 = entry['sha1']
+        else:
+            sha1 = get_file_hash(path)
+        return (st.st_mtime, st.st_size, sha1)
+
+    def get(self, path):
+        """Return cached result of path.
+
+        The result is a tuple (failed, output, links, problems), None is
+        returned if there is no valid result.
+        """
+
+        path = os.path.abspath(path)
+        entry = self.entries.get(path)
+        if entry is None or entry['settings'] != self.settings_hash:
+            return None
+        mtime, size, sha1 = self._get_key(path, entry)
+        if sha1 != entry['sha1']:
+            return None
+        entry['mtime'] = mtime
+        entry['size'] = size
+        self.skipped += 1
+        return (entry['failed'], entry['output'],
+                [tuple(link) for link in entry['links']],
+                [tuple(problem) for problem in entry.get('problems', [])])
+
+    def add(self, path, failed, output, links, problems):
+        """Add result of validating path."""
+
+        path = os.path.abspath(path)
+        mtime, size, sha1 = self._get_key(path, self.entries.get(path))
+        self.validated += 1
+        self.entries[path] = {'settings': self.settings_hash,
+                              'mtime': mtime,
+                              'size': size,
+                              'sha1': sha1,
+                              'failed': failed,
+                              'output': output,
+                              'links': links,
+                              'problems': problems}
+
+    def save(self):
+        """Save results, results of removed files are dropped."""
+
+        entries = dict((path, entry) for path, entry in self.entries.items()
+                       if os.path.isfile(path))
+        try:
+            write_file_atomically(self.cache_file, json.dumps(entries))
+        except (IOError, OSError) as e:
+            print("Warning: cannot write validation cache %s: %s" %
+                  (self.cache_file, e))
+
+    def print_statistics(self):
+        """Print usage statistics of the cache."""
+
+        print("Validation cache: %d files validated, %d unchanged files "
+              "skipped." % (self.validated, self.skipped))
+
+
+def get_validation_cache():
+    """Return ValidationCache for the selected checks."""
+
+    CONF = cfg.CONF
+    return ValidationCache(
+        os.path.join(get_cache_dir(), 'validation.json'),
+        {'check_syntax': CONF.check_syntax,
+         'check_niceness': CONF.check_niceness,
+         'check_links': CONF.check_links,
+         'api_site': CONF.api_site,
+         'url_exceptions': URL_EXCEPTIONS})
+
+
+def validate_file_captured(path, rootdir, check_syntax, check_niceness,
+                           check_links, is_api_site):
+    """Validate a single file and capture its output.
+
+    Returns a tuple of the failure state, of the output written while
+    validating, of the linked URLs as tuples (url, line), of the
+    failures as tuples (check, line, message) and of the seconds needed
+    for validating.
+    """
+
+    links = []
+    problems = []
+    start = time.time()
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        failed = validate_file(path, rootdir, False, check_syntax,
+                               check_niceness, check_links, is_api_site,
+                               links, problems)
+        output = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    return (failed, output, [(url, line) for _, url, line in links],
+            problems, time.time() - start)
+
+
+# State of a validation worker process, set up once per process by
+# init_validation_worker.
+VALIDATION_WORKER = {}
+
+
+def init_validation_worker(rootdir, check_syntax, check_niceness,
+                           check_links, is_api_site):
+    """Initialize a process of the validation pool."""
+
+    VALIDATION_WORKER['args'] = (rootdir, check_syntax, check_niceness,
+                                 check_links, is_api_site)
+
+
+def validate_file_in_worker(path):
+    """Validate a single file inside of a validation pool process.
+
+    Returns the result of validate_file_captured extended by the
+    references entry of DOC_CACHE so that the parent does not need to
+    parse the file again.
+    """
+
+    result = validate_file_captured(path, *VALIDATION_WORKER['args'])
+    return result + (DOC_CACHE.get_references_entry(path),)
+
+
+def get_validation_jobs(jobs, no_files):
+    """Return number of processes to use for validating no_files files."""
+
+    if jobs is None or jobs < 1:
+        jobs = multiprocessing.cpu_count()
+    return max(1, min(jobs, no_files))
+
+
 def validate_individual_files(files_to_check, rootdir, verbose,
                               check_syntax=False, check_niceness=False,
-                              check_links=False, is_api_site=False):
-    """Validate list of files."""
+                              check_links=False, is_api_site=False,
+                              jobs=1, cache=None):
+    """Validate list of files.
 
-    schema = get_schema(is_api_site)
-    if is_api_site:
-        wadl_schema = get_wadl_schema()
+    With jobs larger than 1, files are validated by a pool of processes,
+    the output is printed in the order of files_to_check. Linked URLs
+    of all files are checked at the end.
+
+    If a ValidationCache is passed as cache, files with a cached result
+    are not validated again.
+    """
 
-    any_failures = False
     no_validated = 0
-    no_failed = 0
+    failed_files = set()
+    links = []
 
     checks = []
     if check_links:
@@ -645,42 +1259,80 @@ def validate_individual_files(files_to_check, rootdir, verbose,
         checks.append("syntax")
     print("Checking files for %s..." % (", ".join(checks)))
 
-    for f in files_to_check:
-        validate_schema = True
-        if is_api_site:
-            # Files ending with ".xml" in subdirectories of
-            # wadls and samples files are not docbook files.
-            if (f.endswith('.xml') and
-               ("wadls" in f or "samples" in f)):
-                validate_schema = False
-            # Right now we can only validate docbook .xml
-            # and .wadl files with a schema
-            elif not f.endswith(('.wadl', '.xml')):
-                validate_schema = False
-
-        if is_json(f):
-            any_failures = validate_one_json_file(rootdir, f,
-                                                  verbose,
-                                                  check_syntax,
-                                                  check_niceness)
-        elif (is_api_site and is_wadl(f)):
-            any_failures = validate_one_file(wadl_schema, rootdir, f,
-                                             verbose,
-                                             check_syntax,
-                                             check_niceness,
-                                             check_links,
-                                             validate_schema)
-        else:
-            any_failures = validate_one_file(schema, rootdir, f,
-                                             verbose,
-                                             check_syntax,
-                                             check_niceness,
-                                             check_links,
-                                             validate_schema)
-        if any_failures:
-            no_failed = no_failed + 1
-        no_validated = no_validated + 1
+    cached = {}
+    if cache is not None:
+        for f in files_to_check:
+            result = cache.get(f)
+            if result is not None:
+                cached[f] = result
+    pending = [f for f in files_to_check if f not in cached]
+
+    pool = None
+    jobs = get_validation_jobs(jobs, len(pending))
+    if jobs > 1:
+        if verbose:
+            print(" Using %d processes for validation." % jobs)
+        # Compile the schemas before forking so that all processes
+        # share them.
+        if check_syntax:
+            get_schema(is_api_site)
+            if is_api_site and any(is_wadl(f) for f in pending):
+                get_wadl_schema()
+        pool = multiprocessing.Pool(
+            jobs, initializer=init_validation_worker,
+            initargs=(rootdir, check_syntax, check_niceness,
+                      check_links, is_api_site))
+        # Hand out files in small chunks, this keeps the overhead low
+        # while still balancing big and small files between processes.
+        chunksize = max(1, min(16, len(pending) // (jobs * 4)))
+        results = pool.imap(validate_file_in_worker, pending, chunksize)
+    else:
+        results = (validate_file_captured(f, rootdir, check_syntax,
+                                          check_niceness, check_links,
+                                          is_api_site) + (None,)
+                   for f in pending)
+
+    try:
+        for f in files_to_check:
+            if verbose:
+                print(" Validating %s" % os.path.relpath(f, rootdir))
+            if f in cached:
+                failed, output, file_links, problems = cached[f]
+                duration = None
+            else:
+                (failed, output, file_links, problems, duration,
+                 references) = next(results)
+                DOC_CACHE.add_references(f, references)
+                if cache is not None:
+                    cache.add(f, failed, output, file_links, problems)
+            sys.stdout.write(output)
+            if RESULTS.enabled():
+                f_rel = os.path.relpath(f, rootdir)
+                for check, line, message in problems:
+                    RESULTS.record(f_rel, check, 'failed', message, line)
+                RESULTS.record(f_rel, 'validation',
+                               'failed' if failed else 'passed',
+                               duration=duration)
+            links.extend((f, url, line) for url, line in file_links)
+            if failed:
+                failed_files.add(f)
+            no_validated = no_validated + 1
+        if pool is not None:
+            pool.close()
+            pool.join()
+    except KeyboardInterrupt:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        raise
 
+    if cache is not None:
+        cache.save()
+
+    if check_links:
+        failed_files.update(verify_valid_links(links, rootdir, verbose))
+
+    no_failed = len(failed_files)
     if no_failed > 0:
         print("Check failed, validated %d files with %d failures.\n"
               % (no_validated, no_failed))
@@ -690,26 +1342,187 @@ def validate_individual_files(files_to_check, rootdir, verbose,
     return 0
 
 
+class ValidationRequestHandler(SocketServer.StreamRequestHandler):
+    """Handle a request of openstack-doc-test-client.
+
+    A request is a line with a JSON object, the result of each file is
+    sent back as soon as the file is validated as a line with a JSON
+    object, see os_doc_tools.doctest_client.
+    """
+
+    def send(self, message):
+        self.wfile.write(json.dumps(message) + '\n')
+        self.wfile.flush()
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError as e:
+            self.send({'error': "Invalid request: %s" % e})
+            return
+        error = get_request_error(request)
+        if error:
+            self.send({'error': "Invalid request: %s" % error})
+            return
+
+        if request.get('command') == 'stop':
+            self.server.stopping = True
+            self.send({'done': True})
+            return
+
+        rootdir = request['rootdir']
+        check_links = request.get('check_links', False)
+        files = [f for f in request['files']
+                 if is_testable_file(f, FILE_EXCEPTIONS)]
+        links = []
+        failed_files = set()
+        for path in files:
+            if not os.path.isfile(path):
+                failed, output, file_links, problems, duration = (
+                    True, "  %s: file does not exist\n" %
+                    os.path.relpath(path, rootdir), [], [], 0)
+            else:
+                try:
+                    failed, output, file_links, problems, duration = (
+                        validate_file_captured(
+                            path, rootdir,
+                            request.get('check_syntax', False),
+                            request.get('check_niceness', False),
+                            check_links, request.get('api_site', False)))
+                except Exception as e:
+                    # Keep serving, the client still gets all results.
+                    failed, output, file_links, problems, duration = (
+                        True, "  %s: cannot validate file: %s\n" %
+                        (os.path.relpath(path, rootdir), e), [], [], 0)
+            if failed:
+                failed_files.add(path)
+            links.extend((path, url, line) for url, line in file_links)
+            self.send({'file': path,
+                       'failed': failed,
+                       'output': output,
+                       'problems': problems,
+                       'duration': duration})
+
+        output = ''
+        if check_links:
+            stdout = sys.stdout
+            sys.stdout = StringIO.StringIO()
+            try:
+                failed_files.update(verify_valid_links(links, rootdir,
+                                                       False))
+                output = sys.stdout.getvalue()
+            finally:
+                sys.stdout = stdout
+        self.send({'done': True,
+                   'validated': len(files),
+                   'failed': len(failed_files),
+                   'output': output})
+
+
+def get_request_error(request):
+    """Return what is wrong with a request to the server, None if valid."""
+
+    if not isinstance(request, dict):
+        return "not a JSON object"
+    if 'command' in request:
+        if request['command'] != 'stop':
+            return "unknown command %r" % request['command']
+        return None
+    if not isinstance(request.get('rootdir'), basestring):
+        return "rootdir is missing or not a string"
+    files = request.get('files')
+    if (not isinstance(files, list) or
+            not all(isinstance(f, basestring) for f in files)):
+        return "files is missing or not a list of strings"
+    for key in ('check_syntax', 'check_niceness', 'check_links',
+                'api_site'):
+        if not isinstance(request.get(key, False), bool):
+            return "%s is not a boolean" % key
+    return None
+
+
+def get_socket_path():
+    """Return path of the socket of the validation server."""
+
+    if cfg.CONF.socket:
+        return os.path.abspath(cfg.CONF.socket)
+    return os.path.join(get_cache_dir(), 'doctest.sock')
+
+
+def serve(socket_path, is_api_site):
+    """Validate files for openstack-doc-test-client until stopped.
+
+    Requests are handled one after the other by this process, compiled
+    schemas and parsed files are kept between requests.
+    """
+
+    error = doctest_client.check_socket_path(socket_path)
+    if error:
+        print("ERROR: %s" % error)
+        return 1
+    if os.path.exists(socket_path):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.connect(socket_path)
+        except socket.error:
+            # Left behind by a server that did not stop cleanly.
+            os.unlink(socket_path)
+        else:
+            print("ERROR: a server is already listening on %s." %
+                  socket_path)
+            return 1
+        finally:
+            client.close()
+    elif not os.path.isdir(os.path.dirname(socket_path)):
+        os.makedirs(os.path.dirname(socket_path))
+
+    # Compile the schema now and not on the first request.
+    get_schema(is_api_site)
+
+    try:
+        server = SocketServer.UnixStreamServer(socket_path,
+                                               ValidationRequestHandler)
+    except socket.error as e:
+        print("ERROR: cannot listen on %s: %s" % (socket_path, e))
+        return 1
+    server.stopping = False
+    print("Listening on %s, stop with Ctrl-C or "
+          "openstack-doc-test-client --stop." % socket_path)
+    try:
+        while not server.stopping:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+    print("Server stopped.")
+    return 0
+
+
 def validate_modified_files(rootdir, exceptions, verbose,
                             check_syntax=False, check_niceness=False,
-                            check_links=False, is_api_site=False):
+                            check_links=False, is_api_site=False,
+                            jobs=1, cache=None):
     """Validate list of modified, testable files."""
 
     # Do not select deleted files, just Added, Copied, Modified, Renamed,
     # or Type changed
-    modified_files = get_modified_files(rootdir, "--diff-filter=ACMRT")
-    modified_files = [f for f in modified_files if
-                      is_testable_file(f, exceptions)]
+    modified_files = get_modified_files(rootdir, "ACMRT")
+    modified_files = [os.path.join(rootdir, f) for f in modified_files
+                      if is_testable_file(f, exceptions)]
 
     return validate_individual_files(modified_files, rootdir,
                                      verbose,
                                      check_syntax, check_niceness,
-                                     check_links, is_api_site)
+                                     check_links, is_api_site,
+                                     jobs, cache)
 
 
 def validate_all_files(rootdir, exceptions, verbose,
                        check_syntax, check_niceness=False,
-                       check_links=False, is_api_site=False):
+                       check_links=False, is_api_site=False, jobs=1,
+                       cache=None):
     """Validate all testable files (XML, WADL, JSON, etc.)."""
 
     files_to_check = []
@@ -726,50 +1539,357 @@ def validate_all_files(rootdir, exceptions, verbose,
     return validate_individual_files(files_to_check, rootdir,
                                      verbose,
                                      check_syntax, check_niceness,
-                                     check_links, is_api_site)
+                                     check_links, is_api_site,
+                                     jobs, cache)
 
 
 def logging_build_book(result):
     """Callback for book building."""
     RESULTS_OF_BUILDS.append(result)
+    book, success, output, returncode, duration, _ = result
+    if success:
+        RESULTS.record(book, 'build', 'passed', duration=duration)
+    else:
+        RESULTS.record(book, 'build', 'failed',
+                       "Build failed (returncode = %d).\n%s" %
+                       (returncode, output), duration=duration)
 
 
 def get_gitroot():
     """Return path to top-level of git repository."""
 
-    try:
-        git_args = ["git", "rev-parse", "--show-toplevel"]
-        gitroot = check_output(git_args).rstrip()
-    except (subprocess.CalledProcessError, OSError) as e:
-        print("git failed: %s" % e)
-        sys.exit(1)
+    return get_repository_state().gitroot
+
+
+def get_cache_dir():
+    """Return directory for caches that are kept between runs."""
 
-    return gitroot
+    if cfg.CONF.cache_dir:
+        return os.path.abspath(cfg.CONF.cache_dir)
+
+    return os.path.join(get_repository_state().gitdir, 'openstack-doc-test')
+
+
+def get_index_file(rootdir):
+    """Return path of the include index file for rootdir."""
+
+    rel = os.path.relpath(rootdir, get_gitroot())
+    if rel == '.':
+        name = 'include-index.json'
+    else:
+        name = 'include-index-%s.json' % rel.replace(os.sep, '-')
+    return os.path.join(get_cache_dir(), name)
 
 
 def print_gitinfo():
     """Print information about repository and change."""
 
-    try:
-        git_cmd = ["git", "rev-parse", "--abbrev-ref", "HEAD"]
-        gitbranch = check_output(git_cmd).rstrip()
-        git_cmd = ["git", "show", "--format=%s", "-s"]
-        gitsubject = check_output(git_cmd).rstrip()
-        git_cmd = ["git", "show", "--format=%an", "-s"]
-        gitauthor = check_output(git_cmd).rstrip()
-    except (subprocess.CalledProcessError, OSError) as e:
-        print("git failed: %s" % e)
-        sys.exit(1)
+    repo_state = get_repository_state()
     print("Testing patch:")
-    print("  Title: %s" % gitsubject)
-    print("  Author: %s" % gitauthor)
-    print("  Branch: %s" % gitbranch)
+    print("  Title: %s" % repo_state.subject)
+    print("  Author: %s" % repo_state.author)
+    print("  Branch: %s" % repo_state.branch)
+
+
+def get_doc_path():
+    """Return path of the directory with the documentation."""
+
+    if cfg.CONF.language:
+        return os.path.join(get_gitroot(), 'generated', cfg.CONF.language)
+    elif cfg.CONF.api_site:
+        return get_gitroot()
+    return os.path.join(get_gitroot(), 'doc')
 
 
 def get_publish_path():
     """Return path to use of publishing books."""
 
-    return os.path.join(get_gitroot(), 'publish-docs')
+    return os.path.join(get_gitroot(), 'publish-docs')
+
+
+def get_publish_manifest(publish_path):
+    """Return path of the list of changes of publish_path."""
+
+    return os.path.join(os.path.dirname(os.path.abspath(publish_path)),
+                        'publish-changes.txt')
+
+
+def write_publish_manifest(publish_path, changes):
+    """Append changes to the list of changes of publish_path.
+
+    changes is a list of tuples (status, path) as returned by sync_tree,
+    with path relative to publish_path. Books are published by several
+    processes in parallel, the file is locked while writing.
+    """
+
+    with open(get_publish_manifest(publish_path), 'a') as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        for status, path in changes:
+            fp.write("%s\t%s\n" % (status, path))
+
+
+def clone_file(source, target):
+    """Copy the content of file source to file target.
+
+    On file systems that support it, like Btrfs and XFS, target shares
+    the data blocks of source until one of them is written, which is
+    much faster than copying. Otherwise the content is copied.
+    """
+
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except (IOError, OSError):
+            shutil.copyfileobj(src, dst)
+
+
+def replace_file(source, target):
+    """Replace target by a copy of source, see clone_file.
+
+    The copy is a new file, so that later writes to the file that
+    target was before, for example a hardlink into a build directory,
+    do not change it. Symlinks in source are followed. Like with
+    shutil.copy2, permissions and modification time are copied.
+    """
+
+    tmp_file = "%s.tmp-%d" % (target, os.getpid())
+    try:
+        clone_file(source, tmp_file)
+        shutil.copystat(source, tmp_file)
+        os.rename(tmp_file, target)
+    except (IOError, OSError):
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def is_same_file_content(source, target):
+    """Return whether the files source and target have the same content.
+
+    Files of different sizes differ. Files of the same size and
+    modification time are the same without reading them, replace_file
+    copies the modification time. Other files are compared by content.
+    """
+
+    source_stat = os.stat(source)
+    target_stat = os.stat(target)
+    if source_stat.st_size != target_stat.st_size:
+        return False
+    if int(source_stat.st_mtime) == int(target_stat.st_mtime):
+        return True
+    return filecmp.cmp(source, target, shallow=False)
+
+
+def get_dir_id(path):
+    """Return the device and inode of directory path, symlinks followed."""
+
+    st = os.stat(path)
+    return (st.st_dev, st.st_ino)
+
+
+def remove_published(path, target, changes):
+    """Remove file or directory path and add the removed files to changes."""
+
+    if os.path.isdir(path) and not os.path.islink(path):
+        for root, _, files in os.walk(path):
+            for f in files:
+                changes.append(('D', os.path.relpath(os.path.join(root, f),
+                                                     target)))
+        shutil.rmtree(path)
+    else:
+        changes.append(('D', os.path.relpath(path, target)))
+        os.remove(path)
+
+
+def sync_tree(source, target, ignore=None):
+    """Make target a copy of the directory source.
+
+    Only files that differ in content are replaced and files that do
+    not exist in source are removed, see is_same_file_content. Like
+    shutil.copytree, symlinks in source are followed and their content
+    is copied, symlinks to a directory that contains them are skipped.
+    ignore is called like the ignore argument of shutil.copytree.
+
+    Returns a tuple of the list of changes and of the list of all files
+    in target. Changes are tuples (status, path) with status A for
+    added, M for modified and D for deleted files. All paths are
+    relative to target.
+    """
+
+    changes = []
+    published = []
+    # Directories of the path from source to each directory to walk,
+    # to detect symlink loops.
+    parent_dirs = {source: frozenset()}
+    for root, dirs, files in os.walk(source, followlinks=True):
+        target_root = os.path.normpath(
+            os.path.join(target, os.path.relpath(root, source)))
+        if ignore is not None:
+            ignored = set(ignore(root, dirs + files))
+            dirs[:] = [d for d in dirs if d not in ignored]
+            files = [f for f in files if f not in ignored]
+        root_dirs = parent_dirs.pop(root) | set([get_dir_id(root)])
+        walked_dirs = []
+        for d in dirs:
+            path = os.path.join(root, d)
+            if get_dir_id(path) not in root_dirs:
+                walked_dirs.append(d)
+                parent_dirs[path] = root_dirs
+        dirs[:] = walked_dirs
+        if not os.path.isdir(target_root):
+            os.makedirs(target_root)
+
+        wanted = set(dirs + files)
+        for name in os.listdir(target_root):
+            path = os.path.join(target_root, name)
+            if (name not in wanted or
+                    (name in dirs and not os.path.isdir(path))):
+                remove_published(path, target, changes)
+
+        for f in files:
+            source_file = os.path.join(root, f)
+            path = os.path.join(target_root, f)
+            published.append(os.path.relpath(path, target))
+            if os.path.isdir(path) and not os.path.islink(path):
+                remove_published(path, target, changes)
+            if os.path.lexists(path):
+                # Older versions published symlinks and hardlinks, the
+                # published file has to be independent of source.
+                shared = (os.path.islink(path) or
+                          os.path.samefile(source_file, path))
+                unchanged = (os.path.exists(path) and
+                             is_same_file_content(source_file, path))
+                if unchanged and not shared:
+                    continue
+                status = None if unchanged else 'M'
+            else:
+                status = 'A'
+            replace_file(source_file, path)
+            if status is not None:
+                changes.append((status, os.path.relpath(path, target)))
+    return changes, published
+
+
+def get_manifest_dir(publish_path):
+    """Return directory with the manifests of the books in publish_path."""
+
+    return os.path.join(os.path.dirname(os.path.abspath(publish_path)),
+                        'publish-manifest')
+
+
+def is_index_entry_dir(path):
+    """Return whether entry points in directory path are listed.
+
+    Entry points below common, webapp and content directories are
+    parts of other books.
+    """
+
+    return not any(d in ('common', 'webapp', 'content')
+                   for d in path.split(os.sep))
+
+
+def write_book_manifest(publish_path, book, book_rel, published):
+    """Write manifest of a published book.
+
+    book_rel is the directory of the book relative to publish_path,
+    published the list of its files relative to that directory. The
+    manifest lists the entry points of the book, that are the start
+    pages of webhelp output and API references, and all PDF files,
+    together with their sizes and hashes.
+    """
+
+    book_path = os.path.join(publish_path, book_rel)
+    entry_points = []
+    pdfs = []
+    size = 0
+    for f in sorted(published):
+        path = os.path.join(book_path, f)
+        f_size = os.path.getsize(path)
+        size += f_size
+        rel = os.path.normpath(os.path.join(book_rel, f))
+        dirname, name = os.path.split(rel)
+        entry = {'path': rel, 'size': f_size}
+        if (name == 'index.html' and os.path.basename(dirname) == 'content'
+                and is_index_entry_dir(os.path.dirname(dirname))):
+            entry_points.append(entry)
+        elif name == 'api-ref.html' and is_index_entry_dir(dirname):
+            entry_points.append(entry)
+        elif name.endswith('.pdf'):
+            pdfs.append(entry)
+        else:
+            continue
+        entry['sha1'] = get_file_hash(path)
+
+    manifest = {'book': book,
+                'path': book_rel,
+                'entry_points': entry_points,
+                'pdfs': pdfs,
+                'files': len(published),
+                'size': size}
+    manifest_file = os.path.join(get_manifest_dir(publish_path),
+                                 "%s.json" % book_rel.replace(os.sep, '-'))
+    write_file_atomically(manifest_file, json.dumps(manifest))
+
+
+def load_book_manifests(publish_path):
+    """Return manifests of all books that exist in publish_path."""
+
+    manifest_dir = get_manifest_dir(publish_path)
+    if not os.path.isdir(manifest_dir):
+        return []
+    manifests = []
+    for name in os.listdir(manifest_dir):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(manifest_dir, name), 'r') as fp:
+                manifest = json.load(fp)
+        except (IOError, ValueError):
+            continue
+        if os.path.isdir(os.path.join(publish_path, manifest['path'])):
+            manifests.append(manifest)
+    return sorted(manifests, key=operator.itemgetter('path'))
+
+
+def scan_published_books(publish_path, manifests):
+    """Return manifests for books in publish_path that have none.
+
+    Books published by earlier versions or by a partial publish have no
+    manifest. They are found by scanning publish_path for entry points
+    and PDF files outside of the directories of manifests. The returned
+    manifests have no number of files and size.
+    """
+
+    known = set(manifest['path'] for manifest in manifests)
+    scanned = []
+    for root, dirs, files in os.walk(publish_path):
+        path = os.path.relpath(root, publish_path)
+        dirs[:] = [d for d in dirs
+                   if (d not in ('common', 'webapp', 'content') and
+                       os.path.normpath(os.path.join(path, d)) not in known)]
+        # Ignore top-level index.html files
+        if root == publish_path:
+            continue
+
+        entry_points = []
+        if os.path.isfile(os.path.join(root, 'content/index.html')):
+            entry_points.append(os.path.join(path, 'content/index.html'))
+        if os.path.isfile(os.path.join(root, 'api-ref.html')):
+            entry_points.append(os.path.join(path, 'api-ref.html'))
+        pdfs = [os.path.join(path, f) for f in sorted(files)
+                if f.endswith('.pdf')]
+        if not entry_points and not pdfs:
+            continue
+        scanned.append({
+            'book': os.path.basename(root),
+            'path': path,
+            'entry_points': [{'path': f, 'size': os.path.getsize(
+                os.path.join(publish_path, f))} for f in entry_points],
+            'pdfs': [{'path': f, 'size': os.path.getsize(
+                os.path.join(publish_path, f))} for f in pdfs],
+            'files': None,
+            'size': None})
+    return scanned
 
 
 def ignore_for_publishing(_, names):
@@ -785,8 +1905,13 @@ def ignore_for_publishing(_, names):
     return f
 
 
-def publish_book(publish_path, book):
-    """Copy generated files to publish_path."""
+def publish_book(publish_path, book, book_dir='.'):
+    """Copy generated files of book in directory book_dir to publish_path.
+
+    Only changed files are copied, see sync_tree, the changes are
+    added to the list of changes, see write_publish_manifest. The
+    manifest of the book is written for generate_index_file.
+    """
 
     # Assumption: The path for the book is the same as the name of directory
     # the book is in. We need to special case any exceptions.
@@ -797,18 +1922,17 @@ def publish_book(publish_path, book):
     if cfg.CONF.language:
         book_path = os.path.join(book_path, cfg.CONF.language)
 
-    if os.path.isdir(os.path.join('target/docbkx/webhelp', book)):
-        source = os.path.join('target/docbkx/webhelp', book)
-    elif os.path.isdir(os.path.join('target/docbkx/webhelp/local', book)):
-        source = os.path.join('target/docbkx/webhelp/local', book)
+    webhelp = os.path.join(book_dir, 'target/docbkx/webhelp')
+    if os.path.isdir(os.path.join(webhelp, book)):
+        source = os.path.join(webhelp, book)
+    elif os.path.isdir(os.path.join(webhelp, 'local', book)):
+        source = os.path.join(webhelp, 'local', book)
         book_path = os.path.join(book_path, 'local')
-    elif os.path.isdir(os.path.join('target/docbkx/webhelp/',
-                                    cfg.CONF.release_path, book)):
-        source = os.path.join('target/docbkx/webhelp/',
-                              cfg.CONF.release_path, book)
+    elif os.path.isdir(os.path.join(webhelp, cfg.CONF.release_path, book)):
+        source = os.path.join(webhelp, cfg.CONF.release_path, book)
         book_path = os.path.join(book_path, cfg.CONF.release_path)
     elif (book in BOOK_MAPPINGS):
-        source = BOOK_MAPPINGS[book]
+        source = os.path.join(book_dir, BOOK_MAPPINGS[book])
     else:
         if cfg.CONF.debug:
             print("No build result found for book %s" % book)
@@ -823,159 +1947,566 @@ def publish_book(publish_path, book):
     if cfg.CONF.debug:
         print("Uploading book %s to %s" % (book, book_path))
 
-    # Note that shutil.copytree does not allow an existing target directory,
-    # thus delete it.
-    shutil.rmtree(book_path, ignore_errors=True)
+    # Only replace changed files so that later uploads can skip the
+    # unchanged ones.
+    changes, published = sync_tree(source, book_path,
+                                   ignore=ignore_for_publishing)
+    rel = os.path.relpath(book_path, publish_path)
+    write_publish_manifest(publish_path,
+                           [(status, os.path.join(rel, path))
+                            for status, path in changes])
+    write_book_manifest(publish_path, book, rel, published)
+    if cfg.CONF.debug:
+        print("Changed %d files of book %s" % (len(changes), book))
+
 
-    shutil.copytree(source, book_path,
-                    ignore=ignore_for_publishing)
+def program_exists(program):
+    """Return whether program is in the search path."""
+    retcode = subprocess.call(['which', program], stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE)
+    return retcode == 0
 
 
 def ensure_exists(program):
     """Check that program exists, abort if not."""
-    retcode = subprocess.call(['which', program], stdout=subprocess.PIPE,
-                              stderr=subprocess.PIPE)
-    if retcode != 0:
+    if not program_exists(program):
         print("Program '%s' does not exist, please install!" % program)
         sys.exit(1)
 
 
-def build_book(book, publish_path, log_path):
-    """Build book(s) in directory book."""
+def get_maven_command():
+    """Return Maven command used for building books.
+
+    With the build backend "auto", the Maven daemon mvnd is used if it
+    is installed, otherwise plain mvn.
+    """
+
+    if cfg.CONF.build_backend == 'auto':
+        if program_exists('mvnd'):
+            return 'mvnd'
+        return 'mvn'
+    return cfg.CONF.build_backend
+
+
+class BuildLog(object):
+    """Log of a book build.
+
+    Output of the build commands is written line by line to a gzip
+    compressed log file, only the last tail_lines lines are kept in
+    memory for reporting failures.
+
+    :param path: path of the log file
+    :param name: name of the book, used for progress lines
+    :param progress: print progress lines while commands run
+    :param tail_lines: number of last lines to keep
+    """
+
+    def __init__(self, path, name, progress=False,
+                 tail_lines=BUILD_LOG_TAIL_LINES):
+        self.path = path
+        self.name = name
+        self.progress = progress
+        self.out_file = gzip.open(path, 'w')
+        self.tail = collections.deque(maxlen=tail_lines)
+        self.first_line = None
+
+    def write(self, line):
+        """Write a single line of output."""
+
+        self.out_file.write(line)
+        self.tail.append(line)
+
+    def get_tail(self):
+        """Return the last lines of output as string."""
+
+        return ''.join(self.tail)
+
+    def run(self, cmd, cwd=None):
+        """Run cmd in directory cwd and write its output.
+
+        Sets first_line to the seconds until the command printed its
+        first line. Raises subprocess.CalledProcessError with the last
+        lines as output if the command fails.
+        """
+
+        if self.progress:
+            print(" %s: %s" % (self.name, " ".join(cmd)))
+        start = time.time()
+        self.first_line = None
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, cwd=cwd)
+        for line in iter(process.stdout.readline, b''):
+            if self.first_line is None:
+                self.first_line = time.time() - start
+            self.write(line)
+            if self.progress:
+                match = MAVEN_GOAL_RE.match(line)
+                if match:
+                    print(" %s: %s" % (self.name, match.group(1)))
+        returncode = process.wait()
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, cmd,
+                                                self.get_tail())
+
+    def close(self):
+        """Close the log file."""
+
+        self.out_file.close()
+
+
+class MavenBackend(object):
+    """Run Maven for building books.
+
+    command is the Maven executable, for example mvn or mvnd. mvnd
+    keeps warm Maven daemons between invocations and thus avoids the
+    start of a new JVM and the loading of all plugins for each
+    invocation.
+
+    The timings of all invocations are kept in timings as tuples of
+    the command line, the seconds until Maven printed its first line
+    of output, that is the startup overhead, and the seconds for the
+    whole invocation.
+    """
+
+    def __init__(self, command='mvn'):
+        self.command = command
+        self.timings = []
+
+    def run(self, args, build_log, cwd=None):
+        """Run Maven with args in directory cwd, default is the current one.
+
+        The output is written to build_log, see BuildLog.run.
+        """
+
+        cmd = [self.command] + args
+        start = time.time()
+        try:
+            build_log.run(cmd, cwd)
+        finally:
+            total = time.time() - start
+            startup = build_log.first_line
+            if startup is None:
+                startup = total
+            self.timings.append((" ".join(cmd), startup, total))
+
+
+def print_maven_timings(build_results):
+    """Print startup overhead of all Maven invocations of build_results."""
+
+    timings = [timing for build_result in build_results
+               for timing in build_result[5]]
+    if not timings:
+        return
+    startup = sum(timing[1] for timing in timings)
+    total = sum(timing[2] for timing in timings)
+    print("Maven needed %.2f of %.2f seconds for starting in %d "
+          "invocations." % (startup, total, len(timings)))
+    if cfg.CONF.debug:
+        for command, startup, total in timings:
+            print("  %s: %.2f seconds, %.2f seconds until started." %
+                  (command, total, startup))
+
+
+def is_build_cacheable(book):
+    """Return whether the build of directory book can be cached.
+
+    Books whose build runs other tools than Maven depend on files that
+    are not known to us.
+    """
+
+    base_book = os.path.basename(book)
+    return not (base_book in ('hot-guide', 'image-api-v2') or
+                (cfg.CONF.repo_name == "identity-api" and
+                 book.endswith("v3")))
+
+
+def get_shared_build_inputs():
+    """Return list of files read by the builds of all books.
+
+    These are the special files that affect all books and the entity
+    files found while scanning the books. Without a scan, the entity
+    files of the documentation directory are searched once.
+    """
+
+    global ENTITY_FILES
+    if ENTITY_FILES is None:
+        ENTITY_FILES = []
+        for root, dirs, files in os.walk(os.path.abspath(get_doc_path())):
+            dirs[:] = filter_dirs(dirs)
+            ENTITY_FILES.extend(os.path.join(root, f) for f in files
+                                if f.endswith('.ent'))
+    gitroot = get_gitroot()
+    return ([os.path.join(gitroot, f) for f in gitstate.SPECIAL_FILES] +
+            ENTITY_FILES)
+
+
+def get_input_references(path):
+    """Return absolute paths of the local files referenced by path.
+
+    Unlike get_references, every attribute of INPUT_REFERENCE_XPATH is a
+    reference, this finds for example grammars and samples of WADL
+    files. Returns an empty list if path is not an XML file.
+    """
+
+    try:
+        with open(path, 'rb') as fp:
+            data = fp.read()
+    except IOError:
+        return []
+    if not data.lstrip()[:1] == b'<':
+        return []
+    try:
+        doc = etree.fromstring(data)
+    except (etree.XMLSyntaxError, ValueError):
+        return []
+
+    root = os.path.dirname(path)
+    references = []
+    for href in doc.xpath(INPUT_REFERENCE_XPATH):
+        href = href.split('#', 1)[0]
+        if href and not URL_SCHEME_RE.match(href):
+            references.append(os.path.normpath(os.path.join(root, href)))
+    return references
+
+
+def get_build_inputs(book):
+    """Return sorted list of all files read by the build of book.
+
+    These are all files in the directory book, all files that are
+    referenced from files in there, directly or indirectly, the
+    pom.xml files of all parent directories and the files of
+    get_shared_build_inputs. Missing files are part of the list as well.
+    """
+
+    inputs = set(get_shared_build_inputs())
+    gitroot = get_gitroot()
+    parent = os.path.abspath(book)
+    while parent != gitroot and os.path.dirname(parent) != parent:
+        parent = os.path.dirname(parent)
+        inputs.add(os.path.join(parent, 'pom.xml'))
+
+    todo = []
+    for root, dirs, files in os.walk(book):
+        dirs[:] = filter_dirs(dirs)
+        for f in files:
+            path = os.path.abspath(os.path.join(root, f))
+            inputs.add(path)
+            if is_testable_xml_file(f, []):
+                todo.append(path)
+
+    while todo:
+        path = todo.pop()
+        if path.endswith('.xml'):
+            try:
+                references = [href_abs for _, _, href_abs
+                              in DOC_CACHE.get_references(path)]
+            except (etree.XMLSyntaxError, IOError, OSError):
+                continue
+        else:
+            references = get_input_references(path)
+        for href_abs in references:
+            if href_abs not in inputs:
+                inputs.add(href_abs)
+                if os.path.isfile(href_abs):
+                    todo.append(href_abs)
+    return sorted(inputs)
+
+
+def get_build_key(book, variant=None):
+    """Return key of the build of book for the BuildCache.
+
+    The key is a hash over the content of all files read by the build
+    and over all settings that change the build result. variant is the
+    profiling variant of the book if it is built several times.
+    """
+
+    sha1 = hashlib.sha1()
+    sha1.update(json.dumps([BuildCache.CACHE_VERSION,
+                            os_doc_tools.__version__,
+                            os.path.relpath(book, get_gitroot()),
+                            cfg.CONF.release_path,
+                            cfg.CONF.comments_enabled,
+                            cfg.CONF.language,
+                            variant]))
+    for path in get_build_inputs(book):
+        sha1.update(os.path.relpath(path, book))
+        if os.path.isfile(path):
+            sha1.update(get_file_hash(path))
+        else:
+            sha1.update('-')
+    return sha1.hexdigest()
+
+
+class BuildCache(object):
+    """Results of book builds, kept between runs.
+
+    For each book directory the build result of the last build is
+    stored together with its key, see get_build_key. If the key of a
+    new build is the same, the stored result is restored instead of
+    running Maven again.
+    """
+
+    # Version of the cache layout, increase on incompatible changes.
+    CACHE_VERSION = 2
+
+    # Directories of the build result, relative to the book directory.
+    OUTPUT_DIRS = ['target/docbkx/webhelp']
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.gitroot = get_gitroot()
+
+    def _entry_dir(self, book, variant):
+        rel = os.path.relpath(book, self.gitroot)
+        if variant is not None:
+            rel = "%s-%s" % (rel, variant)
+        return os.path.join(self.cache_dir, rel.replace(os.sep, '-'))
+
+    def _output_dirs(self, book):
+        output_dirs = list(self.OUTPUT_DIRS)
+        base_book = os.path.basename(book)
+        if base_book in BOOK_MAPPINGS:
+            output_dirs.append(BOOK_MAPPINGS[base_book])
+        return output_dirs
+
+    def has(self, book, key, variant=None):
+        """Return whether a build result of book with key is stored."""
+
+        key_file = os.path.join(self._entry_dir(book, variant), 'key')
+        try:
+            with open(key_file, 'r') as fp:
+                return fp.read() == key
+        except IOError:
+            return False
+
+    def restore(self, book, key, variant=None):
+        """Restore build result of book if it was built with key.
+
+        The result of a variant is restored to its directory, see
+        get_variant_dir. Returns True if the result was restored.
+        """
+
+        if not self.has(book, key, variant):
+            return False
+
+        entry_dir = self._entry_dir(book, variant)
+        build_dir = get_variant_dir(book, variant)
+        shutil.rmtree(os.path.join(build_dir, 'target'), ignore_errors=True)
+        for output_dir in self._output_dirs(book):
+            source = os.path.join(entry_dir, 'output', output_dir)
+            if os.path.isdir(source):
+                shutil.copytree(source, os.path.join(build_dir, output_dir))
+        return True
+
+    def store(self, book, key, variant=None):
+        """Store build result of book with key."""
+
+        entry_dir = self._entry_dir(book, variant)
+        build_dir = get_variant_dir(book, variant)
+        tmp_dir = "%s.%d" % (entry_dir, os.getpid())
+        try:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            for output_dir in self._output_dirs(book):
+                source = os.path.join(build_dir, output_dir)
+                if os.path.isdir(source):
+                    shutil.copytree(source, os.path.join(tmp_dir, 'output',
+                                                         output_dir))
+            with open(os.path.join(tmp_dir, 'key'), 'w') as fp:
+                fp.write(key)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.rename(tmp_dir, entry_dir)
+        except (IOError, OSError, shutil.Error) as e:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            print("Warning: cannot store build of %s in cache: %s" %
+                  (book, e))
+
+
+def get_book_variants(book):
+    """Return list of variants of book, [None] for books without."""
+
+    variants = BOOK_VARIANTS.get(os.path.basename(book))
+    if not variants:
+        return [None]
+    return list(variants)
+
+
+def get_variant_dir(book, variant):
+    """Return directory for building variant of book.
+
+    Variants are built in a hidden directory next to the book directory
+    so that relative references to other directories still work.
+    """
+
+    if variant is None:
+        return book
+    return os.path.join(os.path.dirname(book),
+                        ".%s-%s" % (os.path.basename(book), variant))
+
+
+def merge_variants(book, variants, publish_path):
+    """Merge build results of all variants of book and publish them.
+
+    The directories of the variants are removed afterwards.
+    """
+
+    target = os.path.join(book, 'target')
+    shutil.rmtree(target, ignore_errors=True)
+    for variant in variants:
+        variant_target = os.path.join(get_variant_dir(book, variant),
+                                      'target')
+        for root, dirs, files in os.walk(variant_target):
+            target_root = os.path.join(target,
+                                       os.path.relpath(root, variant_target))
+            if not os.path.isdir(target_root):
+                os.makedirs(target_root)
+            for f in files:
+                os.rename(os.path.join(root, f), os.path.join(target_root, f))
+        remove_variants(book, [variant])
+    publish_book(publish_path, os.path.basename(book), book)
+
+
+def remove_variants(book, variants):
+    """Remove directories of variants of book."""
+
+    for variant in variants:
+        shutil.rmtree(get_variant_dir(book, variant), ignore_errors=True)
+
+
+def build_book(book, publish_path, log_path, build_cache=None,
+               build_key=None, variant=None):
+    """Build book(s) in directory book.
+
+    Returns a tuple of the name of the book, the result, the last lines
+    of the output of the build, the returncode, the seconds needed for
+    building and the timings of the Maven invocations, see
+    MavenBackend. The complete output is written to a log file in
+    log_path.
+
+    If a BuildCache is passed as build_cache, the build result is
+    restored from it if the book did not change since the last build.
+    build_key is the key of the book, see get_build_key, it is computed
+    if it is not passed.
+
+    A variant of the book, see BOOK_VARIANTS, is built in its own
+    directory and not published, see merge_variants.
+    """
 
     # Note that we cannot build in parallel several books in the same
-    # directory like the Install Guide. Thus we build sequentially per
-    # directory.
-    os.chdir(book)
+    # directory. Variants are thus built in copies of the directory.
+    start = time.time()
     result = True
     returncode = 0
-    if cfg.CONF.debug:
-        print("Building in directory '%s'" % book)
     base_book = os.path.basename(book)
     base_book_orig = base_book
+    log_name = base_book
+    build_dir = get_variant_dir(book, variant)
+    if variant is not None:
+        variants = BOOK_VARIANTS[base_book]
+        label, operating_system, profile_os = variants[variant]
+        base_book = "%s (for %s)" % (base_book, label)
+        log_name = "%s-%s" % (log_name, variant)
+    if cfg.CONF.debug:
+        print("Building in directory '%s'" % build_dir)
     comments = "-Dcomments.enabled=%s" % cfg.CONF.comments_enabled
     release = "-Drelease.path.name=%s" % cfg.CONF.release_path
     if cfg.CONF.language:
-        out_filename = ("build-" + cfg.CONF.language + "-" + base_book +
+        out_filename = ("build-" + cfg.CONF.language + "-" + log_name +
                         ".log.gz")
     else:
-        out_filename = "build-" + base_book + ".log.gz"
-    out_file = gzip.open(os.path.join(log_path, out_filename), 'w')
-    output = ""
+        out_filename = "build-" + log_name + ".log.gz"
+    build_log = BuildLog(os.path.join(log_path, out_filename), base_book,
+                         cfg.CONF.verbose)
+
+    if build_cache is not None and is_build_cacheable(book):
+        if build_key is None:
+            build_key = get_build_key(book, variant)
+        if build_cache.restore(book, build_key, variant):
+            print("Book %s is unchanged, using build result from cache."
+                  % base_book)
+            build_log.write("Restored unchanged build result from cache.\n")
+            build_log.close()
+            if variant is None:
+                publish_book(publish_path, base_book_orig, book)
+            return (base_book, result, build_log.get_tail(), returncode,
+                    time.time() - start, [])
+
+    if variant is not None:
+        remove_variants(book, [variant])
+        shutil.copytree(book, build_dir,
+                        ignore=shutil.ignore_patterns('target'))
+
+    maven = MavenBackend(get_maven_command())
     try:
         # Clean first and then build so that the output of all guides
         # is available
-        output = subprocess.check_output(
-            ["mvn", "clean"],
-            stderr=subprocess.STDOUT
-        )
-        out_file.write(output)
-        if base_book == "install-guide":
-            # Build Debian
-            base_book = "install-guide (for debian)"
-            output = subprocess.check_output(
-                ["mvn", "generate-sources", "-B",
-                 comments, release,
-                 "-Doperating.system=apt-debian", "-Dprofile.os=debian"],
-                stderr=subprocess.STDOUT
-            )
-            out_file.write(output)
-            # Build Fedora
-            base_book = "install-guide (for Fedora)"
-            output = subprocess.check_output(
-                ["mvn", "generate-sources", "-B",
-                 comments, release,
-                 "-Doperating.system=yum",
-                 "-Dprofile.os=centos;fedora;rhel"],
-                stderr=subprocess.STDOUT
-            )
-            out_file.write(output)
-            # Build openSUSE
-            base_book = "install-guide (for openSUSE)"
-            output = subprocess.check_output(
-                ["mvn", "generate-sources", "-B",
-                 comments, release,
-                 "-Doperating.system=zypper", "-Dprofile.os=opensuse;sles"],
-                stderr=subprocess.STDOUT
-            )
-            out_file.write(output)
-            # Build Ubuntu
-            base_book = "install-guide (for Ubuntu)"
-            output = subprocess.check_output(
-                ["mvn", "generate-sources", "-B",
+        maven.run(["clean"], build_log, build_dir)
+        if variant is not None:
+            maven.run(
+                ["generate-sources", "-B",
                  comments, release,
-                 "-Doperating.system=apt", "-Dprofile.os=ubuntu"],
-                stderr=subprocess.STDOUT
-            )
-            # Success
-            base_book = "install-guide (for Debian, Fedora, openSUSE, Ubuntu)"
+                 "-Doperating.system=%s" % operating_system,
+                 "-Dprofile.os=%s" % profile_os],
+                build_log, build_dir)
         # HOT template guide
         elif base_book == 'hot-guide':
             # Make sure that the build dir is clean
-            if os.path.isdir('build'):
-                shutil.rmtree('build')
+            if os.path.isdir(os.path.join(build_dir, 'build')):
+                shutil.rmtree(os.path.join(build_dir, 'build'))
             # Generate the DN XML
-            output = subprocess.check_output(
-                ["make", "xml"],
-                stderr=subprocess.STDOUT
-            )
-            out_file.write(output)
+            build_log.run(["make", "xml"], build_dir)
             # Generate the docbook book
-            output = subprocess.check_output(
-                ["openstack-dn2osdbk", "build/xml", "build/docbook",
-                 "--toplevel", "book"],
-                stderr=subprocess.STDOUT
-            )
-            out_file.write(output)
-            output = subprocess.check_output(
-                ["mvn", "generate-sources", comments, release, "-B"],
-                stderr=subprocess.STDOUT
-            )
+            build_log.run(["openstack-dn2osdbk", "build/xml",
+                           "build/docbook", "--toplevel", "book"], build_dir)
+            maven.run(
+                ["generate-sources", comments, release, "-B"], build_log,
+                build_dir)
         # Repository: identity-api
         elif (cfg.CONF.repo_name == "identity-api"
               and book.endswith("v3")):
-            output = subprocess.check_output(
+            build_log.run(
                 ["bash", os.path.join(SCRIPTS_DIR, "markdown-docbook.sh"),
-                 "identity-api-v3"],
-                stderr=subprocess.STDOUT
-            )
-            out_file.write(output)
+                 "identity-api-v3"], build_dir)
             # File gets generated at wrong directory, we need to move it
             # around
-            if os.path.isfile('identity-api-v3.xml'):
-                os.remove('identity-api-v3.xml')
-            shutil.move("src/markdown/identity-api-v3.xml", ".")
-            output = subprocess.check_output(
-                ["mvn", "generate-sources", comments, release, "-B"],
-                stderr=subprocess.STDOUT
-            )
+            target = os.path.join(build_dir, 'identity-api-v3.xml')
+            if os.path.isfile(target):
+                os.remove(target)
+            shutil.move(os.path.join(build_dir, "src", "markdown",
+                                     "identity-api-v3.xml"), target)
+            maven.run(
+                ["generate-sources", comments, release, "-B"], build_log,
+                build_dir)
         # Repository: image-api
         elif base_book == 'image-api-v2':
-            output = subprocess.check_output(
+            build_log.run(
                 ["bash", os.path.join(SCRIPTS_DIR, "markdown-docbook.sh"),
-                 "image-api-v2.0"],
-                stderr=subprocess.STDOUT
-            )
-            out_file.write(output)
-            output = subprocess.check_output(
-                ["mvn", "generate-sources", comments, release, "-B"],
-                stderr=subprocess.STDOUT
-            )
+                 "image-api-v2.0"], build_dir)
+            maven.run(
+                ["generate-sources", comments, release, "-B"], build_log,
+                build_dir)
         else:
-            output = subprocess.check_output(
-                ["mvn", "generate-sources", comments, release, "-B"],
-                stderr=subprocess.STDOUT
-            )
-    except (subprocess.CalledProcessError, KeyboardInterrupt) as e:
-        output = e.output
+            maven.run(
+                ["generate-sources", comments, release, "-B"], build_log,
+                build_dir)
+    except subprocess.CalledProcessError as e:
         returncode = e.returncode
         result = False
+    except KeyboardInterrupt:
+        returncode = 1
+        result = False
 
-    out_file.write(output)
-    out_file.close()
+    for command, startup, total in maven.timings:
+        build_log.write("Invocation '%s' took %.2f seconds, %.2f seconds "
+                        "until Maven started.\n" % (command, total, startup))
+    build_log.close()
     if result:
-        publish_book(publish_path, base_book_orig)
-    return (base_book, result, output, returncode)
+        if build_cache is not None and build_key is not None:
+            build_cache.store(book, build_key, variant)
+        if variant is None:
+            publish_book(publish_path, base_book_orig, book)
+    return (base_book, result, build_log.get_tail(), returncode,
+            time.time() - start, maven.timings)
 
 
 def is_book_master(filename):
@@ -994,51 +2525,60 @@ def is_book_master(filename):
             filename == 'openstack-glossary.xml')
 
 
-def print_unused(rootdir, ignore_dirs, included_by):
+def get_unused_files(scan):
+    """Return sorted list of XML files that are not part of any book.
+
+    These are all XML files of scan, a BookScan, that cannot be reached
+    from a book master file by following includes.
+    """
+
+    includes = scan.get_includes()
+    reachable = set(path for path, info in scan.metadata.items()
+                    if info.master)
+    stack = list(reachable)
+    while stack:
+        for g in includes.get(stack.pop(), ()):
+            if g not in reachable:
+                reachable.add(g)
+                stack.append(g)
+    return sorted(path for path in scan.metadata
+                  if path.endswith('.xml') and path not in reachable and
+                  os.path.basename(path) != 'pom.xml')
+
+
+def print_unused(rootdir, scan):
     """Print list of files that are not included anywhere."""
 
     if cfg.CONF.print_unused_files:
         print("Checking for files that are not included anywhere...")
         print(" Note: This only looks at files included by an .xml file "
               "but not for files included by other files like .wadl.")
-        for root, dirs, files in os.walk(rootdir):
-            dirs[:] = filter_dirs(dirs)
-
-            # Filter out directories to be ignored
-            if ignore_dirs:
-                dirs[:] = [d for d in dirs if d not in ignore_dirs]
-
-            for f in files:
-                if not f.endswith('.xml'):
-                    continue
-                f_base = os.path.basename(f)
-                f_abs = os.path.abspath(os.path.join(root, f))
-
-                if (f_abs not in included_by and f_base != "pom.xml"
-                   and not is_book_master(f_base)):
-                    f_rel = os.path.relpath(f_abs, rootdir)
-                    print ("  %s " % f_rel)
+        for path in get_unused_files(scan):
+            print ("  %s " % os.path.relpath(path, rootdir))
         print("\n")
 
 
-def generate_affected_books(rootdir, book_bk, ignore_dirs, abs_ignore_dirs,
-                            included_by):
-    """Generate list of affected books."""
+def generate_affected_books(rootdir, scan, modified_files=None,
+                            chains=None):
+    """Generate list of affected books.
+
+    scan is the BookScan of rootdir, modified_files is a list of
+    absolute paths, if None the files modified by the tested change
+    are used. If a dictionary is passed as chains, it is filled with
+    the shortest include chain from a modified file to the book master
+    file for each affected book.
+    """
 
     affected_books = set()
 
     # Generate list of modified_files
     # Do not select deleted files, just Added, Copied, Modified, Renamed,
     # or Type changed
-    modified_files = get_modified_files(rootdir, "--diff-filter=ACMRT")
-    modified_files = [os.path.abspath(f) for f in modified_files]
-    if ignore_dirs:
-        for idir in abs_ignore_dirs:
-            non_ignored_files = []
-            for f in modified_files:
-                if not f.startswith(idir):
-                    non_ignored_files.append(f)
-            modified_files = non_ignored_files
+    if modified_files is None:
+        modified_files = get_modified_files(rootdir, "ACMRT")
+        modified_files = [os.path.join(rootdir, f) for f in modified_files]
+    modified_files = [f for f in modified_files
+                      if not scan.ignored.contains(f)]
 
     # 2. Find all modified files and where they are included
 
@@ -1049,164 +2589,377 @@ def generate_affected_books(rootdir, book_bk, ignore_dirs, abs_ignore_dirs,
     # All files that are affected (either directly or indirectly)
     affected_files = set(modified_files)
 
+    included_by = scan.included_by
+    metadata = scan.metadata
+    # File each file was reached from, for the include chains.
+    parents = {}
+
     # 3. Iterate over files that have includes on modified files
     # and build a closure - the set of all files (affected_files)
     # that have a path to a modified file via includes.
-    while len(new_files) > 0:
+    while new_files:
         new_files_to_check = new_files
         new_files = []
         for f in new_files_to_check:
-            if "doc/hot-guide/" in f:
-                affected_books.add('hot-guide')
-                continue
-            # Skip bk*.xml files
-            if is_book_master(os.path.basename(f)):
-                book_modified = book_bk[f]
-                if book_modified not in affected_books:
-                    affected_books.add(book_modified)
+            info = metadata.get(f)
+            if info is None:
+                info = scan.add_file(f, None)
+            # Book master files and files of special books are built
+            # directly.
+            if info.route is not None:
+                if chains is not None and info.route not in chains:
+                    chain = [f]
+                    while chain[-1] in parents:
+                        chain.append(parents[chain[-1]])
+                    chains[info.route] = chain[::-1]
+                affected_books.add(info.route)
                 continue
-            if f not in included_by:
-                continue
-            for g in included_by[f]:
+            for g in included_by.get(f, ()):
                 if g not in affected_files:
                     new_files.append(g)
                     affected_files.add(g)
+                    if chains is not None:
+                        parents[g] = f
     return affected_books
 
 
-def find_affected_books(rootdir, book_exceptions, file_exceptions,
-                        force, ignore_dirs):
-    """Check which books are affected by modified files.
+class PathTrie(object):
+    """Set of directories that finds whether a path is in one of them.
+
+    A lookup takes one step per component of the path, independent of
+    the number of directories.
+    """
 
-    Returns a set with books.
+    def __init__(self, directories=()):
+        self.root = {}
+        for directory in directories:
+            self.add(directory)
+
+    def add(self, directory):
+        """Add directory to the set."""
+
+        node = self.root
+        for part in directory.split(os.sep):
+            if part:
+                node = node.setdefault(part, {})
+        node[None] = True
+
+    def contains(self, path):
+        """Return whether path is one of the directories or below one."""
+
+        node = self.root
+        for part in path.split(os.sep):
+            if None in node:
+                return True
+            if part:
+                node = node.get(part)
+                if node is None:
+                    return False
+        return None in node
+
+
+# Metadata of a file found by scan_books: book is the directory of the
+# book containing the file or None if unknown, master is True for book
+# master files, route is the book to build if the file is affected by
+# a modification or None if the books including the file are built.
+FileMetadata = collections.namedtuple('FileMetadata',
+                                      ['book', 'master', 'route'])
+
+
+class BookScan(object):
+    """Books, includes and file metadata found by scan_books.
+
+    :ivar books: list of book directories
+    :ivar book_bk: dictionary with the book directory of each book
+                   master file
+    :ivar included_by: dictionary with the set of files including each
+                       file
+    :ivar abs_ignore_dirs: list of absolute paths of ignored directories
+    :ivar ignored: PathTrie of abs_ignore_dirs
+    :ivar metadata: dictionary with the FileMetadata of each file
+    :ivar entities: list of entity files
     """
-    book_root = rootdir
 
-    books = []
+    def __init__(self):
+        self.books = []
+        self.book_bk = {}
+        self.included_by = {}
+        self.abs_ignore_dirs = []
+        self.ignored = PathTrie()
+        self.metadata = {}
+        self.entities = []
+
+    def get_includes(self):
+        """Return dictionary with the set of files included by each file."""
+
+        includes = {}
+        for target, sources in self.included_by.items():
+            for source in sources:
+                includes.setdefault(source, set()).add(target)
+        return includes
+
+    def add_file(self, path, book):
+        """Add metadata of path in the book directory book."""
+
+        master = is_book_master(os.path.basename(path))
+        if master and book is not None:
+            self.book_bk[path] = book
+        # The Heat Orchestration Template guide is generated from
+        # files that are not included by DocBook files.
+        if "doc/hot-guide/" in path:
+            route = 'hot-guide'
+        elif master and book is not None:
+            route = book
+        else:
+            route = None
+        info = FileMetadata(book, master, route)
+        self.metadata[path] = info
+        return info
 
-    build_all_books = (force or check_modified_affects_all(rootdir) or
-                       cfg.CONF.only_book)
 
-    # Dictionary that contains a set of files.
-    # The key is a filename, the set contains files that include this file.
-    included_by = {}
+def scan_books(rootdir, book_exceptions, file_exceptions, ignore_dirs,
+               collect_includes=True, only_books=None):
+    """Find books and the files they include below rootdir.
 
-    # Dictionary with books and their bk*.xml files
-    book_bk = {}
+    Returns a BookScan. The includes are only collected if
+    collect_includes is True. If only_books is given, only books with
+    these names are listed.
+    """
+
+    scan = BookScan()
+    # Book directories containing root, the innermost is last.
+    book_roots = []
 
-    # List of absolute paths of ignored directories
-    abs_ignore_dirs = []
     # 1. Iterate over whole tree and analyze include files.
     # This updates included_by, book_bk and books.
     for root, dirs, files in os.walk(rootdir):
         dirs[:] = filter_dirs(dirs)
+        while book_roots and not (root + os.sep).startswith(
+                book_roots[-1] + os.sep):
+            book_roots.pop()
+        scan.entities.extend(os.path.abspath(os.path.join(root, f))
+                             for f in files if f.endswith('.ent'))
 
         # Filter out directories to be ignored
         if ignore_dirs:
             for d in dirs:
                 if d in ignore_dirs:
-                    abs_ignore_dirs.append(
-                        os.path.join(os.path.join(root, d)))
+                    idir = os.path.abspath(os.path.join(root, d))
+                    scan.abs_ignore_dirs.append(idir)
+                    scan.ignored.add(idir)
             dirs[:] = [d for d in dirs if d not in ignore_dirs]
 
         if os.path.basename(root) in book_exceptions:
             break
         # Do not process files in doc itself or top-level directory
         elif root.endswith('doc') or root == rootdir:
+            for f in files:
+                scan.add_file(os.path.abspath(os.path.join(root, f)), None)
             continue
-        elif ("pom.xml" in files and (not cfg.CONF.only_book or
+        elif ("pom.xml" in files and (not only_books or
                                       os.path.basename(root) in
-                                      cfg.CONF.only_book)):
-                books.append(root)
-                book_root = root
+                                      only_books)):
+                scan.books.append(root)
+                book_roots.append(root)
+
+        book_root = book_roots[-1] if book_roots else None
+        for f in files:
+            scan.add_file(os.path.abspath(os.path.join(root, f)), book_root)
 
         # No need to check single books if we build all, we just
         # collect list of books
-        if build_all_books:
+        if not collect_includes:
             continue
 
+        included_by = scan.included_by
         for f in files:
-            f_base = os.path.basename(f)
             f_abs = os.path.abspath(os.path.join(root, f))
-            if is_book_master(f_base):
-                book_bk[f_abs] = book_root
             if not is_testable_xml_file(f, file_exceptions):
                 continue
 
             try:
-                doc = etree.parse(f_abs)
+                references = DOC_CACHE.get_references(f_abs)
             except etree.XMLSyntaxError as e:
                 print("  Warning: file %s is invalid XML: %s" % (f_abs, e))
                 continue
-            for node in doc.findall(
-                    '//{http://docbook.org/ns/docbook}imagedata'):
-                href = node.get('fileref')
-                href_abs = os.path.abspath(os.path.join(root, href))
+            for _, _, href_abs in references:
                 if href_abs in included_by:
                     included_by[href_abs].add(f_abs)
                 else:
                     included_by[href_abs] = set([f_abs])
 
-            ns = {"xi": "http://www.w3.org/2001/XInclude"}
-            for node in doc.xpath('//xi:include', namespaces=ns):
-                href = node.get('href')
-                href_abs = os.path.abspath(os.path.join(root, href))
-                if href_abs in included_by:
-                    included_by[href_abs].add(f_abs)
-                else:
-                    included_by[href_abs] = set([f_abs])
+    return scan
 
-            ns = {"wadl": "http://wadl.dev.java.net/2009/02"}
-            for node in doc.xpath('//wadl:resource', namespaces=ns):
-                href = node.get('href')
-                hash_sign = href.rfind('#')
-                if hash_sign != -1:
-                    href = href[:hash_sign]
-                href_abs = os.path.abspath(os.path.join(root, href))
-                if href_abs in included_by:
-                    included_by[href_abs].add(f_abs)
-                else:
-                    included_by[href_abs] = set([f_abs])
-            for node in doc.xpath('//wadl:resources', namespaces=ns):
-                href = node.get('href')
-                # wadl:resources either have a href directly or a child
-                # wadl:resource that has a href. So, check that we have
-                # a href.
-                if href:
-                    hash_sign = href.rfind('#')
-                    if hash_sign != -1:
-                        href = href[:hash_sign]
-                    href_abs = os.path.abspath(os.path.join(root, href))
-                    if href_abs in included_by:
-                        included_by[href_abs].add(f_abs)
-                    else:
-                        included_by[href_abs] = set([f_abs])
-
-    print_unused(rootdir, ignore_dirs, included_by)
+
+def find_affected_books(rootdir, book_exceptions, file_exceptions,
+                        force, ignore_dirs, chains=None, quiet=False):
+    """Check which books are affected by modified files.
+
+    Returns a set with books. chains is filled with include chains if
+    given, see generate_affected_books. If quiet is True, the reason
+    for building all books is not printed.
+    """
+
+    build_all_books = (force or check_modified_affects_all(rootdir) or
+                       cfg.CONF.only_book)
+
+    scan = scan_books(rootdir, book_exceptions, file_exceptions,
+                      ignore_dirs,
+                      not build_all_books or cfg.CONF.print_unused_files,
+                      cfg.CONF.only_book)
+    books = scan.books
+
+    DOC_CACHE.book_bk.update(scan.book_bk)
+    # Entity files are part of the keys of the builds, see
+    # get_build_key.
+    global ENTITY_FILES
+    ENTITY_FILES = scan.entities
+
+    print_unused(rootdir, scan)
 
     if cfg.CONF.only_book:
-        print("Building specified books.")
+        if not quiet:
+            print("Building specified books.")
     elif build_all_books:
-        print("Building all books.")
+        if not quiet:
+            print("Building all books.")
     else:
-        affected_books = generate_affected_books(rootdir, book_bk, ignore_dirs,
-                                                 abs_ignore_dirs, included_by)
+        affected_books = generate_affected_books(rootdir, scan,
+                                                 chains=chains)
         if affected_books:
             books = affected_books
-        else:
+        elif not quiet:
             print("No books are affected by modified files. "
                   "Building all books.")
 
     return books
 
 
+def get_book_of_file(path, rootdir):
+    """Return directory of the book containing path.
+
+    That is the closest directory above path that contains a pom.xml
+    file, None if there is none.
+    """
+
+    directory = os.path.dirname(path)
+    while directory.startswith(os.path.join(rootdir, '')):
+        if os.path.isfile(os.path.join(directory, 'pom.xml')):
+            return directory
+        directory = os.path.dirname(directory)
+    return None
+
+
+def update_includes(included_by, includes, path, file_exceptions):
+    """Update the include graph for the changed or removed file path.
+
+    included_by is the dictionary returned by scan_books, includes
+    the reverse dictionary with the set of files included by each file.
+    """
+
+    for href_abs in includes.pop(path, ()):
+        included_by[href_abs].discard(path)
+    if (not os.path.isfile(path) or
+            not is_testable_xml_file(path, file_exceptions)):
+        return
+    try:
+        references = DOC_CACHE.get_references(path)
+    except etree.XMLSyntaxError:
+        # Reported by the validation.
+        return
+    hrefs = set(href_abs for _, _, href_abs in references)
+    includes[path] = hrefs
+    for href_abs in hrefs:
+        included_by.setdefault(href_abs, set()).add(path)
+
+
+def watch_files(rootdir, book_exceptions, build_file_exceptions,
+                file_exceptions, ignore_dirs, cache=None):
+    """Validate changed files and report affected books, until interrupted.
+
+    Compiled schemas, parsed documents and the include graph are kept
+    between changes, so that only the changed files are validated and
+    scanned again.
+    """
+
+    CONF = cfg.CONF
+    print("Scanning files below %s..." % rootdir)
+    scan = scan_books(rootdir, book_exceptions, build_file_exceptions,
+                      ignore_dirs, only_books=CONF.only_book)
+    included_by = scan.included_by
+    DOC_CACHE.book_bk.update(scan.book_bk)
+    includes = {}
+    for href_abs, files in included_by.items():
+        for f in files:
+            includes.setdefault(f, set()).add(href_abs)
+    if CONF.check_syntax:
+        # Compile the schema now and not on the first change.
+        get_schema(CONF.api_site)
+
+    file_watcher = watcher.FileWatcher(rootdir, filter_dirs,
+                                       CONF.watch_interval)
+    print("Watching %d books for changes, press Ctrl-C to stop.\n" %
+          len(scan.books))
+    try:
+        while True:
+            changed, removed = file_watcher.wait()
+            start = time.time()
+            for path in changed + removed:
+                update_includes(included_by, includes, path,
+                                build_file_exceptions)
+                if path not in scan.metadata:
+                    scan.add_file(path, get_book_of_file(path, rootdir))
+
+            for path in removed:
+                if included_by.get(path):
+                    print("Removed file %s is still referenced by:" %
+                          os.path.relpath(path, rootdir))
+                    for f in sorted(included_by[path]):
+                        print("  %s" % os.path.relpath(f, rootdir))
+
+            to_validate = [f for f in changed
+                           if is_testable_file(f, file_exceptions)]
+            if to_validate and (CONF.check_syntax or CONF.check_niceness or
+                                CONF.check_links):
+                validate_individual_files(to_validate, rootdir,
+                                          CONF.verbose,
+                                          CONF.check_syntax,
+                                          CONF.check_niceness,
+                                          CONF.check_links,
+                                          CONF.api_site,
+                                          CONF.jobs,
+                                          cache)
+
+            affected_books = generate_affected_books(rootdir, scan, changed)
+            if affected_books:
+                print("Affected books: %s" %
+                      ", ".join(sorted(os.path.relpath(book, rootdir)
+                                       if os.path.isabs(book) else book
+                                       for book in affected_books)))
+            print("Handled %d changed files in %.2f seconds.\n" %
+                  (len(changed) + len(removed), time.time() - start))
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+
 def generate_index_file():
-    """Generate index.html file in publish_path."""
+    """Generate index.html file in publish_path.
+
+    The books are listed from their manifests, see write_book_manifest,
+    books without manifest are found with scan_published_books. A JSON
+    catalog of all books is written as catalog.json and, if the
+    URL of the site is known, a sitemap as sitemap.xml.
+    """
 
     publish_path = get_publish_path()
     if not os.path.isdir(publish_path):
         os.mkdir(publish_path)
 
+    manifests = load_book_manifests(publish_path)
+    manifests = sorted(manifests + scan_published_books(publish_path,
+                                                        manifests),
+                       key=operator.itemgetter('path'))
+
     index_file = open(os.path.join(get_publish_path(), 'index.html'), 'w')
 
     index_file.write(
@@ -1216,33 +2969,23 @@ def generate_index_file():
         '<body>\n'
         '<h1>Results of checkbuild</h1>\n')
 
-    for root, dirs, files in os.walk(publish_path):
-
-        dirs[:] = [d for d in dirs if d not in ['common', 'webapp', 'content']]
-
-        # Ignore top-level index.html files
-        if root == publish_path:
-            continue
-
-        if os.path.isfile(os.path.join(root, 'content/index.html')):
-            path = os.path.relpath(root, publish_path)
-            index_file.write('<a href="%s/content/index.html">%s</a>\n' %
-                             (path, path))
-            index_file.write('<br/>\n')
-
-        if os.path.isfile(os.path.join(root, 'api-ref.html')):
-            path = os.path.relpath(root, publish_path)
-            index_file.write('<a href="%s/api-ref.html">%s</a>\n' %
-                             (path, path))
+    for manifest in manifests:
+        for entry in manifest['entry_points']:
+            path = entry['path']
+            if path.endswith('/content/index.html'):
+                name = path[:-len('/content/index.html')]
+            else:
+                name = os.path.dirname(path)
+            index_file.write('<a href="%s">%s</a>\n' % (path, name))
             index_file.write('<br/>\n')
 
         # List PDF files for api-site that have from "bk-api-ref*.pdf"
         # as well since they have no corresponding html file.
-        for f in files:
-            if f.startswith('bk-api-ref') and f.endswith('.pdf'):
-                path = os.path.relpath(root, publish_path)
-                index_file.write('<a href="%s/%s">%s</a>\n' %
-                                 (path, f, f))
+        for entry in manifest['pdfs']:
+            f = os.path.basename(entry['path'])
+            if f.startswith('bk-api-ref'):
+                index_file.write('<a href="%s">%s</a>\n' %
+                                 (entry['path'], f))
                 index_file.write('<br/>\n')
 
     if os.path.isfile(os.path.join(get_publish_path(), 'www-index.html')):
@@ -1253,6 +2996,214 @@ def generate_index_file():
                      '</html>\n')
     index_file.close()
 
+    with open(os.path.join(publish_path, 'catalog.json'), 'w') as fp:
+        json.dump({'books': manifests}, fp, indent=2, sort_keys=True)
+
+    if cfg.CONF.site_url:
+        generate_sitemap(publish_path, manifests, cfg.CONF.site_url)
+
+
+def generate_sitemap(publish_path, manifests, site_url):
+    """Write sitemap.xml with the entry points of all books."""
+
+    ns = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+    urlset = etree.Element('{%s}urlset' % ns, nsmap={None: ns})
+    for manifest in manifests:
+        for entry in manifest['entry_points'] + manifest['pdfs']:
+            url = etree.SubElement(urlset, '{%s}url' % ns)
+            etree.SubElement(url, '{%s}loc' % ns).text = (
+                site_url.rstrip('/') + '/' + entry['path'])
+    etree.ElementTree(urlset).write(
+        os.path.join(publish_path, 'sitemap.xml'), encoding='UTF-8',
+        xml_declaration=True, pretty_print=True)
+
+
+def load_build_times(times_file):
+    """Return dictionary with seconds needed for building each book."""
+
+    try:
+        with open(times_file, 'r') as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_build_times(times_file, build_times):
+    """Save seconds needed for building each book for the next run."""
+
+    try:
+        write_file_atomically(times_file, json.dumps(build_times))
+    except (IOError, OSError) as e:
+        print("Warning: cannot write build times %s: %s" % (times_file, e))
+
+
+def warm_up_maven(book, log_path):
+    """Download the Maven plugins used by book into the local repository.
+
+    Returns True on success.
+    """
+
+    print("Preparing local Maven repository using %s..." %
+          os.path.basename(book))
+    result = True
+    maven = MavenBackend(get_maven_command())
+    build_log = BuildLog(os.path.join(log_path, "build-maven.log.gz"),
+                         "maven", cfg.CONF.verbose)
+    try:
+        maven.run(["dependency:resolve-plugins", "-B"], build_log, cwd=book)
+    except subprocess.CalledProcessError:
+        result = False
+        print("Warning: preparing the local Maven repository failed, "
+              "see build-maven.log.gz.")
+    build_log.close()
+    return result
+
+
+def get_build_jobs(books, publish_path, log_path, build_cache,
+                   build_times):
+    """Return jobs for building books with scheduler.Scheduler.
+
+    Returns a tuple of the list of jobs and of a dictionary with book
+    and variant of each job by name of the job.
+    """
+
+    jobs = []
+    job_variants = {}
+    for book in sorted(books):
+        variants = get_book_variants(book)
+        for variant in variants:
+            build_key = None
+            if build_cache is not None and is_build_cacheable(book):
+                build_key = get_build_key(book, variant)
+            name = os.path.relpath(book, log_path)
+            if variant is not None:
+                name = "%s:%s" % (name, variant)
+            job_variants[name] = (book, variant)
+            # Books with a stored build result do not run Maven.
+            jobs.append(scheduler.Job(
+                name, get_variant_dir(book, variant), build_book,
+                (book, publish_path, log_path, build_cache, build_key,
+                 variant),
+                estimate=build_times.get(name),
+                light=(build_key is not None and
+                       build_cache.has(book, build_key, variant))))
+    return jobs, job_variants
+
+
+def estimate_build_time(jobs, workers, default_estimate):
+    """Return seconds needed for running jobs with workers processes.
+
+    Jobs are started in the order of the scheduler, each on the process
+    that is free first. Light jobs are assumed to take no time, jobs
+    without estimate default_estimate seconds.
+    """
+
+    free_at = [0.0] * max(1, workers)
+    for job in scheduler.Scheduler.order(jobs):
+        if job.light:
+            continue
+        duration = job.estimate
+        if duration is None:
+            duration = default_estimate
+        start = heapq.heappop(free_at)
+        heapq.heappush(free_at, start + duration)
+    return max(free_at)
+
+
+def format_duration(seconds):
+    """Return seconds as text with minutes and seconds."""
+
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    if minutes:
+        return "%d min %d s" % (minutes, seconds)
+    return "%d s" % seconds
+
+
+def explain_build(rootdir, book_exceptions, file_exceptions, force=False,
+                  ignore_dirs=None):
+    """Print which books would be built, why and how long it would take.
+
+    Uses the same selection of books as build_affected_books and the
+    durations of earlier builds, no book is built.
+    """
+
+    if ignore_dirs is None:
+        ignore_dirs = []
+
+    special_files = get_repository_state().get_special_files()
+    chains = {}
+    books = find_affected_books(rootdir, book_exceptions, file_exceptions,
+                                force, ignore_dirs, chains, quiet=True)
+    log_path = get_gitroot()
+    build_cache = None
+    build_times = {}
+    if not cfg.CONF.no_cache:
+        build_cache = BuildCache(os.path.join(get_cache_dir(), 'builds'))
+        build_times = load_build_times(
+            os.path.join(get_cache_dir(), 'build-times.json'))
+    jobs, job_variants = get_build_jobs(books, get_publish_path(), log_path,
+                                        build_cache, build_times)
+
+    if force:
+        reason = "--force builds all books"
+    elif cfg.CONF.only_book:
+        reason = "book is given with --only-book"
+    elif special_files:
+        reason = ("%s is modified, this affects all books" %
+                  os.path.relpath(os.path.join(get_gitroot(),
+                                               special_files[0]), rootdir))
+    else:
+        reason = ("no book is affected by modified files, so all books would "
+                  "be built")
+
+    print("Books that would be built:")
+    for job in sorted(jobs, key=operator.attrgetter('name')):
+        book, variant = job_variants[job.name]
+        if job.light:
+            duration = "unchanged, from build cache"
+        elif job.estimate is None:
+            duration = "no earlier build"
+        else:
+            duration = format_duration(job.estimate)
+        print("  %s (%s)" % (job.name, duration))
+        chain = chains.get(book)
+        if chain is None:
+            print("    because %s" % reason)
+        else:
+            print("    because %s" % " is included by ".join(
+                os.path.relpath(f, rootdir) for f in chain))
+
+    maven_jobs = [job for job in jobs if not job.light]
+    if not maven_jobs:
+        print("No book needs to be built with Maven.\n")
+        return
+
+    if cfg.CONF.debug or not cfg.CONF.parallel:
+        workers = 1
+    else:
+        workers = scheduler.Scheduler(cfg.CONF.build_jobs).max_jobs
+        available = scheduler.get_available_memory()
+        if available is not None:
+            # Builds are only started while enough memory is free.
+            workers = max(1, min(workers, available //
+                                 (cfg.CONF.build_memory * 1024 * 1024)))
+    known = [job.estimate for job in maven_jobs if job.estimate is not None]
+    if not known:
+        print("\nNo build durations are recorded yet, the build time "
+              "cannot be estimated.\n")
+        return
+    unknown = len(maven_jobs) - len(known)
+    default_estimate = sum(known) / len(known)
+    print("\nEstimated build time with %d parallel builds: %s for %d "
+          "builds." % (workers,
+                       format_duration(estimate_build_time(
+                           jobs, workers, default_estimate)),
+                       len(maven_jobs)))
+    if unknown:
+        print("%d builds without earlier duration are assumed to take "
+              "%s each." % (unknown, format_duration(default_estimate)))
+    print("")
+
 
 def build_affected_books(rootdir, book_exceptions, file_exceptions,
                          force=False, ignore_dirs=None):
@@ -1263,6 +3214,9 @@ def build_affected_books(rootdir, book_exceptions, file_exceptions,
     one XML file includes a modified file the method calls
     "mvn clean generate-sources" in that directory.
 
+    Books are built in parallel, see scheduler.Scheduler, books that
+    took longest in earlier runs are started first.
+
     This will throw an exception if a book fails to build
     """
 
@@ -1276,64 +3230,93 @@ def build_affected_books(rootdir, book_exceptions, file_exceptions,
     shutil.rmtree(os.path.expanduser("~/.fop"),
                   ignore_errors=True)
 
-    maxjobs = multiprocessing.cpu_count()
-    # Jenkins fails sometimes with errors if too many jobs run, artificially
-    # limit to 4 for now.
-    # See https://bugs.launchpad.net/openstack-manuals/+bug/1221721
-    if maxjobs > 4:
-        maxjobs = 4
-    pool = multiprocessing.Pool(maxjobs)
     print("Queuing the following books for building:")
     publish_path = get_publish_path()
     log_path = get_gitroot()
-    first_book = True
+    # Start a new list of published changes.
+    open(get_publish_manifest(publish_path), 'w').close()
+    build_cache = None
+    build_times = {}
+    if not cfg.CONF.no_cache:
+        build_cache = BuildCache(os.path.join(get_cache_dir(), 'builds'))
+        times_file = os.path.join(get_cache_dir(), 'build-times.json')
+        build_times = load_build_times(times_file)
 
     # First show books
     for book in sorted(books):
         print("  %s" % os.path.basename(book))
     print("Building all queued %d books now..." % len(books))
 
-    # And then queue - since we wait for the first book to finish.
-    try:
-        for book in sorted(books):
-            if cfg.CONF.debug or not cfg.CONF.parallel:
-                (book, result, output, retcode) = build_book(book,
-                                                             publish_path,
-                                                             log_path)
-                logging_build_book([book, result, output, retcode])
+    jobs, job_variants = get_build_jobs(books, publish_path, log_path,
+                                        build_cache, build_times)
+    # Results of the variants of each book that finished.
+    variant_results = {}
+
+    def finished(job, result):
+        logging_build_book(result)
+        if result[1] and not job.light:
+            build_times[job.name] = result[4]
+        book, variant = job_variants[job.name]
+        if variant is None:
+            return
+        # Publish variants together once all of them are built.
+        results = variant_results.setdefault(book, [])
+        results.append(result[1])
+        variants = get_book_variants(book)
+        if len(results) == len(variants):
+            if all(results):
+                merge_variants(book, variants, publish_path)
             else:
-                res = pool.apply_async(build_book,
-                                       (book, publish_path, log_path),
-                                       callback=logging_build_book)
-                if first_book:
-                    first_book = False
-                    # The first invocation of maven might download loads of
-                    # data locally, we cannot do this in parallel. So, wait
-                    # here for the first job to finish before running further
-                    # mvn jobs.
-                    res.get()
-        pool.close()
-        pool.join()
+                remove_variants(book, variants)
+
+    build_scheduler = scheduler.Scheduler(
+        cfg.CONF.build_jobs, cfg.CONF.build_memory * 1024 * 1024)
+    try:
+        if cfg.CONF.debug or not cfg.CONF.parallel:
+            build_scheduler.run_sequential(jobs, finished)
+        else:
+            maven_jobs = [job for job in jobs if not job.light]
+            # The first invocation of maven might download loads of
+            # data locally, we cannot do this in parallel. If preparing
+            # the local repository fails, the first book is built alone.
+            warmed_up = True
+            if len(maven_jobs) > 1:
+                book = job_variants[maven_jobs[0].name][0]
+                warmed_up = warm_up_maven(book, log_path)
+            build_scheduler.run(jobs, finished, exclusive_first=not warmed_up)
     except KeyboardInterrupt:
-        pool.terminate()
-        pool.join()
+        pass
+    finally:
+        # Variants of books whose builds raised an exception or were
+        # interrupted are neither merged nor removed yet.
+        for book in set(book for book, variant in job_variants.values()
+                        if variant is not None):
+            variants = get_book_variants(book)
+            if len(variant_results.get(book, [])) < len(variants):
+                remove_variants(book, variants)
+
+    if not cfg.CONF.no_cache:
+        save_build_times(times_file, build_times)
 
     any_failures = False
-    for book, result, _, _ in sorted(RESULTS_OF_BUILDS,
-                                     key=operator.itemgetter(0)):
+    for book, result, _, _, _, _ in sorted(RESULTS_OF_BUILDS,
+                                           key=operator.itemgetter(0)):
         if result:
             print(">>> Build of book %s succeeded." % book)
         else:
             any_failures = True
+    print_maven_timings(RESULTS_OF_BUILDS)
 
     if cfg.CONF.create_index:
         generate_index_file()
 
     if any_failures:
-        for book, result, output, returncode in RESULTS_OF_BUILDS:
+        for book, result, output, returncode, _, _ in RESULTS_OF_BUILDS:
             if not result:
                 print(">>> Build of book %s failed (returncode = %d)."
                       % (book, returncode))
+                print("Last lines of the output, see the build log for "
+                      "all output:")
                 print("\n%s" % output)
 
         print("Building of books finished with failures.\n")
@@ -1341,9 +3324,9 @@ def build_affected_books(rootdir, book_exceptions, file_exceptions,
     else:
         print("Building of books finished successfully.\n")
 
-    if len(RESULTS_OF_BUILDS) != len(books):
+    if len(RESULTS_OF_BUILDS) != len(jobs):
         print("ERROR: %d queued for building but only %d build!" %
-              (len(books), len(RESULTS_OF_BUILDS)))
+              (len(jobs), len(RESULTS_OF_BUILDS)))
         return 1
     return 0
 
@@ -1378,6 +3361,11 @@ def add_url_exceptions(url_exception, verbose):
 cli_OPTS = [
     cfg.BoolOpt("api-site", default=False,
                 help="Enable special handling for api-site repository."),
+    cfg.StrOpt("cache-dir", default=None,
+               help="Directory for caches that are kept between runs. "
+               "Defaults to openstack-doc-test in the git directory."),
+    cfg.BoolOpt("cache-stats", default=False,
+                help="Print statistics about the usage of caches."),
     cfg.BoolOpt('check-all', default=False,
                 help="Run all checks."),
     cfg.BoolOpt('check-build', default=False,
@@ -1393,9 +3381,16 @@ cli_OPTS = [
     cfg.BoolOpt("create-index", default=True,
                 help="When publishing create an index.html file to find books "
                 "in an easy way."),
+    cfg.BoolOpt("explain-build", default=False,
+                help="Print which books would be built by --check-build, "
+                "why, and an estimate of the build time. No check is "
+                "run and no book is built."),
     cfg.BoolOpt('force', default=False,
                 help="Force the validation of all files "
                 "and build all books."),
+    cfg.BoolOpt("no-cache", default=False,
+                help="Do not use caches kept between runs, validate all "
+                "files and check all URLs again."),
     cfg.BoolOpt("parallel", default=True,
                 help="Build books in parallel (default)."),
     cfg.BoolOpt("print-unused-files", default=False,
@@ -1404,10 +3399,33 @@ cli_OPTS = [
     cfg.BoolOpt("publish", default=False,
                 help="Setup content in publish-docs directory for "
                 "publishing to external website."),
+    cfg.StrOpt("results-jsonl", default=None,
+               help="Write the results of all checks as JSON Lines to "
+               "this file while the checks are running."),
+    cfg.StrOpt("results-junit", default=None,
+               help="Write the results of all checks as JUnit XML to "
+               "this file."),
+    cfg.BoolOpt("serve", default=False,
+                help="Keep running and validate files sent by "
+                "openstack-doc-test-client."),
+    cfg.StrOpt("socket", default=None,
+               help="Unix socket of the server started with --serve. "
+               "Defaults to doctest.sock in the cache directory."),
+    cfg.StrOpt("build-backend", default="auto",
+               choices=["auto", "mvn", "mvnd"],
+               help="Maven command for building books. mvnd keeps Maven "
+               "running between builds, auto uses mvnd if it is "
+               "installed and mvn otherwise."),
     cfg.MultiStrOpt("build-file-exception",
                     help="File that will be skipped during delete and "
                          "build checks to generate dependencies. This should "
                          "be done for invalid XML files only."),
+    cfg.IntOpt("build-jobs", default=0,
+               help="Maximal number of books to build in parallel. Use 0 "
+               "for one book per CPU. Fewer books are built while memory "
+               "is short or the load is high."),
+    cfg.IntOpt("build-memory", default=1024,
+               help="Memory in MiB needed for building a single book."),
     cfg.MultiStrOpt("file-exception",
                     help="File that will be skipped during niceness and "
                          "syntax validation."),
@@ -1415,14 +3433,31 @@ cli_OPTS = [
                     help="Directory to ignore for building of manuals. The "
                          "parameter can be passed multiple times to add "
                          "several directories."),
+    cfg.IntOpt("jobs", default=1, short='j',
+               help="Number of processes to use for syntax, niceness and "
+               "link checks. Use 0 for one process per CPU."),
     cfg.StrOpt('language', default=None, short='l',
                help="Build translated manual for language in path "
                "generate/$LANGUAGE ."),
+    cfg.IntOpt("link-cache-ttl", default=24,
+               help="Hours for which reachable URLs are not checked "
+               "again. Use 0 to check all URLs."),
+    cfg.IntOpt("link-check-timeout", default=30,
+               help="Timeout in seconds for requests of the link check."),
+    cfg.IntOpt("link-check-workers", default=8,
+               help="Number of URLs to check concurrently, at least 1."),
     cfg.MultiStrOpt('only-book', default=None,
                     help="Build each specified manual."),
     cfg.MultiStrOpt("url-exception",
                     help="URL that will be skipped during reachability "
                          "check."),
+    cfg.BoolOpt("watch", default=False,
+                help="Keep running and check files whenever they change. "
+                "Changed files are validated and the books including "
+                "them are listed, no books are built."),
+    cfg.FloatOpt("watch-interval", default=0.5,
+                 help="Seconds between two scans for changed files with "
+                 "--watch."),
 ]
 
 OPTS = [
@@ -1448,6 +3483,9 @@ OPTS = [
                help="Value to pass to maven for release.path.name."),
     cfg.StrOpt("comments-enabled", default="0",
                help="Value to pass to maven for comments.enabled."),
+    cfg.StrOpt("site-url", default=None,
+               help="URL of the site the books are published to. If set, "
+               "a sitemap.xml file is generated as well."),
 ]
 
 
@@ -1463,6 +3501,13 @@ def handle_options():
          version=os_doc_tools.__version__,
          default_config_files=default_config_files)
 
+    if CONF.build_jobs < 0:
+        raise cfg.Error("Option --build-jobs needs a value of at least 0.")
+
+    if CONF.link_check_workers < 1:
+        raise cfg.Error("Option --link-check-workers needs a value of at "
+                        "least 1.")
+
     if CONF.repo_name:
         print ("Testing repository '%s'\n" % CONF.repo_name)
 
@@ -1499,6 +3544,9 @@ def handle_options():
     if CONF.publish:
         CONF.create_index = False
 
+    if CONF.results_jsonl or CONF.results_junit:
+        RESULTS.open(CONF.results_jsonl, CONF.results_junit)
+
     if CONF.check_build and CONF.book and CONF.target_dir:
         if len(CONF.book) != len(CONF.target_dir):
             print("ERROR: book and target_dir options need to have a 1:1 "
@@ -1545,16 +3593,31 @@ def doctest():
     print_gitinfo()
     errors = 0
 
-    doc_path = get_gitroot()
-    if CONF.language:
-        doc_path = os.path.join(doc_path, 'generated', CONF.language)
-        if CONF.verbose:
-            print("Using %s as root" % doc_path)
-    elif not CONF.api_site:
-        doc_path = os.path.join(doc_path, 'doc')
+    doc_path = get_doc_path()
+    if CONF.language and CONF.verbose:
+        print("Using %s as root" % doc_path)
+
+    if not CONF.no_cache:
+        index_file = get_index_file(doc_path)
+        DOC_CACHE.load_index(index_file, doc_path)
+
+    if CONF.serve:
+        errors = serve(get_socket_path(), CONF.api_site)
+        RESULTS.close()
+        return errors
+
+    if CONF.watch:
+        watch_files(doc_path, BOOK_EXCEPTIONS, BUILD_FILE_EXCEPTIONS,
+                    FILE_EXCEPTIONS, CONF.ignore_dir,
+                    None if CONF.no_cache else get_validation_cache())
+        RESULTS.close()
+        if not CONF.no_cache:
+            DOC_CACHE.save_index(index_file, doc_path)
+        return 0
 
     if not CONF.force and www_touched():
         print("Only files in www directory changed, nothing to do.\n")
+        RESULTS.close()
         return
 
     # Build everything if we publish so that regularly all manuals are
@@ -1562,23 +3625,39 @@ def doctest():
     if (not CONF.force and not CONF.publish and not CONF.language
             and only_po_touched()):
         print("Only files in locale directories changed, nothing to do.\n")
+        RESULTS.close()
         return
 
+    if CONF.explain_build:
+        explain_build(doc_path, BOOK_EXCEPTIONS, BUILD_FILE_EXCEPTIONS,
+                      CONF.force, CONF.ignore_dir)
+        RESULTS.close()
+        if not CONF.no_cache:
+            DOC_CACHE.save_index(index_file, doc_path)
+        return 0
+
+    validation_cache = None
     if CONF.check_syntax or CONF.check_niceness or CONF.check_links:
+        if not CONF.no_cache:
+            validation_cache = get_validation_cache()
         if CONF.force:
             errors += validate_all_files(doc_path, FILE_EXCEPTIONS,
                                          CONF.verbose,
                                          CONF.check_syntax,
                                          CONF.check_niceness,
                                          CONF.check_links,
-                                         CONF.api_site)
+                                         CONF.api_site,
+                                         CONF.jobs,
+                                         validation_cache)
         else:
             errors += validate_modified_files(doc_path, FILE_EXCEPTIONS,
                                               CONF.verbose,
                                               CONF.check_syntax,
                                               CONF.check_niceness,
                                               CONF.check_links,
-                                              CONF.api_site)
+                                              CONF.api_site,
+                                              CONF.jobs,
+                                              validation_cache)
 
     if CONF.check_deletions:
         errors += check_deleted_files(doc_path, BUILD_FILE_EXCEPTIONS,
@@ -1587,12 +3666,22 @@ def doctest():
     if CONF.check_build:
         # Some programs are called in subprocesses,  make sure that they
         # really exist.
-        ensure_exists("mvn")
+        ensure_exists(get_maven_command())
         errors += build_affected_books(doc_path, BOOK_EXCEPTIONS,
                                        BUILD_FILE_EXCEPTIONS,
                                        CONF.force,
                                        CONF.ignore_dir)
 
+    if not CONF.no_cache:
+        DOC_CACHE.save_index(index_file, doc_path)
+    RESULTS.close()
+    if CONF.verbose:
+        print_schema_timings()
+    if CONF.verbose or CONF.cache_stats:
+        DOC_CACHE.print_statistics()
+        if validation_cache is not None:
+            validation_cache.print_statistics()
+
     elapsed_time = (time.time() - start_time)
     print ("Run time was: %.2f seconds." % elapsed_time)
     if errors == 0:
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''
+Client for the validation server of openstack-doc-test.
+
+The server is started with "openstack-doc-test --serve" and keeps
+compiled schemas and parsed files in memory. The client sends the files
+to validate to the server and prints the results while they arrive.
+
+The client sends a single line with a JSON object with the keys files
+(list of absolute paths), rootdir (paths in messages are relative to
+it), check_syntax, check_niceness, check_links and api_site. The server
+answers with one line per file with a JSON object with the keys file,
+failed, output, problems and duration, and a final line with the keys
+done, validated, failed and output. A request {"command": "stop"} stops
+the server.
+
+This module does not import lxml so that it starts fast.
+'''
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+
+from os_doc_tools.common import check_output
+
+# Longest path of a Unix socket, sun_path has room for 108 bytes on Linux
+# including the terminating null byte.
+MAX_SOCKET_PATH = 107
+
+
+def get_default_socket():
+    """Return socket used by a server with the default cache directory."""
+
+    gitdir = check_output(["git", "rev-parse", "--git-dir"]).rstrip()
+    return os.path.join(os.path.abspath(gitdir), 'openstack-doc-test',
+                        'doctest.sock')
+
+
+def check_socket_path(socket_path):
+    """Return error message if socket_path cannot be used, None if it can."""
+
+    if len(socket_path) > MAX_SOCKET_PATH:
+        return ("socket path %s is longer than %d characters, choose a "
+                "shorter one with --socket." % (socket_path, MAX_SOCKET_PATH))
+    return None
+
+
+def send_request(socket_path, request):
+    """Send request to the server, yield the messages of the answer."""
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    try:
+        client.sendall(json.dumps(request) + '\n')
+        for line in client.makefile('r'):
+            yield json.loads(line)
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Validate files with a running openstack-doc-test "
+        "server.")
+    parser.add_argument('files', metavar='FILES', nargs='*')
+    parser.add_argument('--socket',
+                        help="Socket of the server, defaults to the socket "
+                        "in the default cache directory.")
+    parser.add_argument('--api-site', action='store_true',
+                        help="Enable special handling for api-site "
+                        "repository.")
+    parser.add_argument('--check-links', action='store_true',
+                        help="Check that linked URLs are valid and "
+                        "reachable.")
+    parser.add_argument('--check-niceness', action='store_true',
+                        help="Check the niceness of files.")
+    parser.add_argument('--check-syntax', action='store_true',
+                        help="Check the syntax of files.")
+    parser.add_argument('--stop', action='store_true',
+                        help="Stop the server.")
+    args = parser.parse_args()
+
+    if args.socket:
+        socket_path = args.socket
+    else:
+        try:
+            socket_path = get_default_socket()
+        except (subprocess.CalledProcessError, OSError) as e:
+            print("ERROR: cannot find the git repository for the default "
+                  "socket, use --socket: %s" % e)
+            return 1
+    error = check_socket_path(os.path.abspath(socket_path))
+    if error:
+        print("ERROR: %s" % error)
+        return 1
+    if args.stop:
+        request = {'command': 'stop'}
+    else:
+        if not (args.check_syntax or args.check_niceness or
+                args.check_links):
+            args.check_syntax = args.check_niceness = True
+        checks = []
+        if args.check_links:
+            checks.append("valid URL links")
+        if args.check_niceness:
+            checks.append("niceness")
+        if args.check_syntax:
+            checks.append("syntax")
+        print("Checking files for %s..." % (", ".join(checks)))
+        request = {'files': [os.path.abspath(f) for f in args.files],
+                   'rootdir': os.getcwd(),
+                   'check_syntax': args.check_syntax,
+                   'check_niceness': args.check_niceness,
+                   'check_links': args.check_links,
+                   'api_site': args.api_site}
+
+    try:
+        for message in send_request(socket_path, request):
+            if 'error' in message:
+                print("ERROR: %s" % message['error'])
+                return 1
+            sys.stdout.write(message.get('output', ''))
+            sys.stdout.flush()
+            if message.get('done'):
+                break
+        else:
+            print("ERROR: server closed the connection.")
+            return 1
+    except socket.error as e:
+        print("ERROR: cannot connect to server on %s: %s" % (socket_path, e))
+        return 1
+
+    if args.stop:
+        print("Server stopped.")
+        return 0
+    if message['failed']:
+        print("Check failed, validated %d files with %d failures." %
+              (message['validated'], message['failed']))
+        return 1
+    print("Check passed, validated %d files." % message['validated'])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
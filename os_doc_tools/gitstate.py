@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''
+State of the git repository that is tested.
+
+The state is read once with a few git commands, all checks of a run
+use the same snapshot of the top-level directory, the tested change and
+the files it modifies.
+'''
+
+import os
+import subprocess
+import sys
+
+from os_doc_tools.common import check_output   # noqa
+
+# Files that affect all books if modified.
+SPECIAL_FILES = [
+    # Top-Level pom.xml
+    "pom.xml",
+    # doc/pom.xml in openstack-manuals
+    "doc/pom.xml"
+]
+
+
+def _git(args, cwd=None):
+    """Run git with args, exit if git fails."""
+
+    try:
+        return check_output(["git"] + args, cwd=cwd)
+    except (subprocess.CalledProcessError, OSError) as e:
+        print("git failed: %s" % e)
+        sys.exit(1)
+
+
+class RepositoryState(object):
+    """Snapshot of the git repository in the current directory.
+
+    The information about the tested change and the list of modified
+    files are read on first use.
+    """
+
+    def __init__(self):
+        toplevel, gitdir, branch = _git(
+            ["rev-parse", "--show-toplevel", "--git-dir",
+             "--abbrev-ref", "HEAD"]).splitlines()
+        self.gitroot = toplevel
+        self.gitdir = os.path.abspath(gitdir)
+        self.branch = branch
+        self._info = None
+        self._changes = None
+
+    @property
+    def author(self):
+        return self._get_info()[0]
+
+    @property
+    def subject(self):
+        return self._get_info()[1]
+
+    def _get_info(self):
+        if self._info is None:
+            self._info = _git(["show", "-s", "--format=%an%x00%s"],
+                              cwd=self.gitroot).rstrip('\n').split('\0', 1)
+        return self._info
+
+    @property
+    def changes(self):
+        """List of (status, path) of files modified by the last commit.
+
+        status is the letter git uses, path is relative to the top-level
+        directory. Renamed and copied files are listed with their new
+        path.
+        """
+
+        if self._changes is None:
+            output = _git(["diff", "--name-status", "-z", "HEAD~1", "HEAD"],
+                          cwd=self.gitroot)
+            fields = output.split('\0')
+            changes = []
+            i = 0
+            while i < len(fields) - 1:
+                status = fields[i][0]
+                if status in 'RC':
+                    # Followed by the old and the new path.
+                    path = fields[i + 2]
+                    i += 3
+                else:
+                    path = fields[i + 1]
+                    i += 2
+                changes.append((status, path))
+            self._changes = changes
+        return self._changes
+
+    def modified_files(self, rootdir, statuses=None):
+        """Return modified files below rootdir, relative to rootdir.
+
+        statuses is a string of the git status letters of the files to
+        return, for example 'D' for deleted files, None for all files.
+        """
+
+        rel = os.path.relpath(os.path.realpath(rootdir),
+                              os.path.realpath(self.gitroot))
+        prefix = '' if rel == '.' else rel + '/'
+        return [path[len(prefix):] for status, path in self.changes
+                if (statuses is None or status in statuses) and
+                path.startswith(prefix)]
+
+    def www_touched(self):
+        """Return whether only files in www directory are modified."""
+
+        paths = [path for _, path in self.changes]
+        return (any(path.startswith("www/") for path in paths) and
+                all(path.startswith("www/") for path in paths))
+
+    def only_po_touched(self):
+        """Return whether only files in locale directories are modified."""
+
+        paths = [path for _, path in self.changes]
+        return bool(paths) and all(
+            "/locale/" in path and path.endswith((".po", ".pot"))
+            for path in paths)
+
+    def get_special_files(self):
+        """Return modified files that affect all books."""
+
+        return [path for _, path in self.changes
+                if path in SPECIAL_FILES or path.endswith('.ent')]
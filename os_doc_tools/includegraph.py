@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''
+Usage:
+    openstack-doc-graph [options] unused [--json]
+    openstack-doc-graph [options] analyze [--json] [--top TOP]
+
+Queries on the include graph of the books of a repository.
+
+Commands:
+    unused   List XML files that are not reachable from any book master
+             file.
+    analyze  List the files reachable from the book master files of
+             each book, include cycles, and the files that are part of
+             most books. A modification of such a file rebuilds all
+             these books.
+
+The graph is collected like openstack-doc-test does for finding the
+books affected by a change, using the same include index between runs.
+'''
+
+from __future__ import print_function
+
+import json
+import os
+import sys
+
+from oslo.config import cfg
+
+import os_doc_tools
+from os_doc_tools import doctest
+
+# Options of openstack-doc-test that select the files of the graph.
+DOCTEST_OPTIONS = ['api-site', 'build-file-exception', 'cache-dir',
+                   'ignore-dir', 'language', 'no-cache', 'only-book']
+
+
+def scan_books(rootdir):
+    """Return BookScan of rootdir, see doctest.scan_books."""
+
+    CONF = cfg.CONF
+    if CONF.build_file_exception:
+        doctest.add_build_exceptions(CONF.build_file_exception, False)
+    if not CONF.no_cache:
+        index_file = doctest.get_index_file(rootdir)
+        doctest.DOC_CACHE.load_index(index_file, rootdir)
+    scan = doctest.scan_books(rootdir, doctest.BOOK_EXCEPTIONS,
+                              doctest.BUILD_FILE_EXCEPTIONS,
+                              CONF.ignore_dir,
+                              only_books=CONF.only_book)
+    if not CONF.no_cache:
+        doctest.DOC_CACHE.save_index(index_file, rootdir)
+    return scan
+
+
+def get_reachable(graph, roots):
+    """Return set of nodes reachable from roots in graph.
+
+    graph is a dictionary with the set of successors of each node.
+    """
+
+    reachable = set(roots)
+    stack = list(reachable)
+    while stack:
+        for successor in graph.get(stack.pop(), ()):
+            if successor not in reachable:
+                reachable.add(successor)
+                stack.append(successor)
+    return reachable
+
+
+def get_strongly_connected_components(graph):
+    """Return strongly connected components of graph.
+
+    graph is a dictionary with the set of successors of each node. The
+    components are found with Tarjan's algorithm, iteratively so that
+    deep include chains do not exceed the recursion limit.
+    """
+
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+
+    def visit(node):
+        index[node] = lowlink[node] = len(index)
+        stack.append(node)
+        on_stack.add(node)
+        return (node, iter(graph.get(node, ())))
+
+    for start in graph:
+        if start in index:
+            continue
+        work = [visit(start)]
+        while work:
+            node, successors = work[-1]
+            for successor in successors:
+                if successor not in index:
+                    work.append(visit(successor))
+                    break
+                elif successor in on_stack:
+                    lowlink[node] = min(lowlink[node], index[successor])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    return components
+
+
+def get_cycles(graph):
+    """Return sorted lists of files that include each other."""
+
+    return sorted(sorted(component)
+                  for component in get_strongly_connected_components(graph)
+                  if len(component) > 1 or
+                  component[0] in graph.get(component[0], ()))
+
+
+def get_book_files(scan, includes):
+    """Return dictionary with the set of files of each book.
+
+    These are the files reachable from the book master files of the
+    book.
+    """
+
+    masters = {}
+    for master, book in scan.book_bk.items():
+        masters.setdefault(book, []).append(master)
+    return dict((book, get_reachable(includes, masters.get(book, [])))
+                for book in scan.books)
+
+
+def get_hotspots(scan, book_files):
+    """Return files by number of books they are part of.
+
+    Returns a list of tuples (path, number of books, number of files
+    including path) for all files that are not book master files,
+    sorted by decreasing number of books and including files.
+    """
+
+    books_of_file = {}
+    for files in book_files.values():
+        for path in files:
+            books_of_file[path] = books_of_file.get(path, 0) + 1
+    hotspots = [(path, books, len(scan.included_by.get(path, ())))
+                for path, books in books_of_file.items()
+                if path not in scan.book_bk]
+    return sorted(hotspots, key=lambda h: (-h[1], -h[2], h[0]))
+
+
+def command_analyze(rootdir, scan):
+    includes = scan.get_includes()
+    book_files = get_book_files(scan, includes)
+    cycles = get_cycles(includes)
+    hotspots = get_hotspots(scan, book_files)[:cfg.CONF.command.top]
+
+    def rel(path):
+        return os.path.relpath(path, rootdir)
+
+    if cfg.CONF.command.json:
+        print(json.dumps(
+            {'rootdir': rootdir,
+             'books': dict((rel(book), sorted(rel(f) for f in files))
+                           for book, files in book_files.items()),
+             'cycles': [[rel(f) for f in cycle] for cycle in cycles],
+             'hotspots': [{'file': rel(path), 'books': books,
+                           'included_by': included_by}
+                          for path, books, included_by in hotspots]},
+            indent=2, sort_keys=True))
+        return 0
+
+    print("Files of each book:")
+    for book in sorted(book_files):
+        print("  %s: %d files" % (rel(book), len(book_files[book])))
+    print("\nInclude cycles:")
+    for cycle in cycles:
+        print("  %s" % ", ".join(rel(f) for f in cycle))
+    if not cycles:
+        print("  None")
+    print("\nFiles that are part of most books:")
+    for path, books, included_by in hotspots:
+        print("  %s: %d books, included by %d files" %
+              (rel(path), books, included_by))
+    return 0
+
+
+def command_unused(rootdir, scan):
+    unused = [os.path.relpath(path, rootdir)
+              for path in doctest.get_unused_files(scan)]
+    if cfg.CONF.command.json:
+        print(json.dumps({'rootdir': rootdir, 'unused': unused},
+                         indent=2))
+    else:
+        for path in unused:
+            print(path)
+    return 0
+
+
+def add_command_parsers(subparsers):
+    parser = subparsers.add_parser(
+        'unused', help="List XML files that are not reachable from any "
+        "book master file.")
+    parser.add_argument('--json', action='store_true',
+                        help="Print the result as JSON.")
+    parser.set_defaults(func=command_unused)
+
+    parser = subparsers.add_parser(
+        'analyze', help="List files of each book, include cycles and files "
+        "that are part of most books.")
+    parser.add_argument('--json', action='store_true',
+                        help="Print the result as JSON.")
+    parser.add_argument('--top', type=int, default=20,
+                        help="Number of files that are part of most books "
+                        "to list.")
+    parser.set_defaults(func=command_analyze)
+
+
+def main():
+    CONF = cfg.CONF
+    CONF.register_cli_opts([opt for opt in doctest.cli_OPTS
+                            if opt.name in DOCTEST_OPTIONS])
+    CONF.register_cli_opt(cfg.SubCommandOpt('command', title="Commands",
+                                            handler=add_command_parsers))
+    default_config_files = [os.path.join(doctest.get_gitroot(),
+                                         'doc-test.conf')]
+    try:
+        CONF(sys.argv[1:], project='documentation',
+             prog='openstack-doc-graph', version=os_doc_tools.__version__,
+             default_config_files=default_config_files)
+    except cfg.Error as e:
+        print(e)
+        return 1
+
+    rootdir = doctest.get_doc_path()
+    return CONF.command.func(rootdir, scan_books(rootdir))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''
+Check reachability of URLs.
+
+All URLs of a run are checked once, concurrently by a pool of threads.
+URLs of the same host share persistent connections, are rate limited
+and are first requested with HEAD, falling back to GET. Reachable URLs
+can be stored in a cache file so that they are not checked again until
+the cache entry expires.
+'''
+
+import httplib
+import json
+import os
+import Queue
+import socket
+import threading
+import time
+import urllib2
+import urlparse
+
+from os_doc_tools.common import write_file_atomically
+
+# HTTP status codes that are not treated as errors:
+# 403 (Forbidden) since it often means that the user-agent is wrong.
+# 503 (Service Temporarily Unavailable)
+IGNORED_STATUS_CODES = [403, 503]
+
+REDIRECT_STATUS_CODES = [301, 302, 303, 307, 308]
+MAX_REDIRECTS = 10
+
+USER_AGENT = 'openstack-doc-test'
+
+
+class LinkError(object):
+    """Result of a failed check of a URL.
+
+    kind is 'unreachable' if the server answered with an error status and
+    'invalid' if the URL could not be requested at all.
+    """
+
+    def __init__(self, kind, error):
+        self.kind = kind
+        self.error = error
+
+    def __str__(self):
+        return self.error
+
+
+class LinkChecker(object):
+    """Check reachability of URLs with a pool of threads.
+
+    :param workers: number of threads checking URLs
+    :param timeout: timeout in seconds for connecting to and reading
+                    from a host
+    :param per_host: maximal number of concurrent connections to one host
+    :param host_delay: minimal delay in seconds between two requests to
+                       one host
+    :param cache_file: file to store reachable URLs in, None for no cache
+    :param cache_ttl: seconds after which a reachable URL is checked again
+    """
+
+    def __init__(self, workers=8, timeout=30, per_host=2, host_delay=0.1,
+                 cache_file=None, cache_ttl=24 * 3600):
+        self.workers = workers
+        self.timeout = timeout
+        self.per_host = per_host
+        self.host_delay = host_delay
+        self.cache_file = cache_file
+        self.cache_ttl = cache_ttl
+        self.checked = 0
+        self.cache_hits = 0
+        self._results = {}
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._next_request = {}
+        self._host_errors = {}
+        if cache_file:
+            self._load_cache()
+
+    def check(self, urls):
+        """Check all URLs that have not been checked before.
+
+        Returns dictionary with the URLs as keys and either None for
+        reachable URLs or a LinkError as value.
+        """
+
+        now = time.time()
+        by_host = {}
+        for url in set(urls):
+            if url in self._results:
+                continue
+            if now - self._cache.get(url, 0) < self.cache_ttl:
+                self.cache_hits += 1
+                self._results[url] = None
+                continue
+            host = urlparse.urlsplit(url)[1]
+            by_host.setdefault(host, []).append(url)
+
+        jobs = Queue.Queue()
+        for host_urls in by_host.values():
+            # Split URLs of a host between up to per_host connections.
+            for i in range(min(self.per_host, len(host_urls))):
+                jobs.put(host_urls[i::self.per_host])
+
+        threads = []
+        for _ in range(min(max(1, self.workers), jobs.qsize())):
+            thread = threading.Thread(target=self._worker, args=(jobs,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        if self.cache_file:
+            self._save_cache()
+        return dict((url, self._results[url]) for url in urls)
+
+    def check_url(self, url, connections=None):
+        """Check a single URL, return None or a LinkError.
+
+        connections is a dictionary of open connections that can be
+        reused, it is updated with newly opened connections.
+        """
+
+        if connections is None:
+            connections = {}
+        method = 'HEAD'
+        redirects = 0
+        while True:
+            parts = urlparse.urlsplit(url)
+            if parts.scheme not in ('http', 'https'):
+                return self._check_other_url(url)
+            with self._lock:
+                host_error = self._host_errors.get(parts.netloc)
+            if host_error is not None:
+                return host_error
+
+            self._wait_for_host(parts.netloc)
+            path = urlparse.urlunsplit(('', '', parts.path or '/',
+                                        parts.query, ''))
+            try:
+                status, reason, location = self._request(
+                    connections, parts.scheme, parts.netloc, method, path)
+            except (httplib.HTTPException, socket.error) as e:
+                error = LinkError('invalid', "<urlopen error %s>" % e)
+                if isinstance(e, (socket.timeout, socket.gaierror)):
+                    # Do not wait for the same host again and again.
+                    with self._lock:
+                        self._host_errors[parts.netloc] = error
+                return error
+
+            if status in REDIRECT_STATUS_CODES and location:
+                redirects += 1
+                if redirects > MAX_REDIRECTS:
+                    return LinkError('unreachable',
+                                     "HTTP Error %d: too many redirects" %
+                                     status)
+                url = urlparse.urljoin(url, location)
+                continue
+            if status < 400 or status in IGNORED_STATUS_CODES:
+                return None
+            if method == 'HEAD':
+                # Some servers do not handle HEAD requests correctly.
+                method = 'GET'
+                continue
+            return LinkError('unreachable',
+                             "HTTP Error %d: %s" % (status, reason))
+
+    def _worker(self, jobs):
+        """Check lists of URLs of one host until jobs is empty."""
+
+        while True:
+            try:
+                urls = jobs.get_nowait()
+            except Queue.Empty:
+                return
+            connections = {}
+            try:
+                for url in urls:
+                    try:
+                        result = self.check_url(url, connections)
+                    except Exception as e:
+                        # For example ssl.CertificateError or a malformed
+                        # URL, every URL needs a result.
+                        result = LinkError('invalid',
+                                           "<urlopen error %s>" % e)
+                        # The connections might be in any state now.
+                        for connection in connections.values():
+                            connection.close()
+                        connections.clear()
+                    with self._lock:
+                        self.checked += 1
+                        self._results[url] = result
+                        if result is None:
+                            self._cache[url] = time.time()
+            finally:
+                for connection in connections.values():
+                    connection.close()
+
+    def _wait_for_host(self, host):
+        """Wait until the next request to host is allowed."""
+
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next_request.get(host, 0))
+            self._next_request[host] = start + self.host_delay
+        if start > now:
+            time.sleep(start - now)
+
+    def _request(self, connections, scheme, netloc, method, path):
+        """Send request, return status, reason and Location header."""
+
+        key = (scheme, netloc)
+        # A reused connection might have been closed by the server,
+        # retry once with a new connection in that case.
+        for attempt in range(2):
+            connection = connections.get(key)
+            reused = connection is not None
+            if connection is None:
+                if scheme == 'https':
+                    connection = httplib.HTTPSConnection(
+                        netloc, timeout=self.timeout)
+                else:
+                    connection = httplib.HTTPConnection(
+                        netloc, timeout=self.timeout)
+                connections[key] = connection
+            try:
+                connection.request(method, path,
+                                   headers={'User-Agent': USER_AGENT})
+                response = connection.getresponse()
+                # Read the body so that the connection can be reused.
+                while response.read(65536):
+                    pass
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                del connections[key]
+                if reused and attempt == 0:
+                    continue
+                raise
+            if response.getheader('connection', '').lower() == 'close':
+                connection.close()
+                del connections[key]
+            return (response.status, response.reason,
+                    response.getheader('location'))
+
+    def _check_other_url(self, url):
+        """Check a URL that is not using HTTP, for example ftp."""
+
+        try:
+            urllib2.urlopen(url, timeout=self.timeout).close()
+        except urllib2.HTTPError as e:
+            if e.code not in IGNORED_STATUS_CODES:
+                return LinkError('unreachable', str(e))
+        except (urllib2.URLError, socket.error) as e:
+            return LinkError('invalid', str(e))
+        return None
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_file, 'r') as fp:
+                self._cache = json.load(fp)
+        except (IOError, ValueError):
+            self._cache = {}
+
+    def _save_cache(self):
+        now = time.time()
+        cache = dict((url, checked) for url, checked in self._cache.items()
+                     if now - checked < self.cache_ttl)
+        try:
+            write_file_atomically(self.cache_file, json.dumps(cache))
+        except (IOError, OSError) as e:
+            print("Warning: cannot write link cache %s: %s" %
+                  (self.cache_file, e))
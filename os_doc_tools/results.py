@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''
+Machine readable results of openstack-doc-test.
+
+Every check emits records with the fields file, check, status, line,
+message and duration. Records are written as JSON Lines while the
+checks run, a JUnit XML file with one test case per file and check is
+written at the end.
+'''
+
+import collections
+import json
+
+from lxml import etree
+
+# Checks that report single problems found while validating a file,
+# these are failures of the "validation" test case of the file.
+VALIDATION_PROBLEM_CHECKS = ('syntax', 'niceness')
+
+
+class ResultsWriter(object):
+    """Write records of check results.
+
+    Nothing is written until files are given with open.
+    """
+
+    def __init__(self):
+        self.jsonl = None
+        self.junit_file = None
+        # Test cases by check and file, each is a list of the duration
+        # and of a list of failure messages.
+        self.testcases = collections.OrderedDict()
+
+    def open(self, jsonl_file=None, junit_file=None):
+        """Start writing records.
+
+        :param jsonl_file: path of JSON Lines file, None for no such file
+        :param junit_file: path of JUnit XML file, None for no such file
+        """
+
+        if jsonl_file:
+            self.jsonl = open(jsonl_file, 'w')
+        self.junit_file = junit_file
+
+    def enabled(self):
+        """Return whether records are written anywhere."""
+
+        return self.jsonl is not None or self.junit_file is not None
+
+    def record(self, path, check, status, message=None, line=None,
+               duration=None):
+        """Record result of check for path.
+
+        status is either 'passed' or 'failed'. Records of failures should
+        be passed with a message, line is the line of the failure in path
+        if known, duration the time the check took in seconds.
+        """
+
+        if self.jsonl is not None:
+            self.jsonl.write(json.dumps(
+                collections.OrderedDict([('file', path),
+                                         ('check', check),
+                                         ('status', status),
+                                         ('line', line),
+                                         ('message', message),
+                                         ('duration', duration)])))
+            self.jsonl.write('\n')
+            self.jsonl.flush()
+
+        if self.junit_file is not None:
+            if check in VALIDATION_PROBLEM_CHECKS:
+                check = 'validation'
+            testcase = self.testcases.setdefault((check, path), [None, []])
+            if duration is not None:
+                testcase[0] = duration
+            if status == 'failed' and message:
+                testcase[1].append(message)
+            elif status == 'failed' and not testcase[1]:
+                testcase[1].append(status)
+
+    def close(self):
+        """Close JSON Lines file and write JUnit XML file."""
+
+        if self.jsonl is not None:
+            self.jsonl.close()
+            self.jsonl = None
+        if self.junit_file is not None:
+            self._write_junit()
+            self.junit_file = None
+
+    def _write_junit(self):
+        suites = collections.OrderedDict()
+        for (check, path), testcase in self.testcases.items():
+            suites.setdefault(check, []).append((path, testcase))
+
+        root = etree.Element('testsuites')
+        for check, testcases in suites.items():
+            suite = etree.SubElement(root, 'testsuite', name=check)
+            failures = 0
+            total_time = 0.0
+            for path, (duration, messages) in testcases:
+                case = etree.SubElement(suite, 'testcase', classname=check,
+                                        name=_xml_safe(path))
+                if duration is not None:
+                    case.set('time', "%.3f" % duration)
+                    total_time += duration
+                if messages:
+                    failures += 1
+                    text = u"\n".join(_xml_safe(m) for m in messages)
+                    failure = etree.SubElement(
+                        case, 'failure', message=_first_line(text))
+                    failure.text = text
+            suite.set('tests', str(len(testcases)))
+            suite.set('failures', str(failures))
+            suite.set('time', "%.3f" % total_time)
+
+        etree.ElementTree(root).write(self.junit_file, encoding='UTF-8',
+                                      xml_declaration=True,
+                                      pretty_print=True)
+
+
+def _xml_safe(text):
+    """Return text as unicode without characters that are invalid in XML."""
+
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'replace')
+    elif not isinstance(text, unicode):
+        text = unicode(text)
+    return u''.join(c for c in text
+                    if c in u'\t\n\r' or
+                    (c >= u' ' and c not in u'\ufffe\uffff'))
+
+
+def _first_line(text):
+    """Return first line of text that is not blank, for summaries."""
+
+    for line in text.splitlines():
+        if line.strip():
+            return line.strip()
+    return u'failed'
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''
+Run build jobs in parallel.
+
+Jobs are started longest first, using the durations of earlier runs.
+Jobs in the same directory never run at the same time. Further jobs are
+only started while there is enough free memory and the load of the
+machine is lower than the number of CPUs.
+'''
+
+import multiprocessing
+import os
+import Queue
+import time
+
+
+def get_available_memory():
+    """Return available memory in bytes, None if unknown."""
+
+    try:
+        with open('/proc/meminfo', 'r') as fp:
+            meminfo = dict(line.split(':', 1) for line in fp)
+    except (IOError, ValueError):
+        return None
+    if 'MemAvailable' in meminfo:
+        available = int(meminfo['MemAvailable'].split()[0])
+    else:
+        # Kernels before 3.14 do not report MemAvailable.
+        available = sum(int(meminfo[key].split()[0])
+                        for key in ('MemFree', 'Buffers', 'Cached')
+                        if key in meminfo)
+    return available * 1024
+
+
+def get_load():
+    """Return load average of the last minute, None if unknown."""
+
+    try:
+        return os.getloadavg()[0]
+    except OSError:
+        return None
+
+
+class JobError(Exception):
+    """A job exited instead of returning a result."""
+    pass
+
+
+def call_job(function, args):
+    """Call function(*args) inside of a process of the pool."""
+
+    try:
+        return function(*args)
+    except SystemExit as e:
+        # The process of the pool would end without reporting back.
+        raise JobError("exited with status %s" % e.code)
+
+
+class Job(object):
+    """A job for the Scheduler.
+
+    :param name: name of the job
+    :param directory: directory the job works in
+    :param function: function to call, it is called as function(*args)
+                     in a separate process and needs to be picklable
+    :param args: tuple of arguments
+    :param estimate: expected duration in seconds, None if unknown
+    :param light: True if the job needs only few resources, such jobs
+                  are started without checking free memory and load
+    """
+
+    def __init__(self, name, directory, function, args, estimate=None,
+                 light=False):
+        self.name = name
+        self.directory = directory
+        self.function = function
+        self.args = args
+        self.estimate = estimate
+        self.light = light
+
+
+class Scheduler(object):
+    """Run jobs with a pool of processes.
+
+    :param max_jobs: maximal number of jobs running at the same time,
+                     None for the number of CPUs
+    :param job_memory: bytes of memory a job needs, no job is started
+                       while less memory is available
+    :param start_interval: minimal seconds between the start of two jobs
+                           that are not light, so that memory and load
+                           reflect the jobs started before
+    """
+
+    def __init__(self, max_jobs=None, job_memory=1024 * 1024 * 1024,
+                 start_interval=5):
+        self.cpus = multiprocessing.cpu_count()
+        self.max_jobs = max_jobs or self.cpus
+        self.job_memory = job_memory
+        self.start_interval = start_interval
+        self._last_start = 0
+
+    @staticmethod
+    def order(jobs):
+        """Return jobs in the order they get started.
+
+        Jobs without estimate come first since they might be long, then
+        jobs by decreasing estimate.
+        """
+
+        return sorted(jobs, key=lambda job: (
+            job.estimate is not None, -(job.estimate or 0), job.name))
+
+    def run_sequential(self, jobs, callback):
+        """Run jobs one after the other in this process."""
+
+        for job in self.order(jobs):
+            callback(job, job.function(*job.args))
+
+    def run(self, jobs, callback, exclusive_first=False):
+        """Run jobs, call callback(job, result) for each finished job.
+
+        If exclusive_first is True, the first job that is not light runs
+        alone, further jobs that are not light are started after it
+        finished.
+        """
+
+        pending = self.order(jobs)
+        running = {}
+        exclusive_job = None
+        finished = Queue.Queue()
+        pool = multiprocessing.Pool(min(self.max_jobs, max(1, len(jobs))))
+        try:
+            while pending or running:
+                heavy = sum(1 for job in running.values() if not job.light)
+                busy_dirs = set(job.directory for job in running.values())
+                for job in list(pending):
+                    if len(running) >= self.max_jobs:
+                        break
+                    if job.directory in busy_dirs:
+                        continue
+                    if not job.light:
+                        if exclusive_job in running.values():
+                            continue
+                        if not self._can_start(heavy):
+                            continue
+                        heavy += 1
+                        self._last_start = time.time()
+                        if exclusive_first:
+                            exclusive_job = job
+                            exclusive_first = False
+                    pending.remove(job)
+                    busy_dirs.add(job.directory)
+                    result = pool.apply_async(
+                        call_job, (job.function, job.args),
+                        callback=lambda result, job=job:
+                        finished.put((job, result)))
+                    running[result] = job
+
+                # Wake up regularly to check memory and load again.
+                timeout = 1
+                remaining = (self._last_start + self.start_interval -
+                             time.time())
+                if pending and 0 < remaining < timeout:
+                    timeout = remaining
+                try:
+                    job, result = finished.get(timeout=timeout)
+                except Queue.Empty:
+                    pass
+                else:
+                    self._remove(running, job)
+                    callback(job, result)
+
+                # Jobs that raised an exception never call back.
+                for result, job in running.items():
+                    if result.ready() and not result.successful():
+                        del running[result]
+                        try:
+                            result.get()
+                        except Exception as e:
+                            print("ERROR: job %s failed: %s" % (job.name, e))
+            pool.close()
+            pool.join()
+        except KeyboardInterrupt:
+            pool.terminate()
+            pool.join()
+            raise
+
+    @staticmethod
+    def _remove(running, job):
+        for result, running_job in running.items():
+            if running_job is job:
+                del running[result]
+
+    def _can_start(self, heavy):
+        """Return whether another job that is not light may start."""
+
+        if heavy == 0:
+            return True
+        if time.time() - self._last_start < self.start_interval:
+            return False
+        available = get_available_memory()
+        if available is not None and available < self.job_memory:
+            return False
+        load = get_load()
+        if load is not None and load >= self.cpus:
+            return False
+        return True
@@ -0,0 +1,359 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import os
+import shutil
+import StringIO
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from lxml import etree
+from oslo.config import cfg
+
+from os_doc_tools import doctest
+from os_doc_tools import doctest_client
+from os_doc_tools import gitstate
+
+DOCBOOK = ('<book xmlns="http://docbook.org/ns/docbook" '
+           'xmlns:wadl="http://wadl.dev.java.net/2009/02">%s</book>')
+SECTION = ('<section xmlns="http://docbook.org/ns/docbook" version="5.0" '
+           'xml:id="section">\n'
+           '%s<para>Text.</para>\n'
+           '</section>\n')
+
+
+def setUpModule():
+    cfg.CONF.register_cli_opts(doctest.cli_OPTS)
+    cfg.CONF.register_opts(doctest.OPTS)
+    cfg.CONF([], project='documentation', default_config_files=[])
+
+
+class TreeTestCase(unittest.TestCase):
+    """Test case with a temporary directory as rootdir."""
+
+    def setUp(self):
+        self.rootdir = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.rootdir)
+
+    def write(self, name, content):
+        path = os.path.join(self.rootdir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(content)
+        return path
+
+
+class BuildKeyTestCase(TreeTestCase):
+    """Tests for get_build_key on a git repository with one book.
+
+    The book includes an image and a WADL file outside of the book
+    directory, the WADL file references a schema.
+    """
+
+    def setUp(self):
+        super(BuildKeyTestCase, self).setUp()
+        self.write('pom.xml', '<project/>')
+        self.write('doc/pom.xml', '<project/>')
+        self.write('doc/common/entities/openstack.ent',
+                   '<!ENTITY nbsp "&#160;">')
+        self.write('doc/common/figures/a.png', 'png')
+        self.write('doc/other/section.xml', DOCBOOK % '')
+        self.write('doc/api/a.wadl',
+                   '<application xmlns="http://wadl.dev.java.net/2009/02">'
+                   '<grammars><include href="xsd/a.xsd"/></grammars>'
+                   '</application>')
+        self.write('doc/api/xsd/a.xsd', '<schema/>')
+        self.write('doc/book/pom.xml', '<project/>')
+        self.write('doc/book/bk-book.xml', DOCBOOK % (
+            '<imagedata fileref="../common/figures/a.png"/>'
+            '<wadl:resources href="../api/a.wadl#r"/>'))
+        self.book = os.path.join(self.rootdir, 'doc/book')
+
+        for args in (['init', '-q'], ['add', '-A'],
+                     ['-c', 'user.name=Test',
+                      '-c', 'user.email=test@example.com',
+                      'commit', '-q', '-m', 'Add book']):
+            subprocess.check_call(['git'] + args, cwd=self.rootdir)
+        cwd = os.getcwd()
+        os.chdir(self.rootdir)
+        try:
+            repo_state = gitstate.RepositoryState()
+        finally:
+            os.chdir(cwd)
+        for name in ('REPO_STATE', 'ENTITY_FILES', 'DOC_CACHE'):
+            self.addCleanup(setattr, doctest, name, getattr(doctest, name))
+        doctest.REPO_STATE = repo_state
+        doctest.ENTITY_FILES = None
+        doctest.DOC_CACHE = doctest.DocumentCache()
+
+    def assertKeyChanges(self, name):
+        key = doctest.get_build_key(self.book)
+        with open(os.path.join(self.rootdir, name), 'a') as fp:
+            fp.write('\n')
+        doctest.DOC_CACHE = doctest.DocumentCache()
+        self.assertNotEqual(key, doctest.get_build_key(self.book))
+
+    def test_top_level_pom(self):
+        self.assertKeyChanges('pom.xml')
+
+    def test_parent_pom(self):
+        self.assertKeyChanges('doc/pom.xml')
+
+    def test_entity_file(self):
+        self.assertKeyChanges('doc/common/entities/openstack.ent')
+
+    def test_image(self):
+        self.assertKeyChanges('doc/common/figures/a.png')
+
+    def test_wadl_reference(self):
+        self.assertKeyChanges('doc/api/xsd/a.xsd')
+
+    def test_unrelated_file(self):
+        key = doctest.get_build_key(self.book)
+        self.write('doc/other/section.xml', DOCBOOK % '<para/>')
+        self.assertEqual(key, doctest.get_build_key(self.book))
+
+    def test_variant(self):
+        self.assertNotEqual(doctest.get_build_key(self.book),
+                            doctest.get_build_key(self.book, 'debian'))
+
+
+class ValidationCacheTestCase(TreeTestCase):
+
+    def setUp(self):
+        super(ValidationCacheTestCase, self).setUp()
+        self.addCleanup(setattr, doctest, 'BASE_RNG', doctest.BASE_RNG)
+        doctest.BASE_RNG = os.path.join(self.rootdir, 'resources/')
+        self.write('resources/docbook.rng', '<grammar/>')
+        self.cache_file = os.path.join(self.rootdir, 'cache/validation.json')
+        self.path = self.write('doc/a.xml', DOCBOOK % '')
+
+    def add_result(self):
+        cache = doctest.ValidationCache(self.cache_file, {'syntax': True})
+        cache.add(self.path, True, "  a.xml: failed\n", [], [])
+        cache.save()
+
+    def get_result(self, settings=None):
+        cache = doctest.ValidationCache(self.cache_file,
+                                        settings or {'syntax': True})
+        return cache.get(self.path)
+
+    def test_result_is_reused(self):
+        self.add_result()
+        self.assertEqual((True, "  a.xml: failed\n", [], []),
+                         self.get_result())
+
+    def test_modified_file(self):
+        self.add_result()
+        self.write('doc/a.xml', DOCBOOK % '<para/>')
+        self.assertIsNone(self.get_result())
+
+    def test_modified_schema(self):
+        self.add_result()
+        self.write('resources/docbook.rng', '<grammar><start/></grammar>')
+        self.assertIsNone(self.get_result())
+
+    def test_other_settings(self):
+        self.add_result()
+        self.assertIsNone(self.get_result({'syntax': False}))
+
+
+class ScanBooksTestCase(TreeTestCase):
+
+    def setUp(self):
+        super(ScanBooksTestCase, self).setUp()
+        self.write('doc/glossary.xml', DOCBOOK % '')
+        self.write('doc/book/pom.xml', '<project/>')
+        self.write('doc/book/bk-book.xml', DOCBOOK % '')
+        self.write('doc/drafts/draft.xml', DOCBOOK % '')
+        self.addCleanup(setattr, doctest, 'DOC_CACHE', doctest.DOC_CACHE)
+        doctest.DOC_CACHE = doctest.DocumentCache()
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.rootdir)
+
+    def test_relative_rootdir(self):
+        scan = doctest.scan_books('doc', [], [], ['drafts'])
+        doc = os.path.join(self.rootdir, 'doc')
+        self.assertEqual(
+            sorted(os.path.join(doc, f) for f in
+                   ('glossary.xml', 'book/pom.xml', 'book/bk-book.xml')),
+            sorted(scan.metadata))
+        self.assertEqual([os.path.join(doc, 'drafts')],
+                         scan.abs_ignore_dirs)
+
+
+class SyncTreeTestCase(TreeTestCase):
+
+    def setUp(self):
+        super(SyncTreeTestCase, self).setUp()
+        self.source = os.path.join(self.rootdir, 'source')
+        self.target = os.path.join(self.rootdir, 'target')
+        self.write('source/index.html', '<html/>')
+        self.write('source/content/a.html', '<html>a</html>')
+
+    def sync(self):
+        changes, published = doctest.sync_tree(self.source, self.target)
+        return sorted(changes), sorted(published)
+
+    def test_added(self):
+        self.assertEqual(
+            ([('A', 'content/a.html'), ('A', 'index.html')],
+             ['content/a.html', 'index.html']),
+            self.sync())
+        self.assertEqual(
+            int(os.path.getmtime(os.path.join(self.source, 'index.html'))),
+            int(os.path.getmtime(os.path.join(self.target, 'index.html'))))
+
+    def test_unchanged(self):
+        self.sync()
+        self.assertEqual([], self.sync()[0])
+
+    def test_rebuilt_with_same_content(self):
+        self.sync()
+        path = os.path.join(self.target, 'index.html')
+        os.utime(path, (1000, 1000))
+        self.assertEqual([], self.sync()[0])
+        self.assertEqual(1000, os.path.getmtime(path))
+
+    def test_modified_and_deleted(self):
+        self.sync()
+        self.write('source/index.html', '<html>new</html>')
+        os.remove(os.path.join(self.source, 'content/a.html'))
+        self.assertEqual([('D', 'content/a.html'), ('M', 'index.html')],
+                         self.sync()[0])
+        with open(os.path.join(self.target, 'index.html')) as fp:
+            self.assertEqual('<html>new</html>', fp.read())
+
+    def test_symlink_loop(self):
+        os.symlink('..', os.path.join(self.source, 'content/up'))
+        os.symlink('content', os.path.join(self.source, 'other'))
+        self.assertEqual(['content/a.html', 'index.html', 'other/a.html'],
+                         self.sync()[1])
+        self.assertFalse(os.path.lexists(
+            os.path.join(self.target, 'content/up')))
+
+
+class ServeTestCase(TreeTestCase):
+    """Tests for serve, running in a thread on a temporary socket."""
+
+    def setUp(self):
+        super(ServeTestCase, self).setUp()
+        self.socket_path = os.path.join(self.rootdir, 'doctest.sock')
+        self.addCleanup(setattr, sys, 'stdout', sys.stdout)
+        sys.stdout = StringIO.StringIO()
+        self.good = self.write('good.xml', SECTION % '<title>Good</title>')
+        self.bad = self.write('bad.xml', SECTION % '')
+        self.write('notes.txt', 'Not validated.')
+
+        self.errors = []
+        server = threading.Thread(target=lambda: self.errors.append(
+            doctest.serve(self.socket_path, False)))
+        server.daemon = True
+        server.start()
+        self.addCleanup(server.join, 30)
+        self.addCleanup(self.stop)
+        while "Listening on" not in sys.stdout.getvalue():
+            self.assertTrue(server.is_alive())
+            time.sleep(0.05)
+
+    def stop(self):
+        if os.path.exists(self.socket_path):
+            self.request({'command': 'stop'})
+
+    def request(self, request):
+        return list(doctest_client.send_request(self.socket_path, request))
+
+    def validate(self, files):
+        return self.request({'files': files,
+                             'rootdir': self.rootdir,
+                             'check_syntax': True,
+                             'check_niceness': True})
+
+    def test_validate(self):
+        messages = self.validate(
+            [self.good, self.bad, os.path.join(self.rootdir, 'notes.txt')])
+        self.assertEqual([self.good, self.bad],
+                         [m['file'] for m in messages[:-1]])
+        self.assertFalse(messages[0]['failed'])
+        self.assertTrue(messages[1]['failed'])
+        self.assertEqual('syntax', messages[1]['problems'][0][0])
+        self.assertEqual(
+            {'done': True, 'validated': 2, 'failed': 1, 'output': ''},
+            messages[-1])
+
+    def test_exception(self):
+        def fail(path, *args):
+            raise IOError("cannot read %s" % os.path.basename(path))
+
+        self.addCleanup(setattr, doctest, 'validate_file_captured',
+                        doctest.validate_file_captured)
+        doctest.validate_file_captured = fail
+        messages = self.validate([self.good])
+        self.assertEqual(
+            [{'file': self.good, 'failed': True,
+              'output': "  good.xml: cannot validate file: "
+                        "cannot read good.xml\n",
+              'problems': [], 'duration': 0},
+             {'done': True, 'validated': 1, 'failed': 1, 'output': ''}],
+            messages)
+
+    def test_invalid_request(self):
+        self.assertEqual(
+            [{'error': "Invalid request: files is missing or not a list "
+                       "of strings"}],
+            self.request({'rootdir': self.rootdir}))
+
+    def test_stop(self):
+        self.assertEqual([{'done': True}], self.request({'command': 'stop'}))
+        for _ in range(600):
+            if self.errors:
+                break
+            time.sleep(0.05)
+        self.assertEqual([0], self.errors)
+        self.assertFalse(os.path.exists(self.socket_path))
+
+
+class VerifyProfilingTestCase(unittest.TestCase):
+
+    def verify(self, content):
+        doc = etree.fromstring(DOCBOOK % content)
+        try:
+            doctest.verify_profiling(doc)
+        except ValueError as e:
+            return str(e).split("\n     ")
+        return []
+
+    def test_valid(self):
+        self.assertEqual([], self.verify(
+            '<section os="ubuntu;debian"><para os="debian"/></section>'))
+
+    def test_conflict(self):
+        self.assertEqual(
+            ["section os profiling (['ubuntu']) conflicts with os "
+             "profiling of para on line 1."],
+            self.verify('<section os="ubuntu"><para os="debian"/></section>'))
+
+    def test_unknown_value(self):
+        self.assertEqual(
+            ["'windows' is not a recognized os profile on line 1.",
+             "'admins' is not a recognized audience profile on line 1."],
+            self.verify('<para os="windows" audience="admins"/>'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from os_doc_tools import gitstate
+
+
+class RepositoryStateTestCase(unittest.TestCase):
+    """Tests for the changes of the last commit of a repository."""
+
+    def setUp(self):
+        self.rootdir = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.rootdir)
+        self.git('init', '-q')
+        self.git('config', 'diff.renames', 'true')
+        for name in ('doc/a.xml', 'doc/b.xml', 'doc/old name.xml',
+                     'www/index.html'):
+            self.write(name, name)
+        self.commit('First commit')
+
+        self.write('doc/a.xml', 'modified')
+        os.remove(os.path.join(self.rootdir, 'doc/b.xml'))
+        self.git('mv', 'doc/old name.xml', 'doc/new name.xml')
+        self.write('doc/c.xml', 'added')
+        self.commit('Second commit')
+
+        cwd = os.getcwd()
+        os.chdir(os.path.join(self.rootdir, 'doc'))
+        try:
+            self.state = gitstate.RepositoryState()
+        finally:
+            os.chdir(cwd)
+
+    def git(self, *args):
+        subprocess.check_call(('git',) + args, cwd=self.rootdir)
+
+    def write(self, name, content):
+        path = os.path.join(self.rootdir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(content)
+
+    def commit(self, subject):
+        self.git('add', '-A')
+        self.git('-c', 'user.name=Test Author',
+                 '-c', 'user.email=test@example.com',
+                 'commit', '-q', '-m', subject)
+
+    def test_state(self):
+        self.assertEqual(self.rootdir, self.state.gitroot)
+        self.assertEqual(os.path.join(self.rootdir, '.git'),
+                         self.state.gitdir)
+        self.assertEqual('Test Author', self.state.author)
+        self.assertEqual('Second commit', self.state.subject)
+
+    def test_changes(self):
+        self.assertEqual([('A', 'doc/c.xml'),
+                          ('D', 'doc/b.xml'),
+                          ('M', 'doc/a.xml'),
+                          ('R', 'doc/new name.xml')],
+                         sorted(self.state.changes))
+
+    def test_modified_files(self):
+        doc = os.path.join(self.rootdir, 'doc')
+        self.assertEqual(['a.xml', 'b.xml', 'c.xml', 'new name.xml'],
+                         sorted(self.state.modified_files(doc)))
+        self.assertEqual(['b.xml'], self.state.modified_files(doc, 'D'))
+        self.assertEqual([], self.state.modified_files(
+            os.path.join(self.rootdir, 'www')))
+
+    def test_touched(self):
+        self.assertFalse(self.state.www_touched())
+        self.assertFalse(self.state.only_po_touched())
+        self.assertEqual([], self.state.get_special_files())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from os_doc_tools import doctest
+from os_doc_tools import includegraph
+
+DOCBOOK = ('<%s xmlns="http://docbook.org/ns/docbook" '
+           'xmlns:xi="http://www.w3.org/2001/XInclude">%s</%s>')
+
+
+class IncludeGraphTestCase(unittest.TestCase):
+    """Tests for the include graph of a small tree of books.
+
+    Book a includes ch_a, which includes sec_b and is included by it
+    again. Book b includes the shared file common.xml. orphan1 and
+    orphan2, which orphan1 includes, are part of no book.
+    """
+
+    def setUp(self):
+        self.rootdir = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.rootdir)
+        self.write('a/pom.xml', '<project/>')
+        self.write('a/bk-a.xml', self.docbook('book', 'ch_a.xml',
+                                              '../common/common.xml'))
+        self.write('a/ch_a.xml', self.docbook('chapter', 'sec_b.xml'))
+        self.write('a/sec_b.xml', self.docbook('section', 'ch_a.xml'))
+        self.write('a/orphan1.xml', self.docbook('chapter', 'orphan2.xml'))
+        self.write('a/orphan2.xml', self.docbook('section'))
+        self.write('b/pom.xml', '<project/>')
+        self.write('b/bk-b.xml', self.docbook('book',
+                                              '../common/common.xml'))
+        self.write('common/common.xml', self.docbook('section'))
+        self.addCleanup(setattr, doctest, 'DOC_CACHE', doctest.DOC_CACHE)
+        doctest.DOC_CACHE = doctest.DocumentCache()
+        self.scan = doctest.scan_books(self.rootdir, [], [], [])
+
+    def docbook(self, tag, *hrefs):
+        return DOCBOOK % (tag, ''.join('<xi:include href="%s"/>' % href
+                                       for href in hrefs), tag)
+
+    def write(self, name, content):
+        path = os.path.join(self.rootdir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(content)
+
+    def path(self, name):
+        return os.path.join(self.rootdir, name)
+
+    def test_unused_files(self):
+        self.assertEqual([self.path('a/orphan1.xml'),
+                          self.path('a/orphan2.xml')],
+                         doctest.get_unused_files(self.scan))
+
+    def test_cycles(self):
+        self.assertEqual([[self.path('a/ch_a.xml'), self.path('a/sec_b.xml')]],
+                         includegraph.get_cycles(self.scan.get_includes()))
+
+    def test_self_include_is_cycle(self):
+        self.assertEqual([['x']], includegraph.get_cycles({'x': set(['x']),
+                                                           'y': set(['x'])}))
+
+    def test_book_files(self):
+        book_files = includegraph.get_book_files(self.scan,
+                                                 self.scan.get_includes())
+        self.assertEqual(set([self.path('a/bk-a.xml'),
+                              self.path('a/ch_a.xml'),
+                              self.path('a/sec_b.xml'),
+                              self.path('common/common.xml')]),
+                         book_files[self.path('a')])
+        self.assertEqual(set([self.path('b/bk-b.xml'),
+                              self.path('common/common.xml')]),
+                         book_files[self.path('b')])
+
+    def test_hotspots(self):
+        book_files = includegraph.get_book_files(self.scan,
+                                                 self.scan.get_includes())
+        hotspots = includegraph.get_hotspots(self.scan, book_files)
+        self.assertEqual((self.path('common/common.xml'), 2, 2),
+                         hotspots[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
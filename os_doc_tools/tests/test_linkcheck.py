@@ -0,0 +1,133 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import BaseHTTPServer
+import os
+import shutil
+import SocketServer
+import tempfile
+import threading
+import time
+import unittest
+
+from os_doc_tools import linkcheck
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answer requests depending on the path, record all requests.
+
+    /ok answers with 200, /no-head and /no-head-501 answer HEAD requests
+    with 405 and 501 and GET requests with 200, /slow answers after one
+    second, all other paths answer with 404.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def do_HEAD(self):
+        self.answer()
+
+    def do_GET(self):
+        self.answer()
+
+    def answer(self):
+        self.requests.append((self.command, self.path))
+        if self.path == '/ok':
+            status = 200
+        elif self.path == '/no-head':
+            status = 405 if self.command == 'HEAD' else 200
+        elif self.path == '/no-head-501':
+            status = 501 if self.command == 'HEAD' else 200
+        elif self.path == '/slow':
+            time.sleep(1)
+            status = 200
+        else:
+            status = 404
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class LinkCheckerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        StubHandler.requests = []
+        self.server = StubServer(('127.0.0.1', 0), StubHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def get_checker(self, **kwargs):
+        kwargs.setdefault('timeout', 0.2)
+        return linkcheck.LinkChecker(host_delay=0, **kwargs)
+
+    def test_head(self):
+        self.assertIsNone(self.get_checker().check_url(self.base + '/ok'))
+        self.assertEqual([('HEAD', '/ok')], StubHandler.requests)
+
+    def test_get_after_head_fails(self):
+        checker = self.get_checker()
+        self.assertIsNone(checker.check_url(self.base + '/no-head'))
+        self.assertIsNone(checker.check_url(self.base + '/no-head-501'))
+        self.assertEqual([('HEAD', '/no-head'), ('GET', '/no-head'),
+                          ('HEAD', '/no-head-501'), ('GET', '/no-head-501')],
+                         StubHandler.requests)
+
+    def test_not_found(self):
+        error = self.get_checker().check_url(self.base + '/missing')
+        self.assertEqual('unreachable', error.kind)
+        self.assertIn('404', str(error))
+
+    def test_timeout_is_reused_for_host(self):
+        checker = self.get_checker()
+        error = checker.check_url(self.base + '/slow')
+        self.assertEqual('invalid', error.kind)
+        self.assertIs(error, checker.check_url(self.base + '/ok'))
+        self.assertNotIn(('HEAD', '/ok'), StubHandler.requests)
+
+    def test_check(self):
+        urls = [self.base + '/ok', self.base + '/missing', self.base + '/ok']
+        results = self.get_checker(workers=2).check(urls)
+        self.assertIsNone(results[self.base + '/ok'])
+        self.assertEqual('unreachable', results[self.base + '/missing'].kind)
+        self.assertEqual(1, StubHandler.requests.count(('HEAD', '/ok')))
+
+    def test_cache(self):
+        cache_file = os.path.join(self.tmpdir, 'links.json')
+        url = self.base + '/ok'
+        self.get_checker(cache_file=cache_file).check([url])
+        checker = self.get_checker(cache_file=cache_file)
+        checker.check([url])
+        self.assertEqual(1, checker.cache_hits)
+        self.assertEqual(1, len(StubHandler.requests))
+
+        checker = self.get_checker(cache_file=cache_file, cache_ttl=0)
+        checker.check([url])
+        self.assertEqual(0, checker.cache_hits)
+        self.assertEqual(2, len(StubHandler.requests))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from lxml import etree
+
+from os_doc_tools import results
+
+
+class ResultsWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.junit_file = os.path.join(self.tmpdir, 'results.xml')
+        self.writer = results.ResultsWriter()
+        self.writer.open(junit_file=self.junit_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_failures(self):
+        self.writer.close()
+        return etree.parse(self.junit_file).findall('.//failure')
+
+    def test_unicode_message(self):
+        message = ("doc/a.xml:3: invalid unicode character '\xe2\x80\x8b' "
+                   "in 'a\xe2\x80\x8bb'")
+        self.writer.record('doc/a.xml', 'niceness', 'failed', message, 3)
+        self.writer.record('doc/a.xml', 'syntax', 'failed',
+                           u"doc/a.xml: \u2018bad\u2019 \x01element")
+        failures = self.get_failures()
+        self.assertEqual(1, len(failures))
+        self.assertEqual(message.decode('utf-8'), failures[0].get('message'))
+        self.assertIn(u"\u2018bad\u2019 element", failures[0].text)
+
+    def test_blank_message(self):
+        self.writer.record('doc/a.xml', 'links', 'failed', "\n  \nbroken")
+        self.writer.record('doc/b.xml', 'links', 'failed', "  ")
+        failures = self.get_failures()
+        self.assertEqual([u'broken', u'failed'],
+                         [f.get('message') for f in failures])
+
+
+if __name__ == '__main__':
+    unittest.main()
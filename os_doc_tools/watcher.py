@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''
+Watch a directory tree for changed files.
+
+The tree is scanned regularly and the modification time and size of
+each file are compared with the previous scan. Scanning only needs a
+stat call per file and works on every file system, including network
+file systems where inotify does not report changes.
+'''
+
+import os
+import time
+
+
+class FileWatcher(object):
+    """Detect files that were added, changed or removed below rootdir.
+
+    :param rootdir: directory to watch
+    :param filter_dirs: function that returns the list of directories
+                        to descend into for a list of directory names,
+                        None to descend into all directories
+    :param interval: seconds between two scans
+    :param settle_time: seconds to wait after a change was seen, changes
+                        done meanwhile are reported together, so that
+                        files are not reported while being written
+    """
+
+    def __init__(self, rootdir, filter_dirs=None, interval=0.5,
+                 settle_time=0.1):
+        self.rootdir = rootdir
+        self.filter_dirs = filter_dirs
+        self.interval = interval
+        self.settle_time = settle_time
+        self.files = self._scan()
+
+    def _scan(self):
+        """Return dictionary of all files with their stat key."""
+
+        files = {}
+        for root, dirs, names in os.walk(self.rootdir):
+            if self.filter_dirs is not None:
+                dirs[:] = self.filter_dirs(dirs)
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # Removed since listing the directory.
+                    continue
+                files[path] = (st.st_mtime, st.st_size)
+        return files
+
+    def poll(self):
+        """Return files changed since the last call.
+
+        Returns a tuple of the sorted lists of added or modified files
+        and of removed files.
+        """
+
+        files = self._scan()
+        changed = sorted(path for path, key in files.items()
+                         if self.files.get(path) != key)
+        removed = sorted(path for path in self.files if path not in files)
+        self.files = files
+        return changed, removed
+
+    def wait(self):
+        """Wait until files change, return them like poll."""
+
+        while True:
+            changed, removed = self.poll()
+            if changed or removed:
+                break
+            time.sleep(self.interval)
+
+        time.sleep(self.settle_time)
+        more_changed, more_removed = self.poll()
+        changed = sorted((set(changed) | set(more_changed)) -
+                         set(more_removed))
+        removed = sorted((set(removed) - set(more_changed)) |
+                         set(more_removed))
+        return changed, removed
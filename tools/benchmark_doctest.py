@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''
+Usage:
+    benchmark_doctest.py references PATH
+    benchmark_doctest.py profiling [--depth DEPTH] [--width WIDTH]
+                                   [--repeat REPEAT]
+    benchmark_doctest.py closure [--files FILES] [--books BOOKS]
+                                 [--ignore-dirs IGNORE_DIRS]
+                                 [--repeat REPEAT]
+
+Benchmarks for the implementation of openstack-doc-test.
+
+Commands:
+    references   Compare extraction of references with a full DOM,
+                 with etree.iterparse and with extract_references for
+                 all XML files below PATH, for example the doc directory
+                 of openstack-manuals.
+    profiling    Compare the check of profiling attributes with nested
+                 XPath queries against verify_profiling on a synthetic,
+                 deeply nested document with conflicting profiling.
+    closure      Compare the computation of affected books with list
+                 filtering of ignored directories and checks of each
+                 file name against generate_affected_books on a
+                 synthetic include graph.
+
+Every variant runs in its own process so that the reported peak memory
+usage is not influenced by other variants.
+'''
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import time
+
+from lxml import etree
+
+from os_doc_tools import doctest
+
+
+def find_xml_files(rootdir):
+    """Return list of all XML files below rootdir."""
+
+    xml_files = []
+    for root, dirs, files in os.walk(rootdir):
+        dirs[:] = doctest.filter_dirs(dirs)
+        for f in files:
+            if doctest.is_testable_xml_file(f, []):
+                xml_files.append(os.path.abspath(os.path.join(root, f)))
+    return xml_files
+
+
+def references_dom(path):
+    """Extract references with a full DOM as done before."""
+
+    return doctest.get_references(etree.parse(path), path)
+
+
+def references_iterparse(path):
+    """Extract references with etree.iterparse and element clearing."""
+
+    root = os.path.dirname(path)
+    references = []
+    for _, node in etree.iterparse(path, events=('end',),
+                                   tag=doctest.REFERENCE_TAGS):
+        reference = doctest.get_reference(node, root)
+        if reference is not None:
+            references.append(reference)
+        node.clear()
+        while node is not None:
+            while node.getprevious() is not None:
+                del node.getparent()[0]
+            node = node.getparent()
+    return references
+
+
+def references_extract(path):
+    """Extract references like openstack-doc-test does."""
+
+    return doctest.extract_references(path)
+
+
+def _run_variant(function, args, queue):
+    start = time.time()
+    function(*args)
+    elapsed = time.time() - start
+    queue.put((elapsed,
+               resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def run_variant(name, function, args, count, unit):
+    """Run function(*args) in a new process and print the results."""
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_variant,
+                                      args=(function, args, queue))
+    process.start()
+    elapsed, maxrss = queue.get()
+    process.join()
+    print("  %-12s %8.3f s %10.1f %s/s %8d KiB peak RSS"
+          % (name, elapsed, count / max(elapsed, 1e-9), unit, maxrss))
+
+
+def _extract_all(function, xml_files):
+    for path in xml_files:
+        try:
+            function(path)
+        except etree.XMLSyntaxError:
+            pass
+
+
+def benchmark_references(args):
+    xml_files = find_xml_files(args.path)
+    print("Extracting references of %d files:" % len(xml_files))
+    for name, function in (('dom', references_dom),
+                           ('iterparse', references_iterparse),
+                           ('extract', references_extract)):
+        run_variant(name, _extract_all, (function, xml_files),
+                    len(xml_files), 'files')
+
+
+def verify_attribute_profiling_xpath(doc, attribute, known_values):
+    """Check profiling with nested XPath queries as done before."""
+
+    msg = []
+    ns = {"docbook": "http://docbook.org/ns/docbook"}
+    path = '//docbook:*[@%s]' % attribute
+    for parent in doc.xpath(path, namespaces=ns):
+        p_tag = parent.tag
+        p_line = parent.sourceline
+        p_att_list = parent.attrib[attribute].split(';')
+
+        for att in p_att_list:
+            if att not in known_values:
+                msg.append(
+                    "'%s' is not a recognized %s profile on line %d." %
+                    (att, attribute, p_line))
+
+        cpath = './/docbook:*[@%s]' % attribute
+        for child in parent.xpath(cpath, namespaces=ns):
+            c_tag = child.tag
+            c_line = child.sourceline
+            c_att_list = child.attrib[attribute].split(';')
+            for att in c_att_list:
+                if att not in p_att_list:
+                    len_ns = len("{http://docbook.org/ns/docbook}")
+                    msg.append(
+                        "%s %s profiling (%s) conflicts with %s "
+                        "profiling of %s on line %d." %
+                        (p_tag[len_ns:], attribute, p_att_list,
+                         attribute, c_tag[len_ns:], c_line))
+    return msg
+
+
+def profiling_xpath(doc):
+    msg = []
+    for attribute, known_values in doctest.PROFILING_ATTRIBUTES:
+        msg.extend(verify_attribute_profiling_xpath(doc, attribute,
+                                                    known_values))
+    return msg
+
+
+def profiling_single_pass(doc):
+    try:
+        doctest.verify_profiling(doc)
+    except ValueError as e:
+        return str(e).split("\n     ")
+    return []
+
+
+def generate_profiled_doc(depth, width):
+    """Return document with nested sections and profiled paragraphs.
+
+    Every section has width subsections down to depth levels, all
+    sections are profiled for ubuntu and debian, every paragraph has
+    its own os and audience profiling.
+    """
+
+    lines = ['<chapter xmlns="http://docbook.org/ns/docbook" '
+             'os="ubuntu;debian" audience="enduser;installer">']
+
+    def add_section(level):
+        lines.append('<section os="ubuntu;debian">')
+        lines.append('<para os="%s" audience="%s">Text</para>' %
+                     (('ubuntu', 'debian', 'rhel')[level % 3],
+                      ('enduser', 'webpage')[level % 2]))
+        if level < depth:
+            for _ in range(width):
+                add_section(level + 1)
+        lines.append('</section>')
+
+    add_section(1)
+    lines.append('</chapter>')
+    return etree.fromstring("\n".join(lines)).getroottree()
+
+
+def _check_profiling(function, doc, repeat):
+    for _ in range(repeat):
+        function(doc)
+
+
+def benchmark_profiling(args):
+    doc = generate_profiled_doc(args.depth, args.width)
+    elements = sum(1 for _ in doc.iter())
+    old_msg = profiling_xpath(doc)
+    new_msg = profiling_single_pass(doc)
+    # The single pass reports the messages of all attributes, the
+    # XPath variant is called per attribute.
+    if old_msg != new_msg:
+        print("ERROR: messages differ!")
+    print("Checking profiling of %d elements with %d messages, %d times:"
+          % (elements, len(new_msg), args.repeat))
+    for name, function in (('xpath', profiling_xpath),
+                           ('single-pass', profiling_single_pass)):
+        run_variant(name, _check_profiling, (function, doc, args.repeat),
+                    args.repeat, 'docs')
+
+
+def closure_filtering(rootdir, book_bk, abs_ignore_dirs, included_by,
+                      modified_files):
+    """Compute affected books as done before."""
+
+    affected_books = set()
+    for idir in abs_ignore_dirs:
+        non_ignored_files = []
+        for f in modified_files:
+            if not f.startswith(idir):
+                non_ignored_files.append(f)
+        modified_files = non_ignored_files
+
+    new_files = modified_files
+    affected_files = set(modified_files)
+    while len(new_files) > 0:
+        new_files_to_check = new_files
+        new_files = []
+        for f in new_files_to_check:
+            if "doc/hot-guide/" in f:
+                affected_books.add('hot-guide')
+                continue
+            if doctest.is_book_master(os.path.basename(f)):
+                book_modified = book_bk[f]
+                if book_modified not in affected_books:
+                    affected_books.add(book_modified)
+                continue
+            if f not in included_by:
+                continue
+            for g in included_by[f]:
+                if g not in affected_files:
+                    new_files.append(g)
+                    affected_files.add(g)
+    return affected_books
+
+
+def generate_include_graph(rootdir, no_files, no_books, no_ignore_dirs):
+    """Return BookScan of a synthetic tree of books.
+
+    Every book has a book master file including chapters, chapters
+    include sections. A directory of common files is included by
+    sections of all books and the last book is the Heat Orchestration
+    Template guide.
+    """
+
+    rnd = random.Random(42)
+    scan = doctest.BookScan()
+    common = [os.path.join(rootdir, 'common', 'section_%04d.xml' % i)
+              for i in range(no_files // 50)]
+    files_per_book = (no_files - len(common)) // no_books
+    chapters_per_book = max(1, files_per_book // 25)
+
+    def include(target, source):
+        scan.included_by.setdefault(target, set()).add(source)
+
+    for b in range(no_books):
+        if b == no_books - 1:
+            book = os.path.join(rootdir, 'hot-guide')
+        else:
+            book = os.path.join(rootdir, 'book-%03d' % b)
+        scan.books.append(book)
+        master = os.path.join(book, 'bk-book.xml')
+        scan.add_file(master, book)
+        chapters = [os.path.join(book, 'ch_%03d.xml' % c)
+                    for c in range(chapters_per_book)]
+        for chapter in chapters:
+            scan.add_file(chapter, book)
+            include(chapter, master)
+        for i in range(files_per_book - chapters_per_book - 1):
+            section = os.path.join(book, 'section', 'section_%04d.xml' % i)
+            scan.add_file(section, book)
+            include(section, rnd.choice(chapters))
+            if rnd.random() < 0.05:
+                include(rnd.choice(common), section)
+    for path in common:
+        scan.add_file(path, None)
+    for i in range(no_ignore_dirs):
+        idir = os.path.join(rootdir, 'ignored-%03d' % i)
+        scan.abs_ignore_dirs.append(idir)
+        scan.ignored.add(idir)
+    return scan, common
+
+
+def _compute_closures(function, args, repeat):
+    for _ in range(repeat):
+        function(*args)
+
+
+def benchmark_closure(args):
+    rootdir = '/synthetic/doc'
+    scan, common = generate_include_graph(rootdir, args.files, args.books,
+                                          args.ignore_dirs)
+    rnd = random.Random(4711)
+    files = sorted(scan.metadata)
+    modified_files = (rnd.sample(files, max(1, len(files) // 100)) +
+                      rnd.sample(common, min(5, len(common))))
+
+    old = closure_filtering(rootdir, scan.book_bk, scan.abs_ignore_dirs,
+                            scan.included_by, modified_files)
+    new = doctest.generate_affected_books(rootdir, scan, modified_files)
+    if old != new:
+        print("ERROR: affected books differ!")
+    print("Computing affected books of %d modified files in a graph of "
+          "%d files with %d ignored directories, %d times:"
+          % (len(modified_files), len(files), args.ignore_dirs, args.repeat))
+    run_variant('filtering', _compute_closures,
+                (closure_filtering,
+                 (rootdir, scan.book_bk, scan.abs_ignore_dirs,
+                  scan.included_by, modified_files),
+                 args.repeat),
+                args.repeat, 'runs')
+    run_variant('metadata', _compute_closures,
+                (doctest.generate_affected_books,
+                 (rootdir, scan, modified_files),
+                 args.repeat),
+                args.repeat, 'runs')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks for openstack-doc-test.")
+    subparsers = parser.add_subparsers()
+
+    references = subparsers.add_parser(
+        'references', help="Compare extraction of references.")
+    references.add_argument('path', help="Directory with XML files.")
+    references.set_defaults(func=benchmark_references)
+
+    profiling = subparsers.add_parser(
+        'profiling', help="Compare checks of profiling attributes.")
+    profiling.add_argument('--depth', type=int, default=6,
+                           help="Nesting depth of sections.")
+    profiling.add_argument('--width', type=int, default=3,
+                           help="Number of subsections of each section.")
+    profiling.add_argument('--repeat', type=int, default=3,
+                           help="Number of checks of the document.")
+    profiling.set_defaults(func=benchmark_profiling)
+
+    closure = subparsers.add_parser(
+        'closure', help="Compare computations of affected books.")
+    closure.add_argument('--files', type=int, default=20000,
+                         help="Number of files in the include graph.")
+    closure.add_argument('--books', type=int, default=40,
+                         help="Number of books.")
+    closure.add_argument('--ignore-dirs', type=int, default=50,
+                         help="Number of ignored directories.")
+    closure.add_argument('--repeat', type=int, default=20,
+                         help="Number of computations.")
+    closure.set_defaults(func=benchmark_closure)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()